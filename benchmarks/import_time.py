@@ -0,0 +1,138 @@
+import argparse
+import json
+import subprocess
+import sys
+
+from pathlib import Path
+
+
+ROOT = Path(__file__).parent.parent
+BASELINE_PATH = Path(__file__).parent / "import_baseline.json"
+# the module each cli command imports before it runs
+COMMAND_MODULES = {
+    "cli": "src.cli",
+    "basic": "src.basic_assignment",
+    "optimise": "src.optimal_assignment",
+    "manual": "src.optimal_manual_assignment",
+    "incremental": "src.incremental_assignment",
+    "batch": "src.batch_assignment",
+    "serve": "src.service",
+    "export": "src.output",
+}
+# packages that are only imported inside the functions that need them. Any that
+# a bare `import pandas` loads, such as pyarrow on pandas 2.2 and later, are not
+# ours to defer so they are not checked
+DEFERRED_PACKAGES = {"gspread", "scipy", "pyarrow"}
+
+
+def time_import(module, repeat=5):
+    """
+    Imports `module` in a fresh interpreter with `python -X importtime`
+
+    Parameters
+    ----------
+    module: string
+        The module to import
+    repeat: int, optional
+        The number of interpreters to start. The fastest one is kept
+
+    Returns
+    -------
+    dict
+        "seconds", the cumulative import time of `module`, and "packages",
+        the top level packages it imported
+    """
+
+    best = None
+    for _ in range(repeat):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+
+        packages = set()
+        seconds = 0.0
+        # lines are "import time: <self us> | <cumulative us> | <indent><name>"
+        for line in result.stderr.splitlines():
+            if not line.startswith("import time:") or "cumulative" in line:
+                continue
+            _, cumulative, name = line[len("import time:") :].split("|")
+            packages.add(name.strip().split(".")[0])
+            if name.strip() == module:
+                seconds = int(cumulative) / 1e6
+
+        if best is None or seconds < best["seconds"]:
+            best = {"seconds": seconds, "packages": sorted(packages)}
+
+    return best
+
+
+def compare_results(results, baseline, tolerance=0.25):
+    """
+    Compares import times with a baseline run
+
+    Returns
+    -------
+    list of str
+        One line per command that is more than `tolerance` slower than in the
+        baseline
+    """
+
+    regressions = []
+    for command, run in results["commands"].items():
+        previous = baseline["commands"].get(command, {}).get("seconds")
+        if previous and run["seconds"] > previous * (1 + tolerance):
+            regressions.append(
+                f"{command}: {run['seconds']:.3f}s vs {previous:.3f}s in the baseline"
+            )
+
+    return regressions
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description="Time the imports of each command in a fresh interpreter"
+    )
+    parser.add_argument(
+        "commands", nargs="*", default=list(COMMAND_MODULES), help="commands to time"
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", type=Path, help="write the results here")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args(args)
+
+    results = {"python": sys.version.split()[0], "commands": {}}
+    problems = []
+    checked = DEFERRED_PACKAGES.difference(time_import("pandas", 1)["packages"])
+    for command in args.commands:
+        run = time_import(COMMAND_MODULES[command], args.repeat)
+        results["commands"][command] = run
+
+        deferred = sorted(checked.intersection(run["packages"]))
+        print(f"{command:<12} {run['seconds']:>7.3f}s {' '.join(deferred)}")
+        if deferred:
+            problems.append(f"{command}: imports {', '.join(deferred)} at startup")
+
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2))
+
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps(results, indent=2))
+    elif args.baseline.exists():
+        problems += compare_results(
+            results, json.loads(args.baseline.read_text()), args.tolerance
+        )
+
+    for problem in problems:
+        print("REGRESSION:", problem)
+
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
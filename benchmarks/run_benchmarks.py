@@ -0,0 +1,267 @@
+import argparse
+import json
+import platform
+import time
+import tracemalloc
+
+import src.basic_assignment as ba
+
+from benchmarks.synthetic import make_precincts, make_responses
+from pathlib import Path
+from src.config import load_config
+from src.metrics import get_assignment_metrics
+from src.optimal_assignment import OBSERVER_COLUMNS, optimise_buckets
+
+
+# timings depend on the machine, so the baseline is not committed. Create it on
+# the machine the checks run on with --save-baseline
+BASELINE_PATH = Path(__file__).parent / "baseline.json"
+DEFAULT_SIZES = [100, 1000, 10000, 100000]
+
+
+def time_stage(function, *args, **kwargs):
+    """
+    Calls `function` once, tracking its wall clock time and the peak memory
+    allocated while it runs
+
+    Returns
+    -------
+    result:
+        Whatever `function` returns
+    stage: dict
+        "seconds" and "peak_mb"
+    """
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        result = function(*args, **kwargs)
+        seconds = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return result, {"seconds": seconds, "peak_mb": peak / 2 ** 20}
+
+
+def get_quality(precinct, observers):
+    """
+    The number of filled slots and the total travel distance of an assignment
+    """
+
+    return {
+        "filled": int((precinct[OBSERVER_COLUMNS] != "").values.sum()),
+        "distance": get_assignment_metrics(precinct, observers)["distance"]["all"][
+            "total"
+        ],
+    }
+
+
+def run_benchmark(
+    n_observers,
+    n_precincts=None,
+    seed=0,
+    method="ttc",
+    n_candidates=None,
+    max_memory_mb=None,
+    config=None,
+    compare=(),
+):
+    """
+    Times each pipeline stage on synthetic data
+
+    Parameters
+    ----------
+    n_observers: int
+        The number of form responses
+    n_precincts: int, optional
+        The number of polling places. Defaults to half the observers
+    seed: int, optional
+        Seed for the synthetic data
+    method, n_candidates, max_memory_mb:
+        Passed on to `optimise_assignment`
+    config: Config, optional
+        The loaded config. See `src.config.load_config`
+    compare: list of str, optional
+        Other optimiser methods to run on the same basic assignment. Each is
+        timed as stage "optimise_buckets.<method>"
+
+    Returns
+    -------
+    dict
+        The sizes, the travel distance after optimisation, for each stage,
+        "seconds" and "peak_mb", and for `method` and each method in
+        `compare`, the filled slots and total distance of its assignment
+    """
+
+    if config is None:
+        config = load_config()
+    n_precincts = n_precincts or max(n_observers // 2, 1)
+
+    responses = make_responses(n_observers, config.valid_post_codes, seed)
+    precinct = make_precincts(n_precincts, config.valid_post_codes, seed)
+
+    stages = {}
+    observers, stages["prepare_observer_dataset"] = time_stage(
+        ba.prepare_observer_dataset, responses, config
+    )
+    (precinct, observers), stages["run_ordered_assignment"] = time_stage(
+        ba.run_ordered_assignment, precinct, observers, config
+    )
+    options = {
+        "n_workers": 1,
+        "n_candidates": n_candidates,
+        "max_memory_mb": max_memory_mb,
+        "locations": config.locations,
+        "objective": config.objective,
+    }
+    optimised, stages["optimise_buckets"] = time_stage(
+        optimise_buckets, precinct, observers, method=method, **options
+    )
+    methods = {method: get_quality(optimised, observers)}
+    for other in compare:
+        compared, stages[f"optimise_buckets.{other}"] = time_stage(
+            optimise_buckets, precinct, observers, method=other, **options
+        )
+        methods[other] = get_quality(compared, observers)
+
+    _, stages["get_lbj_csv"] = time_stage(ba.get_lbj_csv, optimised, observers, config)
+
+    return {
+        "n_observers": n_observers,
+        "n_precincts": n_precincts,
+        "n_assigned": int(
+            (precinct[["inside_observer", "outside_am_observer"]] != "").values.sum()
+        ),
+        "stages": stages,
+        "distance": get_assignment_metrics(optimised, observers)["distance"]["all"],
+        "methods": methods,
+    }
+
+
+def compare_results(results, baseline, tolerance=0.25):
+    """
+    Compares benchmark results with a baseline run
+
+    Parameters
+    ----------
+    results, baseline: dict
+        As written by `main`
+    tolerance: float, optional
+        How much slower (or bigger) than the baseline a stage can be before
+        it is reported as a regression
+
+    Returns
+    -------
+    list of str
+        One line per regression
+    """
+
+    baseline_runs = {run["n_observers"]: run for run in baseline["runs"]}
+
+    regressions = []
+    for run in results["runs"]:
+        baseline_run = baseline_runs.get(run["n_observers"])
+        if baseline_run is None:
+            continue
+        for stage, measures in run["stages"].items():
+            baseline_measures = baseline_run["stages"].get(stage)
+            if baseline_measures is None:
+                continue
+            for measure, value in measures.items():
+                previous = baseline_measures[measure]
+                if previous > 0 and value > previous * (1 + tolerance):
+                    regressions.append(
+                        f"{run['n_observers']} observers, {stage}: {measure} "
+                        f"{value:.3f} vs {previous:.3f} in the baseline"
+                    )
+
+    return regressions
+
+
+def main(args=None):
+    """
+    Runs the benchmarks and compares them with the baseline, if there is one.
+    Returns 1 if any stage regressed
+    """
+
+    parser = argparse.ArgumentParser(
+        description="Time the assignment pipeline on synthetic data"
+    )
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--method", default="ttc")
+    parser.add_argument(
+        "--compare",
+        nargs="+",
+        default=[],
+        help="other optimiser methods to time and score against --method",
+    )
+    parser.add_argument("--n-candidates", type=int)
+    parser.add_argument("--max-memory-mb", type=float, default=512)
+    parser.add_argument("--output", type=Path, help="write the results here")
+    parser.add_argument(
+        "--baseline",
+        type=Path,
+        default=BASELINE_PATH,
+        help="results to compare with, written by --save-baseline",
+    )
+    parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help="store the results as the baseline instead of comparing them",
+    )
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args(args)
+
+    config = load_config()
+    results = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "method": args.method,
+        "n_candidates": args.n_candidates,
+        "max_memory_mb": args.max_memory_mb,
+        "runs": [],
+    }
+    for size in args.sizes:
+        run = run_benchmark(
+            size,
+            seed=args.seed,
+            method=args.method,
+            n_candidates=args.n_candidates,
+            max_memory_mb=args.max_memory_mb,
+            config=config,
+            compare=args.compare,
+        )
+        results["runs"].append(run)
+        for stage, measures in run["stages"].items():
+            print(
+                f"{size:>7} {stage:<26} {measures['seconds']:>9.3f}s "
+                f"{measures['peak_mb']:>9.1f}MB"
+            )
+        for method, quality in run["methods"].items():
+            print(
+                f"{size:>7} {method:<26} {quality['filled']:>9} filled "
+                f"{quality['distance']:>12.0f} distance"
+            )
+
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2))
+
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps(results, indent=2))
+    elif args.baseline.exists():
+        regressions = compare_results(
+            results, json.loads(args.baseline.read_text()), args.tolerance
+        )
+        for regression in regressions:
+            print("REGRESSION:", regression)
+        return 1 if regressions else 0
+    else:
+        print(f"No baseline at {args.baseline}, run with --save-baseline to create it")
+
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,154 @@
+import numpy as np
+import pandas as pd
+
+from src.basic_assignment import PRECINCT_ASSIGNMENT_COLUMNS
+from src.distance import load_gazetteer
+
+
+# share of observers choosing each election day option on the form
+ELECTION_DAY_MIX = {
+    "Inside": 0.35,
+    "Outside AM": 0.2,
+    "Outside PM": 0.2,
+    "Outside All Day": 0.2,
+    "NA": 0.05,
+}
+
+
+def get_zip_weights(zips, rng):
+    """
+    A skewed distribution over zip codes, a few zip codes have most of the
+    people the way a county's population does
+    """
+
+    weights = 1 / np.arange(1, len(zips) + 1)
+    rng.shuffle(weights)
+
+    return weights / weights.sum()
+
+
+def make_responses(
+    n_observers,
+    valid_post_codes,
+    seed=0,
+    legal_share=0.2,
+    from_county_share=0.9,
+    election_day_mix=None,
+):
+    """
+    Synthetic observer form responses with the columns of `columns_map`, as
+    returned by `get_sheet_columns`. All values are strings, like the sheet.
+
+    Parameters
+    ----------
+    n_observers: int
+        The number of responses
+    valid_post_codes: iterable of int
+        The zip codes in the county, see `Config.valid_post_codes`
+    seed: int, optional
+        Seed for the random generator. The same seed gives the same responses
+    legal_share: float, optional
+        Share of observers with a legal background
+    from_county_share: float, optional
+        Share of observers living in one of `valid_post_codes`. The others
+        live elsewhere in North Carolina
+    election_day_mix: dict, optional
+        Election day option -> share. Defaults to ELECTION_DAY_MIX
+
+    Returns
+    -------
+    pd.DataFrame
+    """
+
+    rng = np.random.default_rng(seed)
+    election_day_mix = election_day_mix or ELECTION_DAY_MIX
+
+    county_zips = np.array(sorted(valid_post_codes))
+    other_zips = np.setdiff1d(load_gazetteer().index.values, county_zips)
+
+    from_county = rng.random(n_observers) < from_county_share
+    post_code = pd.Series(
+        np.where(
+            from_county,
+            rng.choice(county_zips, n_observers, p=get_zip_weights(county_zips, rng)),
+            rng.choice(other_zips, n_observers),
+        )
+    ).astype(str)
+    # some people give their zip+4
+    plus_four = rng.random(n_observers) < 0.05
+    suffix = rng.integers(1000, 9999, plus_four.sum()).astype(str)
+    post_code[plus_four] = post_code[plus_four] + "-" + suffix
+
+    ids = np.char.zfill(np.arange(n_observers).astype(str), 6)
+    date_entered = pd.Timestamp("2020-09-01") + pd.to_timedelta(
+        np.sort(rng.integers(0, 60 * 24 * 3600, n_observers)), unit="s"
+    )
+
+    return pd.DataFrame(
+        {
+            "name": np.char.add("Observer ", ids),
+            "phone_number": np.char.add("(919) 555-", ids),
+            "date_entered": date_entered.strftime("%m/%d/%Y %H:%M:%S"),
+            "election_day": rng.choice(
+                list(election_day_mix),
+                n_observers,
+                p=np.array(list(election_day_mix.values()))
+                / sum(election_day_mix.values()),
+            ),
+            "legal_background": np.where(
+                rng.random(n_observers) < legal_share, "Yes", "No"
+            ),
+            "post_code": post_code.values,
+            "comments": "",
+            "is_rover": np.where(rng.random(n_observers) < 0.02, "1", "0"),
+            "ev_2020_experience": np.where(rng.random(n_observers) < 0.3, "1", "0"),
+            "email": np.char.add(np.char.add("observer", ids), "@example.com"),
+        },
+        dtype=object,
+    )
+
+
+def make_precincts(n_precincts, valid_post_codes, seed=0):
+    """
+    Synthetic polling places with the columns of PollingPlaceDetails.xls, as
+    returned by `get_precinct_dataset`
+
+    Parameters
+    ----------
+    n_precincts: int
+        The number of polling places
+    valid_post_codes: iterable of int
+        The zip codes in the county, see `Config.valid_post_codes`
+    seed: int, optional
+        Seed for the random generator. The same seed gives the same precincts
+
+    Returns
+    -------
+    pd.DataFrame
+        Sorted by "Priority", with empty assignment columns
+    """
+
+    rng = np.random.default_rng(seed + 1)
+
+    county_zips = np.array(sorted(valid_post_codes))
+    ids = np.char.zfill(np.arange(n_precincts).astype(str), 5)
+
+    precinct = pd.DataFrame(
+        {
+            "Pct": np.char.add("P", ids),
+            "Polling Place Name": np.char.add("Polling Place ", ids),
+            "Address": np.char.add(ids, " Main St"),
+            "City": "Raleigh",
+            "State": "NC",
+            "Zip": rng.choice(
+                county_zips, n_precincts, p=get_zip_weights(county_zips, rng)
+            ).astype("int64"),
+            "Priority": rng.permutation(n_precincts).astype("int64") + 1,
+        }
+    )
+    for column in ["Pct", "Polling Place Name", "Address", "City", "State"]:
+        precinct[column] = precinct[column].astype(object)
+    for column in PRECINCT_ASSIGNMENT_COLUMNS:
+        precinct[column] = ""
+
+    return precinct.sort_values("Priority")
@@ -1,22 +1,54 @@
-import gspread
+import argparse
+import logging
 import pandas as pd
 import numpy as np
-import yaml
-import re
+import time
 
 from pathlib import Path
+from src.cache import (
+    get_file_hash,
+    get_file_stat,
+    get_path_key,
+    load_snapshot,
+    save_snapshot,
+)
+from src.config import add_config_arguments, load_config, load_run_config
+from src.instrumentation import get_report, reporting, timed, timer
+from src.interning import NameIndex
+from src.local_sheet import rowcol_to_a1
+from src.metrics import get_assignment_metrics
+from src.output import OUTPUT_DIR, write_outputs
+
+logger = logging.getLogger(__name__)
+
+OBSERVER_SNAPSHOT_PATH = (
+    Path(__file__).parent / "../data/00_raw/observer_responses.parquet"
+)
+PRECINCT_PATH = Path(__file__).parent / "../data/00_raw/PollingPlaceDetails.xls"
+PRECINCT_CACHE_DIR = Path(__file__).parent / "../data/00_raw/cache"
+EXPORT_CHUNK_SIZE = 50_000
+# columns of every saved response that are checked against the sheet on refresh
+SNAPSHOT_KEY_COLUMNS = ["date_entered", "email"]
+
+PRECINCT_TEXT_COLUMNS = ["Pct", "Polling Place Name", "Address", "City", "State"]
+PRECINCT_NUMERIC_COLUMNS = ["Zip", "Priority"]
+PRECINCT_ASSIGNMENT_COLUMNS = [
+    "inside_observer",
+    "inside_legal",
+    "outside_am_observer",
+    "outside_am_legal",
+    "outside_pm_observer",
+    "outside_pm_legal",
+]
 
 
 def load_yaml_config():
     """
-    Loads the config yaml file
+    Loads the config yaml file. The parsed config is cached until the file
+    changes, see `src.config.load_config`
     """
 
-    file_name = Path(__file__).parent / "../config/parameters.yml"
-    with file_name.open() as params_file:
-        params = yaml.full_load(params_file)
-
-    return params
+    return load_config()
 
 
 def add_availability_columns(observers_df):
@@ -37,17 +69,54 @@ def add_availability_columns(observers_df):
     return observers_df
 
 
-def clean_observer_df(observers_df):
+def get_entry_order(observers_df):
+    """
+    The parsed `date_entered` of each response as an int64 array, with
+    responses without a valid date treated as the oldest
+    """
+
+    date_entered = pd.to_datetime(observers_df["date_entered"], errors="coerce")
+
+    return date_entered.fillna(pd.Timestamp.min).values.astype("int64")
+
+
+def clean_observer_df(
+    observers_df, config=None, return_rejects=False, drop_duplicates=True
+):
     """
     Cleans and formats observers dataframe
+
+    Parameters
+    ----------
+    observers_df: pd.DataFrame
+        The raw observer form responses
+    config: Config, optional
+        The loaded config. See `src.config.load_config`
+    return_rejects: bool, optional
+        Also return the rows that were dropped because of invalid values
+    drop_duplicates: bool, optional
+        Only keep the latest response, by `date_entered`, for each name and
+        then for each email
+
+    Returns
+    -------
+    observers_df: pd.DataFrame
+        The cleaned observers
+    rejects: pd.DataFrame
+        Only if `return_rejects`. The raw rows that could not be cleaned with
+        a "reject_reason" column
     """
 
-    valid_post_codes = load_yaml_config()["valid_post_codes"]
+    if config is None:
+        config = load_config()
+    valid_post_codes = config.valid_post_codes
 
     # clean phone number
     observers_df["phone_number"] = (
-        observers_df["phone_number"].apply(lambda x: re.sub("[^0-9]", "", x))
-        # observers_df["phone_number"].str.replace("-", "").replace(" ", "")
+        observers_df["phone_number"]
+        .fillna("")
+        .astype(str)
+        .str.replace("[^0-9]", "", regex=True)
     )
 
     # clean name by removing spaces at the end
@@ -64,213 +133,720 @@ def clean_observer_df(observers_df):
         "is_rover", axis=1
     )
 
-    # clean post-codes - keep to first 5 and cast as int
-    observers_df["post_code"] = (
-        observers_df["post_code"].astype(str).apply(lambda x: int(x.split("-")[0]))
+    # clean post-codes - keep the digits before any "-" and cast as int
+    post_code = (
+        observers_df["post_code"]
+        .astype(str)
+        .str.extract(r"^\s*(\d{1,9})\s*(?:-.*)?$", expand=False)
+        .astype("Int32")
     )
-    observers_df["from_county"] = False
-    observers_df.loc[
-        observers_df.post_code.isin(valid_post_codes), "from_county"
-    ] = True
+    invalid_post_code = post_code.isna()
+    rejects = observers_df.loc[invalid_post_code].assign(reject_reason="post_code")
 
-    # drop duplicates
-    observers_df = observers_df.sort_values("date_entered")
-    observers_df = observers_df.drop_duplicates(["name"], keep="last")
-    observers_df = observers_df.drop_duplicates(["email"], keep="last")
+    observers_df = observers_df.loc[~invalid_post_code]
+    # no missing values are left so use a plain integer column
+    observers_df["post_code"] = post_code[~invalid_post_code].astype("int32")
+    observers_df["from_county"] = observers_df.post_code.isin(valid_post_codes)
+
+    observers_df["election_day"] = observers_df["election_day"].astype("category")
+
+    # drop duplicates. Dates are compared parsed, as "10/10/2020" sorts before
+    # "10/9/2020" as text
+    if drop_duplicates:
+        order = np.argsort(get_entry_order(observers_df), kind="stable")
+        observers_df = observers_df.iloc[order]
+        observers_df = observers_df.drop_duplicates(["name"], keep="last")
+        observers_df = observers_df.drop_duplicates(["email"], keep="last")
 
     # map legal background as boolean
     observers_df["legal_background"] = observers_df["legal_background"] == "Yes"
 
+    if return_rejects:
+        return observers_df, rejects
     return observers_df
 
 
-def get_observer_dataset():
+# google api status codes that are worth retrying: rate limits and server errors
+RETRY_STATUS_CODES = {429, 500, 502, 503}
+
+
+def call_with_backoff(request, max_retries=5, backoff_seconds=1.0):
     """
-    Loads the google sheets observer forms and returns a dataframe with
-    important columns. Adds additional columns and cleans data
+    Calls `request` retrying with exponential backoff if the google api
+    rate limits us or has a transient error. Errors are recognised by the
+    status code of their response, as on `gspread.exceptions.APIError`, so
+    gspread is only imported by the worksheets that need it.
     """
 
-    gc = gspread.oauth()
-    config = load_yaml_config()
-    params = config["columns_map"]
+    for attempt in range(max_retries + 1):
+        try:
+            return request()
+        except Exception as error:
+            response = getattr(error, "response", None)
+            status_code = getattr(response, "status_code", None)
+            if status_code not in RETRY_STATUS_CODES or attempt == max_retries:
+                raise
+            time.sleep(backoff_seconds * 2 ** attempt)
+
 
-    sh = gc.open(config["observer_google_sheet"])
+def get_sheet_blocks(worksheet, blocks, n_rows, max_retries=5, backoff_seconds=1.0):
+    """
+    Fetches several blocks of columns of the worksheet in a single request
 
-    required_length = sh.sheet1.row_count
+    Parameters
+    ----------
+    worksheet: gspread.Worksheet
+        The observer form responses
+    blocks: list of tuple
+        (columns_map, first_row) for each block. Rows `first_row` to `n_rows`
+        of the columns in `columns_map` are fetched
+    n_rows: int
+        The last row to fetch. Shorter columns are padded with their
+        "fill_missing" value
+    max_retries: int, optional
+        Number of times to retry if rate limited
+    backoff_seconds: float, optional
+        Wait before the first retry. Doubles on each retry
 
-    all_columns = {
-        "assigned_am": np.nan,
-        "assigned_pm": np.nan,
-    }
+    Returns
+    -------
+    list of pd.DataFrame
+        One per block, with one column per entry in its `columns_map`
+    """
 
-    for column_name, column_params in params.items():
-        column_data = sh.sheet1.col_values(column_params["col_num"])[1:]
-        column_data += [column_params["fill_missing"]] * (
-            required_length - len(column_data)
+    ranges = [
+        "{}:{}".format(
+            rowcol_to_a1(first_row, column_params["col_num"]),
+            rowcol_to_a1(n_rows, column_params["col_num"]),
         )
+        for columns_map, first_row in blocks
+        if n_rows >= first_row
+        for column_params in columns_map.values()
+    ]
+    value_ranges = iter(
+        call_with_backoff(
+            lambda: worksheet.batch_get(ranges, major_dimension="COLUMNS"),
+            max_retries,
+            backoff_seconds,
+        )
+        if ranges
+        else []
+    )
 
-        all_columns[column_name] = column_data
+    frames = []
+    for columns_map, first_row in blocks:
+        n_fetched = max(n_rows - first_row + 1, 0)
+        if n_fetched == 0:
+            frames.append(
+                pd.DataFrame(
+                    {column_name: [] for column_name in columns_map}, dtype=object
+                )
+            )
+            continue
 
-    observer_df = pd.DataFrame(all_columns)
-    observer_df = add_availability_columns(observer_df)
-    observer_df = clean_observer_df(observer_df)
-    observer_df = observer_df.sort_values(
-        ["ev_2020_experience", "outside_all_day"], ascending=False
-    )
+        columns = {}
+        for column_name, column_params in columns_map.items():
+            values = next(value_ranges)
+            column = pd.Series(values[0] if values else [], dtype=object)
+            column = column.reindex(pd.RangeIndex(n_fetched))
+            if column_params["fill_missing"] is not None:
+                column = column.fillna(column_params["fill_missing"])
+            columns[column_name] = column
+        frames.append(pd.DataFrame(columns))
 
-    return observer_df
+    return frames
 
 
-def get_precinct_dataset():
+def get_sheet_columns(
+    worksheet, columns_map, n_rows, first_row=2, max_retries=5, backoff_seconds=1.0
+):
     """
-    Load precinct excel sheet. Note that it much define "Priority" column
+    Fetches rows `first_row` to `n_rows` of the mapped columns of the
+    worksheet in a single request
+
+    Parameters
+    ----------
+    worksheet: gspread.Worksheet
+        The observer form responses
+    columns_map: dict
+        Column name -> dict with "col_num" and "fill_missing"
+    n_rows: int
+        The last row to fetch. Shorter columns are padded with their
+        "fill_missing" value
+    first_row: int, optional
+        The first row to fetch. Defaults to the first row after the header
+    max_retries: int, optional
+        Number of times to retry if rate limited
+    backoff_seconds: float, optional
+        Wait before the first retry. Doubles on each retry
+
+    Returns
+    -------
+    pd.DataFrame
+        One column per entry in `columns_map`
     """
 
-    precinct = pd.read_excel(
-        Path(__file__).parent / "../data/00_raw/PollingPlaceDetails.xls"
+    (columns,) = get_sheet_blocks(
+        worksheet, [(columns_map, first_row)], n_rows, max_retries, backoff_seconds
     )
-    precinct = precinct.sort_values("Priority")
-    precinct = precinct.fillna("")
-    return precinct
+
+    return columns
 
 
-def get_available_observers(
-    observers_df, n_required, location, need_legal_background, need_from_county
+def refresh_observer_snapshot(
+    worksheet,
+    columns_map,
+    path=OBSERVER_SNAPSHOT_PATH,
+    full=False,
+    max_retries=5,
+    backoff_seconds=1.0,
 ):
     """
-    Get available observers that can be assigned to precincts
+    Updates the local snapshot of the observer form responses with the rows
+    appended to the sheet since it was last saved, or the whole sheet if the
+    saved rows have changed
 
     Parameters
     ----------
-    observer_df: pd.DataFrame
-        The observers dataframe
-    n_required: int
-        The number of observers required. This is the maximum that will be returned. If
-        there are few that these available, it will be padded with np.nan
-    location: string
-        Must be one of "inside_all_day", "outside_AM", "outside_PM", "outside_all_day"
-    need_legal_background: bool
-        If observer must have legal expertise
-    need_from_county: bool
-        If observer must be from the county
+    worksheet: gspread.Worksheet
+        The observer form responses
+    columns_map: dict
+        Column name -> dict with "col_num" and "fill_missing"
+    path: str or Path, optional
+        The snapshot parquet file
+    full: bool, optional
+        Re-download the whole sheet instead of only the new rows
+    max_retries: int, optional
+        Number of times to retry if rate limited
+    backoff_seconds: float, optional
+        Wait before the first retry. Doubles on each retry
 
     Returns
     -------
-    available_names: np.array
-        An array of available observer names to assign to precincts
+    pd.DataFrame
+        All the responses, as returned by `get_sheet_columns`
 
     Note
     ----
-    SIDE EFFECT ALERT: Once observers are returned, they are also marked in the
-    observers_df as no longer being free.
+    The snapshot stores the number of rows fetched and the latest
+    `date_entered`. Along with the new rows, the SNAPSHOT_KEY_COLUMNS of
+    every row are fetched in the same request and compared with the
+    snapshot. If a saved row was deleted, moved or resubmitted through the
+    form, which changes its `date_entered`, the keys no longer line up and the
+    whole sheet is fetched again. So is it if the columns have changed or any
+    new row is not newer than the latest one we have. Cells typed into the
+    sheet by hand outside the key columns are only picked up by `full`, or
+    the "sheet" mode of `get_observer_dataset`.
+    """
+
+    snapshot, watermark = (None, None) if full else load_snapshot(path)
+    if snapshot is not None and watermark.get("columns") != list(columns_map):
+        snapshot = None
+
+    if snapshot is None:
+        first_row = 2
+        blocks = [(columns_map, first_row)]
+    else:
+        first_row = watermark["n_rows"] + 2
+        key_map = {
+            column: columns_map[column]
+            for column in SNAPSHOT_KEY_COLUMNS
+            if column in columns_map
+        }
+        blocks = [(key_map, 2), (columns_map, first_row)]
+
+    *keys, new_rows = get_sheet_blocks(
+        worksheet, blocks, worksheet.row_count, max_retries, backoff_seconds
+    )
+
+    if snapshot is not None:
+        saved_keys = snapshot[list(key_map)].fillna("").astype(str).values
+        sheet_keys = keys[0].iloc[: len(snapshot)].fillna("").astype(str).values
+        if sheet_keys.shape != saved_keys.shape or (sheet_keys != saved_keys).any():
+            return refresh_observer_snapshot(
+                worksheet, columns_map, path, True, max_retries, backoff_seconds
+            )
 
-    #TODO: Fix this side effect
+    # drop the empty rows at the bottom of the sheet
+    entered = new_rows["date_entered"].notna() & (new_rows["date_entered"] != "")
+    new_rows = new_rows.iloc[: entered[::-1].idxmax() + 1 if entered.any() else 0]
+    new_rows = new_rows.where(new_rows.isna(), new_rows.astype(str))
+
+    date_entered = pd.to_datetime(new_rows["date_entered"], errors="coerce")
+    latest = date_entered.max()
+
+    if snapshot is not None:
+        if len(new_rows) == 0:
+            return snapshot
+
+        previous_latest = pd.Timestamp(watermark["date_entered"])
+        if (date_entered <= previous_latest).any():
+            return refresh_observer_snapshot(
+                worksheet, columns_map, path, True, max_retries, backoff_seconds
+            )
+
+        responses = pd.concat([snapshot, new_rows], ignore_index=True)
+        latest = max(latest, previous_latest) if pd.notna(latest) else previous_latest
+    else:
+        responses = new_rows
+
+    save_snapshot(
+        responses,
+        path,
+        columns=list(columns_map),
+        date_entered=None if pd.isna(latest) else latest.isoformat(),
+    )
+
+    return responses
+
+
+@timed("load_observers")
+def get_observer_dataset(
+    config=None, mode="sheet", snapshot_path=None, export_path=None, worksheet=None
+):
+    """
+    Loads the google sheets observer forms and returns a dataframe with
+    important columns. Adds additional columns and cleans data
+
+    Parameters
+    ----------
+    config: Config, optional
+        The loaded config. See `src.config.load_config`
+    mode: string, optional
+        Where to get the responses from. One of:
+            "sheet" - download the whole sheet (default)
+            "refresh" - download only new rows and update the local snapshot
+            "offline" - only use the local snapshot
+            "export" - stream a CSV or Parquet export of the responses
+    snapshot_path: str or Path, optional
+        The snapshot parquet file. Defaults to OBSERVER_SNAPSHOT_PATH
+    export_path: str or Path, optional
+        The export to read in "export" mode, see `read_observer_export`
+    worksheet: gspread.Worksheet, optional
+        Read the responses from this worksheet in "sheet" and "refresh" mode
+        instead of opening the google sheet, e.g. a
+        `src.local_sheet.LocalWorksheet`
     """
 
-    if location == "outside_AM":
-        assignment_cols = ["assigned_am"]
-    elif location == "outside_PM":
-        assignment_cols = ["assigned_pm"]
+    if config is None:
+        config = load_config()
+    params = config.columns_map
+    snapshot_path = snapshot_path or OBSERVER_SNAPSHOT_PATH
+
+    if mode == "export":
+        if export_path is None:
+            raise ValueError("export_path is needed in export mode")
+        return read_observer_export(export_path, config)
+    elif mode == "offline":
+        responses, _ = load_snapshot(snapshot_path)
+        if responses is None:
+            raise FileNotFoundError(f"No observer snapshot at {snapshot_path}")
+    elif mode in ("sheet", "refresh"):
+        retry = config.sheet_fetch
+
+        if worksheet is None:
+            import gspread
+
+            gc = gspread.oauth()
+            sh = call_with_backoff(
+                lambda: gc.open(config.observer_google_sheet),
+                retry["max_retries"],
+                retry["backoff_seconds"],
+            )
+            worksheet = call_with_backoff(
+                lambda: sh.sheet1, retry["max_retries"], retry["backoff_seconds"]
+            )
+
+        if mode == "sheet":
+            responses = get_sheet_columns(
+                worksheet,
+                params,
+                worksheet.row_count,
+                2,
+                retry["max_retries"],
+                retry["backoff_seconds"],
+            )
+        else:
+            responses = refresh_observer_snapshot(
+                worksheet,
+                params,
+                snapshot_path,
+                False,
+                retry["max_retries"],
+                retry["backoff_seconds"],
+            )
     else:
-        assignment_cols = ["assigned_pm", "assigned_am"]
+        raise ValueError(f"Unknown observer dataset mode: {mode}")
+
+    return prepare_observer_dataset(responses, config)
+
+
+def clean_responses(responses, config=None, drop_duplicates=True):
+    """
+    Adds the assignment and availability columns to raw form responses and
+    cleans them, see `clean_observer_df`
+
+    Returns
+    -------
+    observer_df: pd.DataFrame
+    rejects: pd.DataFrame
+    """
 
-    assigned = observers_df[assignment_cols].isna().all(axis=1)
+    observer_df = responses.copy()
+    observer_df.insert(0, "assigned_am", np.nan)
+    observer_df.insert(1, "assigned_pm", np.nan)
+    observer_df = add_availability_columns(observer_df)
 
-    available_mask = (
-        (observers_df[location])
-        & (observers_df["legal_background"] == need_legal_background)
-        & assigned
+    return clean_observer_df(
+        observer_df, config, return_rejects=True, drop_duplicates=drop_duplicates
     )
 
-    if need_from_county:
-        available_mask = available_mask & (observers_df["from_county"])
 
-    available_names = observers_df[available_mask]["name"].values
-    observers_df.loc[available_mask, assignment_cols] = True
+@timed("clean")
+def prepare_observer_dataset(responses, config=None):
+    """
+    Turns the raw form responses, as returned by `get_sheet_columns`, into
+    the observer dataset. Adds the assignment and availability columns,
+    cleans the data and sorts the most experienced observers first.
+    """
 
-    if len(available_names) < n_required:
-        available_names = np.pad(
-            available_names, (0, n_required - len(available_names)), constant_values="",
+    observer_df, rejects = clean_responses(responses, config)
+    if len(rejects) > 0:
+        logger.warning(
+            "Dropped %d observers with invalid values:\n%s",
+            len(rejects),
+            rejects[["name", "reject_reason"]],
         )
-    elif len(available_names) > n_required:
-        available_names = available_names[:n_required]
+    observer_df = observer_df.sort_values(
+        ["ev_2020_experience", "outside_all_day"], ascending=False
+    )
+
+    return observer_df
+
+
+def iter_export_chunks(path, columns_map, chunksize=EXPORT_CHUNK_SIZE):
+    """
+    Reads a CSV or Parquet export of the form responses `chunksize` rows at a
+    time
+
+    Parameters
+    ----------
+    path: str or Path
+        The export. Its columns are either named as in `columns_map`, like the
+        local snapshot, or in the form's order, like a CSV download of the
+        sheet, and picked by "col_num"
+    columns_map: dict
+        Column name -> dict with "col_num" and "fill_missing"
+    chunksize: int, optional
+        The number of rows to read at a time
+
+    Yields
+    ------
+    pd.DataFrame
+        One column per entry in `columns_map`, as returned by
+        `get_sheet_columns`
+    """
+
+    path = Path(path)
+
+    if path.suffix == ".csv":
+        header = pd.read_csv(path, nrows=0).columns
+    elif path.suffix == ".parquet":
+        from pyarrow import parquet
 
-    if (location == "outside_all_day") and (len(available_names) > 0):
-        print(location, len(available_names), n_required)
-        available_names = (
-            np.repeat(available_names, 2).reshape(n_required, -1).squeeze()
+        parquet_file = parquet.ParquetFile(path)
+        header = pd.Index(parquet_file.schema_arrow.names)
+    else:
+        raise ValueError(f"Unknown export format: {path.suffix}")
+
+    if set(columns_map) <= set(header):
+        source_columns = {column_name: column_name for column_name in columns_map}
+    else:
+        source_columns = {
+            header[column_params["col_num"] - 1]: column_name
+            for column_name, column_params in columns_map.items()
+        }
+
+    if path.suffix == ".csv":
+        chunks = pd.read_csv(
+            path, usecols=list(source_columns), dtype=str, chunksize=chunksize
         )
-        print(available_names.shape)
-    return available_names
+    else:
+        chunks = (
+            batch.to_pandas()
+            for batch in parquet_file.iter_batches(
+                batch_size=chunksize, columns=list(source_columns)
+            )
+        )
+
+    for chunk in chunks:
+        chunk = chunk.rename(columns=source_columns)[list(columns_map)]
+        for column_name, column_params in columns_map.items():
+            if column_params["fill_missing"] is not None:
+                chunk[column_name] = chunk[column_name].fillna(
+                    column_params["fill_missing"]
+                )
+        yield chunk.astype(object)
 
 
-def assign_observers(precinct, observers, location, is_attorney, params=None):
+def keep_latest_responses(observers_df, key):
     """
-    Assign free observers to precincts.
+    Only keeps the latest response for each value of `key`, by `date_entered`
+    and then by the response's position in the export, its index. Missing
+    values never match.
+    """
+
+    order = np.lexsort((observers_df.index.values, get_entry_order(observers_df)))
+    observers_df = observers_df.iloc[order]
+    values = observers_df[key]
+
+    return observers_df[~(values.duplicated(keep="last") & values.notna())]
+
+
+@timed("read_export")
+def read_observer_export(path, config=None, chunksize=EXPORT_CHUNK_SIZE):
+    """
+    Builds the observer dataset from a CSV or Parquet export of the form
+    responses without holding more than a chunk of raw rows in memory
 
     Parameters
     ----------
-    precinct: pd.DataFrame
-        The precinct DataFrame
-    observers: pd.DataFrame
-        The observers DataFrame
-    location: string
-        one of "inside", "outside_am", "outside_pm", "outside_both"
-    is_attorney: bool
-        If available observer should be an attorney
-    params: dict, optional
-        Dictionary of parameters
+    path: str or Path
+        The export, see `iter_export_chunks`
+    config: Config, optional
+        The loaded config. See `src.config.load_config`
+    chunksize: int, optional
+        The number of rows to read and clean at a time
 
     Returns
     -------
-    precinct: pd.DataFrame
-        The updated precinct DataFrame
-    observers: pd.DataFrame
-        The updated observers DataFrame
+    pd.DataFrame
+        As returned by `prepare_observer_dataset`
 
     Note
     ----
-    You don't really need the returned values since the original input
-    dataframes are updated.
+    Each chunk is cleaned on its own, without dropping duplicates. The
+    cleaned rows are indexed by their position in the export, and after each
+    chunk only the latest response for each name is kept, found by hashing
+    the names, so at most one chunk plus one response per name is held in
+    memory. Once every chunk is read, only the latest of those for each email
+    is kept, as in `clean_observer_df`. The result does not depend on
+    `chunksize`. Responses are ordered by their parsed `date_entered`, with
+    undated responses the oldest and ties in file order, and missing names
+    and emails never match.
+    """
+
+    if config is None:
+        config = load_config()
 
-    #TODO: Should fix this side effect
+    observer_df = None
+    n_rows = 0
+    n_rejects = 0
+
+    for chunk in iter_export_chunks(path, config.columns_map, chunksize):
+        # rows keep their position in the export, for ties on date_entered
+        chunk.index = pd.RangeIndex(n_rows, n_rows + len(chunk))
+        n_rows += len(chunk)
+        chunk, rejects = clean_responses(chunk, config, drop_duplicates=False)
+        n_rejects += len(rejects)
+
+        if observer_df is not None:
+            chunk = pd.concat([observer_df, chunk])
+        observer_df = keep_latest_responses(chunk, "name")
+
+    if n_rejects > 0:
+        logger.warning("Dropped %d observers with invalid values", n_rejects)
+
+    if observer_df is None:
+        return prepare_observer_dataset(
+            pd.DataFrame({column: [] for column in config.columns_map}, dtype=object),
+            config,
+        )
+
+    observer_df = keep_latest_responses(observer_df, "email").reset_index(drop=True)
+    # chunks with different categories are concatenated as objects
+    observer_df["election_day"] = (
+        observer_df["election_day"].astype(object).astype("category")
+    )
+
+    return observer_df.sort_values(
+        ["ev_2020_experience", "outside_all_day"], ascending=False
+    )
+
+
+def read_precinct_file(path):
+    """
+    Reads the precinct excel sheet with explicit column types. Text and
+    assignment columns are filled with "", "Zip" and "Priority" are int64.
     """
 
-    if params is None:
-        params = load_yaml_config()[location]
+    precinct = pd.read_excel(
+        path, dtype={column: str for column in PRECINCT_TEXT_COLUMNS}
+    )
+
+    for column in PRECINCT_ASSIGNMENT_COLUMNS:
+        if column not in precinct:
+            precinct[column] = ""
+
+    missing_numbers = precinct[PRECINCT_NUMERIC_COLUMNS].isna().any()
+    if missing_numbers.any():
+        raise ValueError(
+            f"{path}: missing values in {list(missing_numbers[missing_numbers].index)}"
+        )
 
-    from_county = params["from_county"]
-    missing_observer = (precinct[params["precinct_observer"]] == "").all(axis=1)
-    print(
-        location,
-        is_attorney,
-        "PRECINCT SHAPE: ",
-        precinct.loc[missing_observer, params["precinct_observer"]].shape,
+    precinct[PRECINCT_NUMERIC_COLUMNS] = precinct[PRECINCT_NUMERIC_COLUMNS].astype(
+        "int64"
     )
-    precinct.loc[
-        missing_observer, params["precinct_observer"]
-    ] = get_available_observers(
-        observers,
-        missing_observer.sum(),
-        params["observer_availability"],
-        is_attorney,
-        from_county,
+    text_columns = precinct.columns.difference(PRECINCT_NUMERIC_COLUMNS, sort=False)
+    precinct[text_columns] = precinct[text_columns].astype(object).fillna("")
+
+    return precinct.sort_values("Priority")
+
+
+def load_county_observers(config, mode="refresh", snapshot_path=None):
+    """
+    Loads a county's observers from its `observer_export` if it has one,
+    otherwise with `mode` from its google sheet, see `get_observer_dataset`
+    """
+
+    if config.observer_export is not None:
+        return get_observer_dataset(
+            config, mode="export", export_path=config.observer_export
+        )
+
+    return get_observer_dataset(config, mode=mode, snapshot_path=snapshot_path)
+
+
+@timed("load_precincts")
+def get_precinct_dataset(path=None, use_cache=True, cache_dir=None):
+    """
+    Load precinct excel sheet. Note that it much define "Priority" column
+
+    Parameters
+    ----------
+    path: str or Path, optional
+        The precinct sheet. Defaults to PRECINCT_PATH
+    use_cache: bool, optional
+        Load from a parquet copy of the sheet in `cache_dir`, creating it if
+        needed. The copy is rebuilt whenever the sheet's contents change.
+    cache_dir: str or Path, optional
+        Where to keep the copy. Defaults to PRECINCT_CACHE_DIR
+
+    Note
+    ----
+    Each sheet has its own copy, named after a hash of its resolved path, so
+    sheets with the same file name in different directories don't share one.
+    The copy is used as it is while the sheet's modification time and size
+    are unchanged, and otherwise only if the sheet's contents hash the same.
+    """
+
+    path = Path(path or PRECINCT_PATH).resolve()
+    if not use_cache:
+        return read_precinct_file(path)
+
+    cache_dir = Path(cache_dir or PRECINCT_CACHE_DIR)
+    cache_path = cache_dir / f"{path.stem}-{get_path_key(path)}.parquet"
+    source_stat = get_file_stat(path)
+
+    precinct, metadata = load_snapshot(cache_path, memory_map=True)
+    if precinct is not None and metadata.get("source_stat") == source_stat:
+        return precinct
+
+    source_hash = get_file_hash(path)
+    if precinct is not None and metadata.get("source_hash") == source_hash:
+        return precinct
+
+    precinct = read_precinct_file(path)
+    save_snapshot(
+        precinct,
+        cache_path,
+        source=str(path),
+        source_stat=source_stat,
+        source_hash=source_hash,
     )
 
-    precinct.loc[missing_observer, params["precinct_is_legal"]] = is_attorney
+    return precinct
 
-    observers_allocated = observers.merge(
-        precinct[[params["precinct_observer"][0], "Polling Place Name"]],
-        left_on="name",
-        right_on=params["precinct_observer"][0],
-        how="left",
+
+def get_assignment_columns(observer_availability):
+    """
+    The observer columns that mark an observer as assigned for an availability
+    """
+
+    if observer_availability == "outside_AM":
+        return ["assigned_am"]
+    elif observer_availability == "outside_PM":
+        return ["assigned_pm"]
+    else:
+        return ["assigned_pm", "assigned_am"]
+
+
+# (location, is_attorney) in the order they are filled
+ASSIGNMENT_ORDER = [
+    ("inside", True),
+    ("outside_both", True),
+    ("outside_am", True),
+    ("outside_pm", True),
+    ("inside", False),
+    ("outside_both", False),
+    ("outside_am", False),
+    ("outside_pm", False),
+]
+
+
+def assign_tier(slots, free, observer_arrays, params, is_attorney):
+    """
+    Fills the precinct slots of one tier that are still empty with free
+    observers in order.
+
+    Parameters
+    ----------
+    slots: dict
+        Precinct observer column -> np.array of observer indices, -1 if empty.
+        Updated in place
+    free: dict
+        Observer assignment column -> boolean np.array of free observers.
+        Updated in place
+    observer_arrays: dict
+        Observer column -> np.array for the availability, legal and county columns
+    params: dict
+        Dictionary of parameters for the location
+    is_attorney: bool
+        If available observer should be an attorney
+
+    Returns
+    -------
+    missing: np.array
+        Boolean mask of the precincts that were missing an observer
+    """
+
+    precinct_cols = params["precinct_observer"]
+    assignment_cols = get_assignment_columns(params["observer_availability"])
+
+    missing = np.logical_and.reduce([slots[col] < 0 for col in precinct_cols])
+
+    available_mask = observer_arrays[params["observer_availability"]] & (
+        observer_arrays["legal_background"] == is_attorney
     )
-    observers[params["observer_loc"]] = observers_allocated["Polling Place Name"].values
+    for col in assignment_cols:
+        available_mask &= free[col]
+    if params["from_county"]:
+        available_mask &= observer_arrays["from_county"]
 
-    return precinct, observers
+    # all available observers are marked as taken, even those left without a
+    # slot, so they are not used by a later tier
+    for col in assignment_cols:
+        free[col] &= ~available_mask
+
+    missing_rows = np.flatnonzero(missing)
+    available = np.flatnonzero(available_mask)[: len(missing_rows)]
+    for col in precinct_cols:
+        slots[col][missing_rows[: len(available)]] = available
 
+    return missing
 
-def run_ordered_assignment(precinct, observers):
+
+def run_ordered_assignment(precinct, observers, config=None):
     """
     Assign observers as per priority and availability. Returns the same
     datasets as input just with updated assignments
@@ -281,120 +857,194 @@ def run_ordered_assignment(precinct, observers):
         The precinct data
     observers: pd.DataFrame
         The observers data
+    config: Config, optional
+        The loaded config. See `src.config.load_config`
 
     Returns
     -------
     precinct: pd.DataFrame
     observers: pd.DataFrame
 
+    Note
+    ----
+    The inputs are not modified. Observers and precincts are encoded as arrays
+    once, all tiers in `ASSIGNMENT_ORDER` are run on those and the results are
+    written to copies of the inputs at the end.
     """
-    assign_observers(precinct, observers, "inside", True)
-    assign_observers(precinct, observers, "outside_both", True)
-    assign_observers(precinct, observers, "outside_am", True)
-    assign_observers(precinct, observers, "outside_pm", True)
-    assign_observers(precinct, observers, "inside", False)
-    assign_observers(precinct, observers, "outside_both", False)
-    assign_observers(precinct, observers, "outside_am", False)
-    assign_observers(precinct, observers, "outside_pm", False)
 
-    return precinct, observers
+    if config is None:
+        config = load_config()
 
+    tier_params = [
+        (config.locations[location], is_attorney)
+        for location, is_attorney in ASSIGNMENT_ORDER
+    ]
+    precinct_cols = list(
+        dict.fromkeys(
+            col for params, _ in tier_params for col in params["precinct_observer"]
+        )
+    )
+    legal_cols = list(
+        dict.fromkeys(
+            col
+            for params, _ in tier_params
+            for col in np.atleast_1d(params["precinct_is_legal"])
+        )
+    )
 
-def output_by_shift(precinct, observers, rename_dict, params):
-    """
-    """
+    # encode
+    names = observers["name"].values
+    name_index = NameIndex(names)
 
-    outside_pm_df = precinct.merge(
-        observers, left_on=params["observer_col"], right_on="name", how="left",
-    )
+    observer_arrays = {
+        col: observers[col].values.astype(bool)
+        for col in ["inside_all_day", "outside_AM", "outside_PM", "outside_all_day"]
+        + ["legal_background", "from_county"]
+    }
+    free = {col: observers[col].isna().values for col in ["assigned_am", "assigned_pm"]}
+    slots = {col: name_index.encode(precinct[col].values) for col in precinct_cols}
+    unmatched = {
+        col: (slots[col] < 0) & (precinct[col].values != "") for col in precinct_cols
+    }
+    for col in precinct_cols:
+        slots[col][unmatched[col]] = len(observers)
+    legal = {col: precinct[col].values.copy() for col in legal_cols}
+
+    for (location, _), (params, is_attorney) in zip(ASSIGNMENT_ORDER, tier_params):
+        legal_name = "legal" if is_attorney else "not_legal"
+        with timer(f"assign.{location}_{legal_name}"):
+            missing = assign_tier(slots, free, observer_arrays, params, is_attorney)
+        for col in np.atleast_1d(params["precinct_is_legal"]):
+            legal[col][missing] = is_attorney
+
+    # materialise
+    precinct = precinct.copy()
+    padded_names = np.append(names, "")
+    for col in precinct_cols:
+        precinct[col] = np.where(
+            unmatched[col], precinct[col].values, padded_names[slots[col]]
+        )
+    for col in legal_cols:
+        precinct[col] = legal[col]
 
-    outside_pm_df.rename(
-        columns=rename_dict, inplace=True,
-    )
+    observers = observers.copy()
+    for col, is_free in free.items():
+        observers[col] = np.where(is_free, observers[col].values.astype(object), True)
 
-    assert outside_pm_df.shape[0] == precinct.shape[0], "Mismatch in number of records"
-
-    outside_pm_df["County"] = params["county"]
-    outside_pm_df["Date"] = params["date"]
-    outside_pm_df["Start Time"] = params["start_time"]
-    outside_pm_df["End Time"] = params["end_time"]
-    outside_pm_df["Area"] = params["area"]
-
-    return outside_pm_df[
-        [
-            "County",
-            "Rank",
-            "LocationName",
-            "Date",
-            "Start Time",
-            "End Time",
-            "Area",
-            "Name",
-            "Phone Number",
-            "Email Address",
-        ]
-    ]
+    location_cols = {
+        params["observer_loc"]: params["precinct_observer"][0]
+        for params, _ in tier_params
+    }
+    locations = np.append(precinct["Polling Place Name"].values, np.nan)
+    for location_col, col in location_cols.items():
+        # empty (-1) and unmatched slots land on the padding at the end
+        observer_location = np.full(len(observers) + 1, len(precinct))
+        observer_location[slots[col]] = np.arange(len(precinct))
+        observers[location_col] = locations[observer_location[:-1]]
+
+    return precinct, observers
 
 
-def get_lbj_csv(precinct, observers):
+# shifts in the order they appear in the LBJ output
+LBJ_SHIFTS = [
+    "outside_am_output",
+    "outside_pm_output",
+    "inside_am_output",
+    "inside_pm_output",
+]
+LBJ_COLUMNS = [
+    "County",
+    "Rank",
+    "LocationName",
+    "Date",
+    "Start Time",
+    "End Time",
+    "Area",
+    "Name",
+    "Phone Number",
+    "Email Address",
+]
+
+
+@timed("lbj_output")
+def get_lbj_csv(precinct, observers, config=None):
     """
+    One row per precinct and shift with the observer's contact details, in
+    the format used by the LBJ system. The shifts are stacked in the order
+    of `LBJ_SHIFTS`.
     """
 
-    precinct_cols = [
-        "Priority",
-        "Polling Place Name",
-        "inside_observer",
-        "outside_am_observer",
-        "outside_pm_observer",
-    ]
+    if config is None:
+        config = load_config()
 
-    observer_cols = ["name", "phone_number", "email"]
+    shifts = [config.outputs[shift] for shift in LBJ_SHIFTS]
+    n_precincts = len(precinct)
 
-    output_df = pd.DataFrame()
-    for shift in [
-        "outside_am_output",
-        "outside_pm_output",
-        "inside_am_output",
-        "inside_pm_output",
+    observer_id = NameIndex(observers["name"].values).encode(
+        np.concatenate([precinct[params["observer_col"]].values for params in shifts])
+    )
+    # precincts without an observer land on the padding at the end
+    observer_id = np.where(observer_id >= 0, observer_id, len(observers))
+
+    columns = {}
+    for column, key in [
+        ("County", "county"),
+        ("Date", "date"),
+        ("Start Time", "start_time"),
+        ("End Time", "end_time"),
+        ("Area", "area"),
     ]:
-        params = load_yaml_config()
-        output_df = output_df.append(
-            output_by_shift(
-                precinct[precinct_cols],
-                observers[observer_cols],
-                params["rename_columns"],
-                params[shift],
-            )
-        )
+        columns[column] = np.repeat([params[key] for params in shifts], n_precincts)
 
-    return output_df
+    for column in ["Priority", "Polling Place Name"]:
+        columns[column] = np.tile(precinct[column].values, len(shifts))
 
+    for column in ["name", "phone_number", "email"]:
+        values = np.append(observers[column].values.astype(object), np.nan)
+        columns[column] = values[observer_id]
 
-if __name__ == "__main__":
+    output_df = pd.DataFrame(columns)
 
-    observers = get_observer_dataset()
-    precinct = get_precinct_dataset()
+    return output_df.rename(columns=config.rename_columns)[LBJ_COLUMNS]
 
-    run_ordered_assignment(precinct, observers)
 
-    precinct.to_excel(
-        Path(__file__).parent / "../data/01_output/assigned_precincts.xlsx",
-        index=False,
-        encoding="utf-8",
-    )
+def main(args=None):
+    """
+    Assigns observers in priority order and writes the assignment and the LBJ
+    output to OUTPUT_DIR
+    """
 
-    observers.to_excel(
-        Path(__file__).parent / "../data/01_output/assigned_observers.xlsx",
-        index=False,
-        encoding="utf-8",
+    parser = add_config_arguments(
+        argparse.ArgumentParser(description="Assign observers to precincts")
     )
+    args = parser.parse_args(args)
+
+    config = load_run_config(args)
+    with reporting("basic_assignment", config, OUTPUT_DIR):
+        observers = load_county_observers(config, args.mode)
+        precinct = get_precinct_dataset(config.precinct_file)
+
+        precinct, observers = run_ordered_assignment(precinct, observers, config)
+        get_report().add_metrics(
+            "assignment",
+            get_assignment_metrics(
+                precinct, observers, config.optimiser["distance"]
+            ),
+        )
 
-    lbj_output = get_lbj_csv(precinct, observers)
+        lbj_output = get_lbj_csv(precinct, observers, config)
 
-    lbj_output.to_excel(
-        Path(__file__).parent / "../data/01_output/lbj_output.xlsx",
-        index=False,
-        encoding="utf-8",
-    )
+        write_outputs(
+            {
+                "assigned_precincts": precinct,
+                "assigned_observers": observers,
+                "lbj_output": lbj_output,
+            },
+            **config.export,
+        )
 
-    print(lbj_output)
+        print(lbj_output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+import argparse
+import logging
+import pandas as pd
+import numpy as np
+
+import src.basic_assignment as ba
+
+from concurrent.futures import ProcessPoolExecutor
+from src.config import DISTANCES, load_config
+from src.instrumentation import collect_report, get_report, reporting
+from src.interning import NameIndex
+from src.optimal_assignment import optimise_all
+from src.output import OUTPUT_DIR, write_outputs
+
+logger = logging.getLogger(__name__)
+
+
+def get_observer_keys(observers):
+    """
+    The key an observer is identified by across counties: their email if they
+    gave one, otherwise their name
+    """
+
+    email = observers["email"].fillna("").astype(str).str.strip().str.lower()
+    name = observers["name"].fillna("").astype(str).str.lower()
+
+    return np.where(email.isin(["", "none"]), "name:" + name, "email:" + email)
+
+
+def deduplicate_counties(county_observers):
+    """
+    Makes sure volunteers who signed up in several counties are only
+    assigned in one. A volunteer goes to the first county they live in, or
+    to the first county they signed up in if they live in none of them.
+
+    Parameters
+    ----------
+    county_observers: dict
+        County -> observers, in priority order
+
+    Returns
+    -------
+    dict
+        County -> the observers assigned to that county
+    """
+
+    counties = list(county_observers)
+    keys = [get_observer_keys(observers) for observers in county_observers.values()]
+    key_index = NameIndex(np.concatenate(keys))
+
+    # rank every sign up, home counties first, then in county order
+    rank = np.full(len(key_index.index), np.iinfo(np.int64).max)
+    for county_order, (observers, county_keys) in enumerate(
+        zip(county_observers.values(), keys)
+    ):
+        observer_rank = county_order + len(counties) * (
+            ~observers["from_county"].values.astype(bool)
+        )
+        np.minimum.at(rank, key_index.index.get_indexer(county_keys), observer_rank)
+
+    deduplicated = {}
+    for county_order, (county, county_keys) in enumerate(zip(counties, keys)):
+        observers = county_observers[county]
+        observer_rank = rank[key_index.index.get_indexer(county_keys)]
+        home = observer_rank % len(counties) == county_order
+        deduplicated[county] = observers[home]
+        if (~home).any():
+            logger.info(
+                "%s: %d observers are assigned in another county", county, (~home).sum()
+            )
+
+    return deduplicated
+
+
+def get_county_cache_dir(config):
+    """
+    The directory for a county's cached precinct sheet and observer snapshot,
+    so counties run side by side never share or overwrite each other's
+    """
+
+    return ba.PRECINCT_CACHE_DIR / config.county
+
+
+def run_county(config_path, observers, **options):
+    """
+    Runs the basic and optimised assignment for one county. Runs in a worker
+    process so the config is loaded from its path. `options` override the
+    county's optimiser settings. The precinct sheet is cached in the county's
+    own directory, see `get_county_cache_dir`.
+
+    Returns
+    -------
+    dict
+        "county", "precinct", "observers", "lbj_output" and the county's run
+        "report"
+    """
+
+    config = load_config(config_path)
+
+    with collect_report(config.county) as report:
+        with report.timer("total"):
+            precinct = ba.get_precinct_dataset(
+                config.precinct_file, cache_dir=get_county_cache_dir(config)
+            )
+            precinct, observers = ba.run_ordered_assignment(
+                precinct, observers, config
+            )
+            # the counties are already spread over the processes
+            precinct, observers = optimise_all(
+                precinct, observers, config, **{**options, "n_workers": 1}
+            )
+            lbj_output = ba.get_lbj_csv(precinct, observers, config)
+
+    return {
+        "county": config.county,
+        "precinct": precinct,
+        "observers": observers,
+        "lbj_output": lbj_output,
+        "report": report.to_dict(),
+    }
+
+
+def run_counties(config_paths, mode="refresh", n_workers=None, **options):
+    """
+    Runs the assignment for several counties
+
+    Parameters
+    ----------
+    config_paths: list of str or Path
+        One parameters file per county, in priority order for volunteers
+        who signed up in more than one
+    mode: string, optional
+        How to load observers for counties without an `observer_export`, see
+        `get_observer_dataset`
+    n_workers: int, optional
+        The most counties to run at once. Defaults to the number of CPUs
+    **options:
+        Override every county's optimiser settings, e.g. distance="haversine"
+
+    Returns
+    -------
+    dict
+        "precinct", "observers" and "lbj_output" for all counties, with a
+        "county" column
+    """
+
+    configs = [load_config(path) for path in config_paths]
+
+    county_observers = {}
+    for config in configs:
+        snapshot_path = get_county_cache_dir(config) / "observer_responses.parquet"
+        with get_report().timer(f"load.{config.county}"):
+            county_observers[config.county] = ba.load_county_observers(
+                config, mode, snapshot_path
+            )
+    county_observers = deduplicate_counties(county_observers)
+
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        futures = [
+            executor.submit(
+                run_county, config.path, county_observers[config.county], **options
+            )
+            for config in configs
+        ]
+        results = [future.result() for future in futures]
+
+    combined = {}
+    for key in ["precinct", "observers", "lbj_output"]:
+        combined[key] = pd.concat(
+            [result[key].assign(county=result["county"]) for result in results],
+            ignore_index=True,
+        )
+    for result in results:
+        get_report().merge(result["report"], prefix=f"{result['county']}.")
+
+    return combined
+
+
+def main(args=None):
+    """
+    Runs the assignment for the counties given on the command line and writes
+    the combined outputs to OUTPUT_DIR
+    """
+
+    parser = argparse.ArgumentParser(description="Assign observers in several counties")
+    parser.add_argument("configs", nargs="+", help="one parameters file per county")
+    parser.add_argument("--mode", default="refresh")
+    parser.add_argument("--n-workers", type=int)
+    parser.add_argument(
+        "--distance", choices=sorted(DISTANCES), help="defaults to each county's"
+    )
+    args = parser.parse_args(args)
+    options = {} if args.distance is None else {"distance": args.distance}
+
+    config = load_config(args.configs[0])
+    with reporting("batch_assignment", config, OUTPUT_DIR):
+        combined = run_counties(args.configs, args.mode, args.n_workers, **options)
+
+        write_outputs(
+            {
+                "batch_assigned_precincts": combined["precinct"],
+                "batch_assigned_observers": combined["observers"],
+                "batch_lbj_output": combined["lbj_output"],
+            },
+            **config.export,
+        )
+
+        print(combined["precinct"].groupby("county").size())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+import hashlib
+import json
+import os
+import pandas as pd
+import tempfile
+
+from datetime import datetime
+from pathlib import Path
+
+
+def get_metadata_path(path):
+    """
+    The json file holding the watermark for a snapshot
+    """
+
+    return Path(path).with_suffix(".json")
+
+
+def write_atomically(path, write):
+    """
+    Calls `write` with a temporary file next to `path` and then moves it into
+    place, so readers never see a partly written file
+    """
+
+    path = Path(path)
+    handle, temp_path = tempfile.mkstemp(
+        dir=path.parent, prefix=f".{path.name}.", suffix=".tmp"
+    )
+    os.close(handle)
+    try:
+        write(temp_path)
+        os.replace(temp_path, path)
+    except BaseException:
+        Path(temp_path).unlink(missing_ok=True)
+        raise
+
+
+def save_snapshot(df, path, **watermark):
+    """
+    Saves a dataframe as parquet along with a json watermark. Both are written
+    atomically, the parquet file first, so a watermark is never newer than
+    the data it describes.
+
+    Parameters
+    ----------
+    df: pd.DataFrame
+        The data to save
+    path: str or Path
+        The parquet file to write
+    **watermark:
+        Additional json serialisable values to store with the snapshot
+
+    Returns
+    -------
+    metadata: dict
+        The stored watermark. Always includes the row count and the time
+        the snapshot was saved
+    """
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    write_atomically(path, df.to_parquet)
+
+    metadata = {
+        "n_rows": len(df),
+        "saved_at": datetime.now().isoformat(timespec="seconds"),
+        **watermark,
+    }
+    write_atomically(
+        get_metadata_path(path),
+        lambda temp_path: Path(temp_path).write_text(json.dumps(metadata, indent=2)),
+    )
+
+    return metadata
+
+
+def load_snapshot(path, memory_map=False):
+    """
+    Loads a snapshot saved with `save_snapshot`
+
+    Parameters
+    ----------
+    path: str or Path
+        The parquet file
+    memory_map: bool, optional
+        Memory map the file rather than reading it
+
+    Returns
+    -------
+    df: pd.DataFrame or None
+        The saved data, None if there is no snapshot
+    metadata: dict or None
+        The saved watermark
+    """
+
+    path = Path(path)
+    if not (path.exists() and get_metadata_path(path).exists()):
+        return None, None
+
+    with get_metadata_path(path).open() as metadata_file:
+        metadata = json.load(metadata_file)
+
+    return pd.read_parquet(path, memory_map=memory_map), metadata
+
+
+def get_path_key(path):
+    """
+    A short key for a file's resolved path, so files with the same name in
+    different directories get different cache entries
+    """
+
+    return hashlib.sha256(str(Path(path).resolve()).encode()).hexdigest()[:16]
+
+
+def get_file_stat(path):
+    """
+    The modification time and size of a file, a quick check that it is
+    unchanged
+    """
+
+    stat = Path(path).stat()
+
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def get_file_hash(path):
+    """
+    The sha256 hex digest of a file's contents
+    """
+
+    file_hash = hashlib.sha256()
+    with Path(path).open("rb") as source:
+        for block in iter(lambda: source.read(1 << 20), b""):
+            file_hash.update(block)
+
+    return file_hash.hexdigest()
@@ -0,0 +1,312 @@
+import numpy as np
+
+from src.distance import ZipCodeDistance
+
+
+# float32 distance + int32 column index per stored candidate
+BYTES_PER_CANDIDATE = 8
+# dense distances computed per chunk of zip codes are at most 8 bytes each
+BYTES_PER_DISTANCE = 8
+
+
+def get_candidate_budget(n_observers, n_locations, max_memory_mb):
+    """
+    Works out how many candidates per observer, and how many zip codes per
+    chunk of dense distances, fit within a memory ceiling
+
+    Returns
+    -------
+    n_candidates: int
+    chunk_size: int
+    """
+
+    max_bytes = max_memory_mb * 2 ** 20
+    n_candidates = max_bytes // (BYTES_PER_CANDIDATE * max(n_observers, 1)) - 1
+    chunk_size = max_bytes // (BYTES_PER_DISTANCE * max(n_locations, 1))
+
+    return int(np.clip(n_candidates, 1, max(n_locations, 1))), int(max(chunk_size, 1))
+
+
+def get_closest(distance, k):
+    """
+    The `k` closest columns for each row of `distance`. Ties are broken by
+    column so these are always the first `k` of the row's preference order.
+
+    Returns
+    -------
+    np.array
+        Shape (len(distance), k), the closest columns in column order
+    """
+
+    n_rows, n_cols = distance.shape
+    if k >= n_cols:
+        return np.broadcast_to(np.arange(n_cols), (n_rows, n_cols))
+
+    kth = np.partition(distance, k - 1, axis=1)[:, k - 1 : k]
+    closer = distance < kth
+    tied = distance == kth
+    n_tied = k - closer.sum(axis=1, keepdims=True)
+    keep = closer | (tied & (np.cumsum(tied, axis=1) <= n_tied))
+
+    return np.nonzero(keep)[1].reshape(n_rows, k)
+
+
+def get_nearest_candidates(
+    observer_zip, owned, precinct_zip, n_candidates, distance, chunk_size
+):
+    """
+    The `n_candidates` closest polling locations for each observer, plus the
+    location they currently hold unless `owned` is None. Observers in the
+    same zip code have the same closest locations so distances are only
+    computed once per zip code.
+
+    Returns
+    -------
+    rows, cols, data: np.array
+        The observer, polling location and distance of each candidate
+    """
+
+    unique_zip, zip_index = np.unique(observer_zip, return_inverse=True)
+
+    nearest = []
+    nearest_distance = []
+    for start in range(0, len(unique_zip), chunk_size):
+        chunk_distance = distance(unique_zip[start : start + chunk_size], precinct_zip)
+        chunk_nearest = get_closest(chunk_distance, n_candidates)
+        nearest.append(chunk_nearest)
+        nearest_distance.append(
+            np.take_along_axis(chunk_distance, chunk_nearest, axis=1)
+        )
+
+    nearest = np.concatenate(nearest)[zip_index]
+    nearest_distance = np.concatenate(nearest_distance)[zip_index]
+
+    rows = np.arange(len(observer_zip))
+    if owned is None:
+        return (
+            np.repeat(rows, nearest.shape[1]),
+            nearest.ravel(),
+            nearest_distance.ravel(),
+        )
+
+    own_missing = ~(nearest == owned[:, np.newaxis]).any(axis=1)
+    own_distance = distance.paired(
+        observer_zip[own_missing], precinct_zip[owned[own_missing]]
+    )
+
+    return (
+        np.concatenate([np.repeat(rows, nearest.shape[1]), rows[own_missing]]),
+        np.concatenate([nearest.ravel(), owned[own_missing]]),
+        np.concatenate([nearest_distance.ravel(), own_distance]),
+    )
+
+
+def get_spread_candidates(from_zip, to_zip, n_candidates, distance, chunk_size):
+    """
+    Like `get_nearest_candidates`, but rows in the same zip code don't all get
+    the same closest columns. The i-th row of a zip code gets the columns
+    ranked i to i + `n_candidates` - 1 in the zip code's preference order, so
+    together they cover as many columns as they could fill.
+
+    Parameters
+    ----------
+    from_zip, to_zip: np.array
+        Post codes of the rows and of the columns
+    n_candidates: int
+        The number of candidates per row, at most len(to_zip)
+    distance: callable
+        The distance provider, see `src.distance`
+    chunk_size: int
+        The number of zip codes to compute dense distances for at once
+
+    Returns
+    -------
+    rows, cols, data: np.array
+        The row, column and distance of each candidate
+    """
+
+    unique_zip, zip_index, zip_count = np.unique(
+        from_zip, return_inverse=True, return_counts=True
+    )
+    n_cols = len(to_zip)
+    n_ranked = np.minimum(n_candidates + zip_count - 1, n_cols)
+
+    # the columns of each zip code in preference order, closest first. The
+    # closest columns come in column order, so a stable sort by distance
+    # breaks ties by column
+    nearest = np.zeros((len(unique_zip), n_ranked.max()), dtype=np.int64)
+    nearest_distance = np.zeros(nearest.shape)
+    for start in range(0, len(unique_zip), chunk_size):
+        chunk = slice(start, start + chunk_size)
+        chunk_distance = distance(unique_zip[chunk], to_zip)
+        k = n_ranked[chunk].max()
+        closest = get_closest(chunk_distance, k)
+        closest_distance = np.take_along_axis(chunk_distance, closest, axis=1)
+        order = np.argsort(closest_distance, axis=1, kind="stable")
+        nearest[chunk, :k] = np.take_along_axis(closest, order, axis=1)
+        nearest_distance[chunk, :k] = np.sort(closest_distance, axis=1)
+
+    # position of each row among the rows with the same zip code
+    by_zip = np.argsort(zip_index, kind="stable")
+    first = np.cumsum(zip_count) - zip_count
+    position = np.empty(len(from_zip), dtype=np.int64)
+    position[by_zip] = np.arange(len(from_zip)) - first[zip_index[by_zip]]
+
+    rank = position[:, np.newaxis] + np.arange(n_candidates)
+    rank %= n_ranked[zip_index][:, np.newaxis]
+    cols = np.take_along_axis(nearest[zip_index], rank, axis=1)
+    data = np.take_along_axis(nearest_distance[zip_index], rank, axis=1)
+
+    return np.repeat(np.arange(len(from_zip)), n_candidates), cols.ravel(), data.ravel()
+
+
+class CandidateGraph:
+    """
+    The closest polling locations for each observer held as a sparse CSR
+    matrix of distances. Observer `i` currently holds location `i`, which is
+    always a candidate so that every observer can be matched.
+
+    Parameters
+    ----------
+    observer_zip: np.array
+        Post codes of the observers
+    precinct_zip: np.array
+        Post codes of the polling locations
+    n_candidates: int or np.array
+        The number of closest polling locations to keep, for all observers or
+        for each one
+    distance: callable, optional
+        The distance provider, see `src.distance`. Defaults to ZipCodeDistance
+    chunk_size: int, optional
+        The number of zip codes to compute dense distances for at once
+
+    Attributes
+    ----------
+    matrix: scipy.sparse.csr_matrix
+        Distances from observers (rows) to candidate polling locations (cols).
+        Each row is ordered closest first, ties broken by column, so it starts
+        with the observer's `n_candidates` closest locations followed by their
+        current location if it isn't one of them.
+    n_candidates: np.array
+        The number of closest polling locations kept for each observer
+    """
+
+    def __init__(
+        self, observer_zip, precinct_zip, n_candidates, distance=None, chunk_size=1024
+    ):
+
+        self.observer_zip = np.asarray(observer_zip)
+        self.precinct_zip = np.asarray(precinct_zip)
+        self.distance = distance if distance is not None else ZipCodeDistance()
+        self.chunk_size = chunk_size
+
+        self.n_candidates = np.minimum(
+            np.broadcast_to(n_candidates, len(self.observer_zip)),
+            len(self.precinct_zip),
+        ).astype(int)
+
+        self.matrix = self.build_matrix(
+            *self.get_rows(np.arange(len(self.observer_zip)))
+        )
+
+    @classmethod
+    def from_memory_limit(
+        cls, observer_zip, precinct_zip, max_memory_mb, distance=None
+    ):
+        """
+        Builds the graph with as many candidates per observer as fit within
+        `max_memory_mb`
+        """
+
+        n_candidates, chunk_size = get_candidate_budget(
+            len(observer_zip), len(precinct_zip), max_memory_mb
+        )
+
+        return cls(observer_zip, precinct_zip, n_candidates, distance, chunk_size)
+
+    def get_rows(self, observers):
+        """
+        Finds the candidates for `observers`, grouped by how many they keep
+        """
+
+        rows = [np.array([], dtype=int)]
+        cols = [np.array([], dtype=int)]
+        data = [np.array([], dtype=np.float32)]
+        for k in np.unique(self.n_candidates[observers]):
+            group = observers[self.n_candidates[observers] == k]
+            group_rows, group_cols, group_data = get_nearest_candidates(
+                self.observer_zip[group],
+                group,
+                self.precinct_zip,
+                k,
+                self.distance,
+                self.chunk_size,
+            )
+            rows.append(group[group_rows])
+            cols.append(group_cols)
+            data.append(group_data)
+
+        return np.concatenate(rows), np.concatenate(cols), np.concatenate(data)
+
+    def build_matrix(self, rows, cols, data, base=None):
+        """
+        Packs candidates into CSR form with each row ordered closest first.
+        If `base` is given, the rows of `base` that have no new candidates
+        are copied across unchanged.
+        """
+        from scipy import sparse
+
+        n_observers = len(self.observer_zip)
+        order = np.lexsort((cols, data, rows))
+        rows, cols, data = rows[order], cols[order], data[order]
+
+        row_length = np.bincount(rows, minlength=n_observers)
+        if base is not None:
+            base_length = np.diff(base.indptr)
+            kept = row_length == 0
+            row_length[kept] = base_length[kept]
+
+        indptr = np.zeros(n_observers + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum(row_length)
+        indices = np.empty(indptr[-1], dtype=np.int32)
+        values = np.empty(indptr[-1], dtype=np.float32)
+
+        # the i-th new candidate of a row goes i places after the row start
+        position = indptr[rows] + np.arange(len(rows)) - np.searchsorted(rows, rows)
+        indices[position] = cols
+        values[position] = data
+
+        if base is not None:
+            base_rows = np.repeat(np.arange(n_observers), base_length)
+            copied = kept[base_rows]
+            position = (
+                indptr[base_rows[copied]]
+                + np.flatnonzero(copied)
+                - base.indptr[base_rows[copied]]
+            )
+            indices[position] = base.indices[copied]
+            values[position] = base.data[copied]
+
+        return sparse.csr_matrix(
+            (values, indices, indptr), shape=(n_observers, len(self.precinct_zip))
+        )
+
+    def expand(self, observers):
+        """
+        Doubles the number of candidates for `observers`. Their closest
+        candidates stay at the front of their rows, in the same order.
+        """
+
+        observers = np.asarray(observers)
+        self.n_candidates[observers] = np.minimum(
+            self.n_candidates[observers] * 2, len(self.precinct_zip)
+        )
+
+        self.matrix = self.build_matrix(*self.get_rows(observers), base=self.matrix)
+
+    def is_complete(self):
+        """
+        Which observers have every polling location as a candidate
+        """
+
+        return self.n_candidates >= len(self.precinct_zip)
@@ -0,0 +1,53 @@
+import importlib
+import sys
+
+
+# command -> (module with a `main(args)` function, help). Only the module of the
+# command that is run is imported, so `python -m src.cli --help` does not load
+# pandas
+COMMANDS = {
+    "basic": ("src.basic_assignment", "assign observers in priority order"),
+    "optimise": ("src.optimal_assignment", "assign and optimise travel distance"),
+    "manual": ("src.optimal_manual_assignment", "optimise a manual assignment"),
+    "incremental": ("src.incremental_assignment", "update the last assignment"),
+    "batch": ("src.batch_assignment", "assign several counties"),
+    "serve": ("src.service", "serve the assignment over HTTP"),
+    "export": ("src.output", "convert the last outputs to another format"),
+    "importtime": ("benchmarks.import_time", "time the imports of each command"),
+}
+
+
+def get_usage():
+    lines = ["usage: python -m src.cli <command> [options]", "", "commands:"]
+    for command, (_, help) in COMMANDS.items():
+        lines.append(f"  {command:<12} {help}")
+    lines.append("")
+    lines.append(
+        "Run `python -m src.cli <command> --help` for the options of a command."
+    )
+
+    return "\n".join(lines)
+
+
+def main(args=None):
+    """
+    Runs a command. The arguments after the command are passed on to the
+    `main` function of its module.
+    """
+
+    args = sys.argv[1:] if args is None else list(args)
+    if not args or args[0] in ("-h", "--help"):
+        print(get_usage())
+        return 0
+    if args[0] not in COMMANDS:
+        print(f"Unknown command: {args[0]}\n\n{get_usage()}", file=sys.stderr)
+        return 2
+
+    module, _ = COMMANDS[args[0]]
+    sys.argv[0] = f"python -m src.cli {args[0]}"
+
+    return importlib.import_module(module).main(args[1:]) or 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,268 @@
+import yaml
+
+from dataclasses import dataclass, replace
+from functools import lru_cache
+from pathlib import Path
+from types import MappingProxyType
+from typing import FrozenSet, Mapping, Optional
+
+
+DEFAULT_CONFIG_PATH = Path(__file__).parent / "../config/parameters.yml"
+
+LOCATION_KEYS = {
+    "from_county",
+    "precinct_observer",
+    "precinct_is_legal",
+    "observer_availability",
+    "observer_loc",
+}
+OBSERVER_AVAILABILITY = {
+    "inside_all_day",
+    "outside_AM",
+    "outside_PM",
+    "outside_all_day",
+}
+OUTPUT_KEYS = {"observer_col", "start_time", "end_time", "area", "county", "date"}
+SHEET_FETCH_DEFAULTS = {"max_retries": 5, "backoff_seconds": 1.0}
+OPTIMISER_DEFAULTS = {
+    "method": "ttc",
+    "n_candidates": None,
+    "max_memory_mb": None,
+    "n_workers": None,
+    "distance": "zipcode",
+}
+OPTIMISER_METHODS = {"networkx", "ttc", "hungarian", "flow", "weighted"}
+# the providers of `src.distance.DISTANCE_PROVIDERS`
+DISTANCES = {"zipcode", "haversine"}
+OBJECTIVE_DEFAULTS = {
+    "fill": 1000.0,
+    "priority": 100.0,
+    "legal": 50.0,
+    "from_county": 500.0,
+    "distance": 1.0,
+    "warm_start": True,
+}
+EXPORT_DEFAULTS = {"format": "xlsx", "n_workers": None}
+EXPORT_FORMATS = {"xlsx", "csv", "parquet"}
+REPORT_DEFAULTS = {"log_level": "INFO", "profile": None}
+LOG_LEVELS = {"DEBUG", "INFO", "WARNING", "ERROR"}
+PROFILERS = {"cprofile", "pyinstrument"}
+
+
+@dataclass(frozen=True)
+class Config:
+    """
+    Parsed and validated parameters file. Supports `config[key]` lookups of the
+    raw yaml so it can be used wherever the loaded dict used to be.
+    """
+
+    path: Path
+    observer_google_sheet: str
+    columns_map: Mapping[str, Mapping]
+    valid_post_codes: FrozenSet[int]
+    locations: Mapping[str, Mapping]
+    rename_columns: Mapping[str, str]
+    outputs: Mapping[str, Mapping]
+    sheet_fetch: Mapping[str, float]
+    optimiser: Mapping[str, object]
+    export: Mapping[str, object]
+    report: Mapping[str, object]
+    objective: Mapping[str, object]
+    county: str
+    precinct_file: Optional[Path]
+    observer_export: Optional[Path]
+    raw: Mapping
+
+    def __getitem__(self, key):
+        return self.raw[key]
+
+    def __contains__(self, key):
+        return key in self.raw
+
+
+def freeze(value):
+    """
+    Recursively converts dicts to read-only mappings and lists to tuples
+    """
+
+    if isinstance(value, dict):
+        return MappingProxyType({k: freeze(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze(v) for v in value)
+    return value
+
+
+def validate_config(params, path):
+    """
+    Checks the parameters file has everything the pipeline needs. Raises a
+    ValueError describing the first problem found.
+    """
+
+    for key in ["observer_google_sheet", "columns_map", "valid_post_codes"]:
+        if key not in params:
+            raise ValueError(f"{path}: missing '{key}'")
+
+    for column_name, column_params in params["columns_map"].items():
+        if "col_num" not in (column_params or {}):
+            raise ValueError(f"{path}: columns_map.{column_name} has no col_num")
+
+    for location in ["inside", "outside_am", "outside_pm", "outside_both"]:
+        missing_keys = LOCATION_KEYS - set(params.get(location) or {})
+        if missing_keys:
+            raise ValueError(f"{path}: {location} is missing {sorted(missing_keys)}")
+        availability = params[location]["observer_availability"]
+        if availability not in OBSERVER_AVAILABILITY:
+            raise ValueError(
+                f"{path}: {location} has unknown availability '{availability}'"
+            )
+
+    optimiser = params.get("optimiser") or {}
+    unknown_keys = set(optimiser) - set(OPTIMISER_DEFAULTS)
+    if unknown_keys:
+        raise ValueError(f"{path}: optimiser has unknown keys {sorted(unknown_keys)}")
+    if optimiser.get("method", "ttc") not in OPTIMISER_METHODS:
+        raise ValueError(f"{path}: unknown optimiser method '{optimiser['method']}'")
+    n_workers = optimiser.get("n_workers")
+    if n_workers is not None and (not isinstance(n_workers, int) or n_workers < 1):
+        raise ValueError(f"{path}: optimiser.n_workers must be a positive integer")
+    if optimiser.get("distance", "zipcode") not in DISTANCES:
+        raise ValueError(
+            f"{path}: unknown optimiser distance '{optimiser['distance']}'"
+        )
+
+    export = params.get("export") or {}
+    unknown_keys = set(export) - set(EXPORT_DEFAULTS)
+    if unknown_keys:
+        raise ValueError(f"{path}: export has unknown keys {sorted(unknown_keys)}")
+    if export.get("format", "xlsx") not in EXPORT_FORMATS:
+        raise ValueError(f"{path}: unknown export format '{export['format']}'")
+
+    report = params.get("report") or {}
+    unknown_keys = set(report) - set(REPORT_DEFAULTS)
+    if unknown_keys:
+        raise ValueError(f"{path}: report has unknown keys {sorted(unknown_keys)}")
+    if report.get("log_level", "INFO") not in LOG_LEVELS:
+        raise ValueError(f"{path}: unknown report log_level '{report['log_level']}'")
+    if report.get("profile") not in PROFILERS | {None}:
+        raise ValueError(f"{path}: unknown report profile '{report['profile']}'")
+
+    objective = params.get("objective") or {}
+    unknown_keys = set(objective) - set(OBJECTIVE_DEFAULTS)
+    if unknown_keys:
+        raise ValueError(f"{path}: objective has unknown keys {sorted(unknown_keys)}")
+    for key, value in objective.items():
+        if key == "warm_start":
+            if not isinstance(value, bool):
+                raise ValueError(f"{path}: objective.warm_start must be true or false")
+        elif (
+            isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0
+        ):
+            raise ValueError(f"{path}: objective.{key} must be a non-negative number")
+
+    for key, value in params.items():
+        if key.endswith("_output"):
+            missing_keys = OUTPUT_KEYS - set(value or {})
+            if missing_keys:
+                raise ValueError(f"{path}: {key} is missing {sorted(missing_keys)}")
+
+
+@lru_cache(maxsize=8)
+def read_config(path, mtime_ns):
+    """
+    Parses the parameters file. Cached on the file's path and modification
+    time so it is only re-read when it changes.
+    """
+
+    with path.open() as params_file:
+        params = yaml.full_load(params_file)
+
+    validate_config(params, path)
+
+    try:
+        valid_post_codes = frozenset(int(code) for code in params["valid_post_codes"])
+    except (TypeError, ValueError):
+        raise ValueError(f"{path}: valid_post_codes must all be integers")
+
+    locations = ["inside", "outside_am", "outside_pm", "outside_both"]
+    outputs = {key: value for key, value in params.items() if key.endswith("_output")}
+
+    # input files are relative to the parameters file
+    input_files = {
+        key: path.parent / params[key] if params.get(key) else None
+        for key in ["precinct_file", "observer_export"]
+    }
+    county = params.get("county") or next(
+        (output["county"] for output in outputs.values()), path.stem
+    )
+
+    return Config(
+        path=path,
+        observer_google_sheet=params["observer_google_sheet"],
+        columns_map=freeze(params["columns_map"]),
+        valid_post_codes=valid_post_codes,
+        locations=freeze({location: params[location] for location in locations}),
+        rename_columns=freeze(params.get("rename_columns", {})),
+        outputs=freeze(outputs),
+        sheet_fetch=freeze({**SHEET_FETCH_DEFAULTS, **params.get("sheet_fetch", {})}),
+        optimiser=freeze({**OPTIMISER_DEFAULTS, **(params.get("optimiser") or {})}),
+        export=freeze({**EXPORT_DEFAULTS, **(params.get("export") or {})}),
+        report=freeze({**REPORT_DEFAULTS, **(params.get("report") or {})}),
+        objective=freeze({**OBJECTIVE_DEFAULTS, **(params.get("objective") or {})}),
+        county=str(county),
+        precinct_file=input_files["precinct_file"],
+        observer_export=input_files["observer_export"],
+        raw=freeze(params),
+    )
+
+
+def load_config(path=None):
+    """
+    Loads the config yaml file
+
+    Parameters
+    ----------
+    path: str or Path, optional
+        The parameters file. Defaults to config/parameters.yml
+
+    Returns
+    -------
+    Config
+        The parsed config. The same object is returned until the file changes.
+    """
+
+    path = Path(path or DEFAULT_CONFIG_PATH).resolve()
+
+    return read_config(path, path.stat().st_mtime_ns)
+
+
+def add_config_arguments(parser):
+    """
+    Adds the options the entry points share to an argparse parser: --config
+    for the parameters file, --mode for how observers are loaded, see
+    `get_observer_dataset`, and --distance to override the optimiser's
+    distance provider
+    """
+
+    parser.add_argument("--config", help="defaults to config/parameters.yml")
+    parser.add_argument("--mode", default="refresh")
+    parser.add_argument(
+        "--distance", choices=sorted(DISTANCES), help="defaults to the config's"
+    )
+
+    return parser
+
+
+def load_run_config(args):
+    """
+    Loads the config named by arguments parsed with `add_config_arguments`,
+    with the optimiser settings given on the command line in place of the
+    ones in the file
+    """
+
+    config = load_config(args.config)
+    if getattr(args, "distance", None) is not None:
+        config = replace(
+            config, optimiser=freeze({**config.optimiser, "distance": args.distance})
+        )
+
+    return config
@@ -0,0 +1,168 @@
+import numpy as np
+import pandas as pd
+
+from functools import lru_cache
+from pathlib import Path
+
+
+# zip code centroids for North Carolina, from the `zipcodes` package (MIT)
+GAZETTEER_PATH = Path(__file__).parent / "../data/00_raw/nc_zip_gazetteer.csv"
+EARTH_RADIUS_KM = 6371.0
+# distance to or from a zip code missing from the gazetteer. Further than any
+# two points on earth so unknown zip codes are always the last choice
+UNKNOWN_DISTANCE_KM = 50_000.0
+
+
+@lru_cache(maxsize=4)
+def load_gazetteer(path=GAZETTEER_PATH):
+    """
+    Loads the zip code gazetteer as a dataframe indexed by zip code with
+    "lat" and "lon" columns in degrees
+    """
+
+    gazetteer = pd.read_csv(path, dtype={"zip": "int64"})
+
+    return gazetteer.set_index("zip")[["lat", "lon"]]
+
+
+class ZipCodeDistance:
+    """
+    Absolute difference between zip codes. A rough proxy for travel distance
+    that needs no location data, see `get_zipcode_distance`.
+    """
+
+    def __call__(self, observer_zip, precinct_zip):
+        """
+        Distances between observers (rows) and polling locations (cols)
+        """
+
+        observer_zip = np.asarray(observer_zip)
+        precinct_zip = np.asarray(precinct_zip)
+
+        return np.abs(precinct_zip[np.newaxis, :] - observer_zip[:, np.newaxis])
+
+    def paired(self, observer_zip, precinct_zip):
+        """
+        Distance between each observer and the polling location in the same
+        position
+        """
+
+        return np.abs(np.asarray(precinct_zip) - np.asarray(observer_zip))
+
+
+class HaversineDistance:
+    """
+    Great circle distance in km between zip code centroids from a local
+    gazetteer. Any distance to or from a zip code missing from the gazetteer
+    is UNKNOWN_DISTANCE_KM, even between two unknown zip codes.
+
+    Parameters
+    ----------
+    gazetteer: pd.DataFrame, optional
+        Indexed by zip code with "lat" and "lon" columns. Defaults to the
+        bundled `GAZETTEER_PATH`
+    """
+
+    def __init__(self, gazetteer=None):
+
+        if gazetteer is None:
+            gazetteer = load_gazetteer()
+
+        lat = np.radians(gazetteer["lat"].values)
+        lon = np.radians(gazetteer["lon"].values)
+
+        self.zips = gazetteer.index.values
+        self.points = np.column_stack(
+            [np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)]
+        ).astype(np.float32)
+
+    def get_points(self, zips):
+        """
+        Unit vectors for the zip codes, shape (len(zips), 3), and a boolean
+        mask of the zip codes found in the gazetteer. Unknown zip codes get a
+        zero vector.
+        """
+
+        zips = np.asarray(zips)
+        index = pd.Index(self.zips).get_indexer(zips)
+        known = index >= 0
+
+        points = np.zeros((len(zips), 3), dtype=np.float32)
+        points[known] = self.points[index[known]]
+
+        return points, known
+
+    @staticmethod
+    def chord_to_km(chord):
+        """
+        Converts straight line distance between unit vectors to distance
+        along the earth's surface
+        """
+
+        return (2 * EARTH_RADIUS_KM * np.arcsin(np.minimum(chord / 2, 1))).astype(
+            np.float32
+        )
+
+    def __call__(self, observer_zip, precinct_zip):
+        """
+        Distances in km between observers (rows) and polling locations (cols)
+        """
+
+        # there are far fewer zip codes than observers or polling locations so
+        # only work out distances between distinct zip codes
+        observer_zip, observer_index = np.unique(observer_zip, return_inverse=True)
+        precinct_zip, precinct_index = np.unique(precinct_zip, return_inverse=True)
+
+        observer_points, observer_known = self.get_points(observer_zip)
+        precinct_points, precinct_known = self.get_points(precinct_zip)
+
+        chord_squared = np.zeros(
+            (len(observer_points), len(precinct_points)), dtype=np.float32
+        )
+        for axis in range(3):
+            chord_squared += np.square(
+                precinct_points[np.newaxis, :, axis]
+                - observer_points[:, np.newaxis, axis]
+            )
+        zip_distance = self.chord_to_km(np.sqrt(chord_squared))
+        zip_distance[~observer_known, :] = UNKNOWN_DISTANCE_KM
+        zip_distance[:, ~precinct_known] = UNKNOWN_DISTANCE_KM
+
+        return zip_distance[observer_index[:, np.newaxis], precinct_index]
+
+    def paired(self, observer_zip, precinct_zip):
+        """
+        Distance in km between each observer and the polling location in the
+        same position
+        """
+
+        observer_points, observer_known = self.get_points(observer_zip)
+        precinct_points, precinct_known = self.get_points(precinct_zip)
+        chord = np.linalg.norm(precinct_points - observer_points, axis=1)
+
+        return np.where(
+            observer_known & precinct_known,
+            self.chord_to_km(chord),
+            np.float32(UNKNOWN_DISTANCE_KM),
+        )
+
+
+# name in the optimiser config -> distance provider
+DISTANCE_PROVIDERS = {"zipcode": ZipCodeDistance, "haversine": HaversineDistance}
+
+
+def get_distance(distance=None):
+    """
+    The distance provider for `distance`: None for ZipCodeDistance, a name
+    from DISTANCE_PROVIDERS, as set in the optimiser config, or a provider,
+    which is returned as it is
+    """
+
+    if distance is None:
+        return ZipCodeDistance()
+    if isinstance(distance, str):
+        if distance not in DISTANCE_PROVIDERS:
+            raise ValueError(f"Unknown distance provider: {distance}")
+        return DISTANCE_PROVIDERS[distance]()
+
+    return distance
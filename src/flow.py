@@ -0,0 +1,690 @@
+import numpy as np
+
+from src.candidates import get_candidate_budget, get_spread_candidates
+from src.config import load_config
+from src.distance import get_distance
+from src.instrumentation import count, observe, timer
+from src.interning import NameIndex, isin
+from src.metrics import OBSERVER_COLUMNS, get_priority_tiers
+
+
+# slot kind -> (location in the config, precinct columns it fills). A pair is
+# an outside AM and PM slot held by the same all day observer
+SLOT_KINDS = {
+    "inside": ("inside", ["inside_observer"]),
+    "pair": ("outside_both", ["outside_am_observer", "outside_pm_observer"]),
+    "am": ("outside_am", ["outside_am_observer"]),
+    "pm": ("outside_pm", ["outside_pm_observer"]),
+}
+# observer availability -> the slot kinds they can fill
+UNIT_KINDS = {
+    "inside_all_day": ["inside"],
+    "outside_all_day": ["pair", "am", "pm"],
+    "outside_AM": ["am"],
+    "outside_PM": ["pm"],
+}
+# distances are scaled to integers for the solver
+DISTANCE_SCALE = 100
+# closest slots per unit, and units per slot, when n_candidates is not given
+FLOW_CANDIDATES = 10
+# the solver works in float64, which holds every integer up to 2**53 exactly
+MAX_EXACT_COST = 2 ** 53
+
+
+def get_slot_mask(rows, n_precincts):
+    """
+    The slots that may be changed, one column per OBSERVER_COLUMNS, from a
+    mask of the precincts or of the slots. None allows every slot.
+    """
+
+    if rows is None:
+        return np.ones((n_precincts, len(OBSERVER_COLUMNS)), dtype=bool)
+
+    rows = np.asarray(rows, dtype=bool)
+    if rows.ndim == 1:
+        return np.repeat(rows[:, np.newaxis], len(OBSERVER_COLUMNS), axis=1)
+
+    return rows
+
+
+def get_flow_units(precinct, observers, rows):
+    """
+    The observers that can be moved: everyone in a slot in `rows`, as
+    returned by `get_slot_mask`, and everyone without a slot, unless they
+    also hold a slot elsewhere
+
+    Returns
+    -------
+    dict
+        "observer" (position in `observers`), "kind" (key of UNIT_KINDS),
+        "legal", "from_county" and "zip" arrays, one entry per unit, "unit",
+        the unit of each observer or -1, and the observers' "name_index"
+    """
+
+    name_index = NameIndex(observers["name"].values)
+    held = name_index.encode(precinct[OBSERVER_COLUMNS].values[~rows].ravel())
+    # empty slots (-1) land on the padding at the end
+    held_elsewhere = np.zeros(len(observers) + 1, dtype=bool)
+    held_elsewhere[held] = True
+    movable = ~held_elsewhere[:-1]
+
+    kind = np.full(len(observers), "", dtype=object)
+    for unit_kind in reversed(list(UNIT_KINDS)):
+        kind[observers[unit_kind].values.astype(bool)] = unit_kind
+    movable &= kind != ""
+
+    observer = np.flatnonzero(movable)
+    unit = np.full(len(observers) + 1, -1)
+    unit[observer] = np.arange(len(observer))
+
+    return {
+        "observer": observer,
+        "kind": kind[observer],
+        "legal": observers["legal_background"].values.astype(bool)[observer],
+        "from_county": observers["from_county"].values.astype(bool)[observer],
+        "zip": observers["post_code"].values[observer],
+        "unit": unit,
+        "name_index": name_index,
+    }
+
+
+def get_flow_slots(precinct, rows, units, locations):
+    """
+    The slots in `rows`, as returned by `get_slot_mask`. Precincts with the
+    same observer in the AM and PM slots have a pair slot, which is only
+    included if both are in `rows`, the others an AM and a PM slot. Slots
+    held by someone who can't be moved are left out.
+
+    Returns
+    -------
+    dict
+        "row" (position in `precinct`), "kind" (key of SLOT_KINDS),
+        "legal" (1 or 0 if the slot needs a legal or non-legal observer, -1
+        for empty slots), "from_county", "zip", "unit" (the current unit or
+        -1) and "weight" (the number of precinct columns it fills) arrays
+    """
+
+    am = precinct["outside_am_observer"].values
+    paired = (am == precinct["outside_pm_observer"].values) & (am != "")
+    inside_rows, am_rows, pm_rows = rows.T
+    kind_rows = {
+        "inside": inside_rows,
+        "pair": am_rows & pm_rows & paired,
+        "am": am_rows & ~paired,
+        "pm": pm_rows & ~paired,
+    }
+
+    slots = {key: [] for key in ["row", "kind", "legal", "from_county", "unit"]}
+    for kind, (location, columns) in SLOT_KINDS.items():
+        row = np.flatnonzero(kind_rows[kind])
+        names = precinct[columns[0]].values[row]
+        legal = precinct[columns[0].replace("_observer", "_legal")].values[row]
+        unit = units["unit"][units["name_index"].encode(names)]
+
+        keep = (names == "") | (unit >= 0)
+        slots["row"].append(row[keep])
+        slots["kind"].append(np.full(keep.sum(), kind, dtype=object))
+        slots["legal"].append(np.where(names == "", -1, legal.astype(bool))[keep])
+        slots["from_county"].append(
+            np.full(keep.sum(), bool(locations[location]["from_county"]))
+        )
+        slots["unit"].append(unit[keep])
+
+    slots = {key: np.concatenate(values) for key, values in slots.items()}
+    slots["zip"] = precinct["Zip"].values[slots["row"]]
+    slots["weight"] = np.array([len(SLOT_KINDS[kind][1]) for kind in slots["kind"]])
+
+    return slots
+
+
+def get_flow_groups(units, slots, constrained=True):
+    """
+    Splits the slots into groups of the same kind, legal requirement and
+    `from_county` requirement, which can all be filled by the same units.
+    Unless `constrained`, any unit with the right availability may fill a
+    slot whatever its legal and `from_county` requirements.
+
+    Returns
+    -------
+    list of tuple
+        (slots, units) of each group that any unit can fill
+    """
+
+    slot_legal = slots["legal"] if constrained else np.full(len(slots["row"]), -1)
+    slot_county = slots["from_county"] & constrained
+
+    groups = []
+    keys = sorted(set(zip(slots["kind"], slot_legal, slot_county)))
+    for kind, legal, from_county in keys:
+        group = np.flatnonzero(
+            (slots["kind"] == kind)
+            & (slot_legal == legal)
+            & (slot_county == from_county)
+        )
+        unit_kinds = [name for name, kinds in UNIT_KINDS.items() if kind in kinds]
+        allowed = isin(units["kind"], unit_kinds)
+        if legal >= 0:
+            allowed &= units["legal"] == bool(legal)
+        if from_county:
+            allowed &= units["from_county"]
+        if allowed.any():
+            groups.append((group, np.flatnonzero(allowed)))
+
+    return groups
+
+
+class FlowCandidates:
+    """
+    The sparse edges of the flow. In each group of `get_flow_groups`, every
+    unit is linked to its closest slots and every slot to its closest units,
+    so that slots far from most observers are still linked to someone. Units
+    are also linked to the slot they currently hold.
+
+    Parameters
+    ----------
+    units, slots: dict
+        As returned by `get_flow_units` and `get_flow_slots`
+    n_candidates: int
+        The number of closest slots kept for each unit, and of closest units
+        for each slot, in each group
+    distance: callable
+        The distance provider, see `src.distance`
+    chunk_size: int, optional
+        The number of zip codes to compute dense distances for at once
+    constrained: bool, optional
+        See `get_flow_groups`
+
+    Attributes
+    ----------
+    unit, slot, cost: np.array
+        One entry per edge, ordered by unit then slot. Costs are distances
+        scaled by DISTANCE_SCALE
+    """
+
+    def __init__(
+        self, units, slots, n_candidates, distance, chunk_size=1024, constrained=True
+    ):
+        self.units = units
+        self.slots = slots
+        self.n_candidates = n_candidates
+        self.distance = distance
+        self.chunk_size = chunk_size
+        self.groups = get_flow_groups(units, slots, constrained)
+
+        self.unit = np.array([], dtype=np.int64)
+        self.slot = np.array([], dtype=np.int64)
+
+        current = np.flatnonzero(slots["unit"] >= 0)
+        edges = [(slots["unit"][current], current)]
+        for slot, unit in self.groups:
+            edges += self.get_edges(unit, slot)
+        self.add_edges(edges)
+
+    def __repr__(self):
+        return f"FlowCandidates({len(self.unit)} edges, {len(self.groups)} groups)"
+
+    def get_edges(self, unit, slot):
+        """
+        Links each of the units `unit` to its closest slots of `slot`, and
+        each of those slots to its closest units. Units, or slots, in the same
+        zip code are linked to different slots, see `get_spread_candidates`
+
+        Returns
+        -------
+        list of tuple
+            (unit, slot) arrays of the edges
+        """
+
+        unit_zip = self.units["zip"][unit]
+        slot_zip = self.slots["zip"][slot]
+
+        unit_rows, slot_cols, _ = get_spread_candidates(
+            unit_zip,
+            slot_zip,
+            min(self.n_candidates, len(slot)),
+            self.distance,
+            self.chunk_size,
+        )
+        slot_rows, unit_cols, _ = get_spread_candidates(
+            slot_zip,
+            unit_zip,
+            min(self.n_candidates, len(unit)),
+            self.distance,
+            self.chunk_size,
+        )
+
+        return [(unit[unit_rows], slot[slot_cols]), (unit[unit_cols], slot[slot_rows])]
+
+    def add_edges(self, edges):
+        """
+        Adds edges, dropping any that are already there, and works out the
+        cost of every edge
+        """
+
+        n_slots = len(self.slots["row"])
+        key = np.concatenate(
+            [self.unit * n_slots + self.slot]
+            + [
+                np.asarray(unit, dtype=np.int64) * n_slots + slot
+                for unit, slot in edges
+            ]
+        )
+        key = np.unique(key)
+        self.unit, self.slot = key // n_slots, key % n_slots
+
+        cost = self.distance.paired(
+            self.units["zip"][self.unit], self.slots["zip"][self.slot]
+        )
+        self.cost = np.rint(np.asarray(cost) * DISTANCE_SCALE).astype(np.int64)
+
+    def expand(self, matched):
+        """
+        Links the empty slots and the free units of every group that has
+        both to their closest free units and empty slots, as they may be
+        missing an edge that is worth taking.
+
+        Parameters
+        ----------
+        matched: np.array
+            The unit in each slot, -1 if it is empty, from `solve_flow`
+
+        Returns
+        -------
+        bool
+            Whether any edges were added
+        """
+
+        free = np.ones(len(self.units["observer"]), dtype=bool)
+        free[matched[matched >= 0]] = False
+
+        edges = []
+        for slot, unit in self.groups:
+            empty_slot = slot[matched[slot] < 0]
+            free_unit = unit[free[unit]]
+            if len(empty_slot) > 0 and len(free_unit) > 0:
+                edges += self.get_edges(free_unit, empty_slot)
+
+        n_edges = len(self.unit)
+        if edges:
+            self.add_edges(edges)
+
+        return len(self.unit) > n_edges
+
+
+def solve_matching(n_units, n_slots, edge_unit, edge_slot, edge_weight):
+    """
+    Matches each unit to at most one slot, minimising the total weight, as a
+    min weight full bipartite matching where each unit has a dummy slot of its
+    own for leaving it out
+
+    Returns
+    -------
+    np.array
+        The unit in each slot, -1 if it is empty
+    """
+    from scipy import sparse
+    from scipy.sparse.csgraph import min_weight_full_bipartite_matching
+
+    dummy = np.arange(n_units)
+    weight = np.concatenate([edge_weight, np.zeros(n_units, dtype=np.int64)])
+    # scipy drops zero weight edges so shift all of them up. Every unit is
+    # matched once so this doesn't change the optimal matching
+    weight = weight - weight.min() + 1
+    # the total weight of a matching must be exact in float64
+    if n_units * int(weight.max()) >= MAX_EXACT_COST:
+        raise ValueError(
+            f"Flow weights up to {weight.max()} for {n_units} observers are too "
+            "large to solve exactly, use smaller objective weights"
+        )
+    weight = weight.astype(float)
+    rows = np.concatenate([edge_unit, dummy])
+    cols = np.concatenate([edge_slot, n_slots + dummy])
+    matrix = sparse.csr_matrix(
+        (weight, (rows, cols)), shape=(n_units, n_slots + n_units)
+    )
+
+    unit, slot = min_weight_full_bipartite_matching(matrix)
+
+    matched = np.full(n_slots, -1)
+    filled = slot < n_slots
+    matched[slot[filled]] = unit[filled]
+
+    return matched
+
+
+def solve_flow(n_units, n_slots, edge_unit, edge_slot, edge_cost, reward):
+    """
+    Sends one unit of flow from each observer either to a slot or straight to
+    the sink, minimising the edge costs less the rewards of the filled slots.
+    Each connected part of the flow, e.g. the inside and the outside slots,
+    is solved on its own with `solve_matching` (requires `scipy`).
+
+    Returns
+    -------
+    np.array
+        The unit in each slot, -1 if it is empty
+    """
+    from scipy import sparse
+    from scipy.sparse.csgraph import connected_components
+
+    graph = sparse.coo_matrix(
+        (np.ones(len(edge_unit)), (edge_unit, n_units + edge_slot)),
+        shape=(n_units + n_slots, n_units + n_slots),
+    )
+    _, labels = connected_components(graph, directed=False)
+
+    edge_weight = edge_cost - reward[edge_slot]
+    edge_label = labels[edge_unit]
+    order = np.argsort(edge_label, kind="stable")
+    bounds = np.flatnonzero(np.diff(edge_label[order])) + 1
+
+    matched = np.full(n_slots, -1)
+    for edge in np.split(order, bounds):
+        if len(edge) == 0:
+            continue
+        # renumber the units and slots of the part from 0
+        unit, unit_id = np.unique(edge_unit[edge], return_inverse=True)
+        slot, slot_id = np.unique(edge_slot[edge], return_inverse=True)
+        part = solve_matching(
+            len(unit), len(slot), unit_id, slot_id, edge_weight[edge]
+        )
+        filled = part >= 0
+        matched[slot[filled]] = unit[part[filled]]
+
+    return matched
+
+
+def get_flow_rewards(slots, edge_unit, edge_cost, n_units):
+    """
+    The integer edge costs and slot rewards of "flow", where filling a slot
+    in a higher priority tier is worth more than any change in distance
+
+    Parameters
+    ----------
+    slots: dict
+        As returned by `get_flow_slots`, with the priority "tier" of each
+        slot, 0 for the highest
+    edge_unit, edge_cost: np.array
+        The unit and cost of each edge, see `FlowCandidates`
+    n_units: int
+        The number of units
+
+    Returns
+    -------
+    edge_cost: np.array
+        The costs, divided by `scale` and rounded
+    reward: np.array
+        What filling each slot is worth
+    scale: int
+        What the costs were divided by, 1 unless they had to be
+
+    Note
+    ----
+    Any two matchings differ in total cost by less than `span`, the sum of
+    the costliest edge of each unit plus one. A slot in tier t of n_tiers
+    earns weight * span * (2 * n_tiers - t), so one more tier is worth more
+    than any change in distance. The solver needs n_units times the largest
+    edge weight, the largest reward plus the largest cost, to stay below
+    MAX_EXACT_COST, or else costs that differ only in distance may compare
+    equal. While it doesn't, the costs are halved, so distances are compared
+    to the nearest `scale` / DISTANCE_SCALE instead.
+    """
+
+    n_tiers = int(slots["tier"].max(initial=0)) + 1
+    max_reward = int(slots["weight"].max(initial=0)) * 2 * n_tiers
+    scale = 1
+    while True:
+        cost = np.rint(edge_cost / scale).astype(np.int64)
+        unit_cost = np.zeros(n_units, dtype=np.int64)
+        np.maximum.at(unit_cost, edge_unit, cost)
+        span = int(unit_cost.sum()) + 1
+        max_weight = max_reward * span + int(cost.max(initial=0)) + 1
+        if n_units * max_weight < MAX_EXACT_COST or span == 1:
+            break
+        scale *= 2
+
+    reward = slots["weight"] * span * (2 * n_tiers - slots["tier"])
+
+    return cost, reward.astype(np.int64), scale
+
+
+def get_weighted_costs(units, slots, edge_unit, edge_slot, edge_cost, objective):
+    """
+    The cost of each edge under the weighted objective: the distance less what
+    filling the slot is worth, see `optimise_flow`
+
+    Parameters
+    ----------
+    units, slots: dict
+        As returned by `get_flow_units` and `get_flow_slots`, with a
+        "priority" score for each slot, 1 for the highest priority precinct
+        and 0 for the lowest
+    edge_unit, edge_slot, edge_cost: np.array
+        As returned by `get_flow_edges`
+    objective: dict
+        The weights, see `Config.objective`
+
+    Returns
+    -------
+    np.array
+        Integer costs in the units of DISTANCE_SCALE
+    """
+
+    worth = slots["weight"][edge_slot] * (
+        objective["fill"]
+        + objective["priority"] * slots["priority"][edge_slot]
+        + objective["legal"] * units["legal"][edge_unit]
+    )
+    out_of_county = slots["from_county"][edge_slot] & ~units["from_county"][edge_unit]
+    cost = (
+        objective["distance"] * edge_cost
+        + DISTANCE_SCALE * (objective["from_county"] * out_of_county - worth)
+    )
+
+    return np.rint(cost).astype(np.int64)
+
+
+def optimise_flow(
+    precinct,
+    observers,
+    rows=None,
+    locations=None,
+    n_candidates=None,
+    max_memory_mb=None,
+    distance=None,
+    method="flow",
+    objective=None,
+    **options,
+):
+    """
+    Reassigns the inside, outside all day, AM and PM slots in one min cost
+    flow instead of bucket by bucket. All day observers compete with half day
+    observers for the AM and PM slots, and observers can move to a higher
+    priority precinct that was left empty.
+
+    Parameters
+    ----------
+    precinct: pd.DataFrame
+        The precincts after the basic assignment
+    observers: pd.DataFrame
+        The list of all observers, with their availability
+    rows: np.array, optional
+        Boolean mask of the precincts, or of the slots with one column per
+        OBSERVER_COLUMNS, that may be changed. Defaults to all
+    locations: dict, optional
+        The location parameters, for their `from_county` requirement. Taken
+        from the config if not provided
+    n_candidates: int, optional
+        Each observer is linked to their `n_candidates` closest slots of each
+        kind, plus their current one, and each slot to its `n_candidates`
+        closest observers. Defaults to FLOW_CANDIDATES
+    max_memory_mb: float, optional
+        If given instead of `n_candidates`, uses fewer than FLOW_CANDIDATES
+        if they don't fit in this much memory
+    distance: callable or string, optional
+        The distance provider, see `src.distance`, or its name in
+        DISTANCE_PROVIDERS. Defaults to ZipCodeDistance
+    method: string, optional
+        "flow" (default) or "weighted", see the note
+    objective: dict, optional
+        The weights for "weighted". Taken from the config if not provided
+    **options:
+        Ignored, so the optimiser settings can be passed on as they are
+
+    Returns
+    -------
+    pd.DataFrame
+        A copy of `precinct` with the reassigned observers
+
+    Note
+    ----
+    With "flow", filling a slot earns a reward that outweighs any change in
+    distance, so the solver fills as many slots as it can, then the highest
+    priority ones, and only then minimises the distance. Precincts with the
+    same priority compete on distance alone. The costs are kept as integers
+    small enough to be exact in float64, see `get_flow_rewards`. Filled slots
+    keep their legal or non-legal status and slots of locations with
+    `from_county` only take observers from the county.
+
+    With "weighted", these are traded off with the weights in `objective`
+    instead. A slot earns `fill`, plus up to `priority` for its precinct's
+    priority, plus `legal` for a legal observer. An observer from outside the
+    county costs `from_county` where the location wants them from the county,
+    and each unit of distance costs `distance`. A slot is only filled if it
+    is worth more than it costs. With `warm_start`, the current observers are
+    kept as candidates so the result scores at least as well as the basic
+    assignment. Without it, every slot is solved from the candidates alone.
+
+    Either way pair slots stay pairs, so an all day observer is never split
+    over two precincts.
+
+    The flow only has edges between the closest observers and slots, see
+    `FlowCandidates`, and is solved as a sparse min weight bipartite matching
+    (requires `scipy`). Empty slots and free observers left over are then
+    linked to each other and the flow is solved again, for as long as this
+    fills more slots.
+    """
+
+    if method not in ["flow", "weighted"]:
+        raise ValueError(f"Unknown flow method: {method}")
+    if locations is None:
+        locations = load_config().locations
+    if objective is None and method == "weighted":
+        objective = load_config().objective
+    distance = get_distance(distance)
+    rows = get_slot_mask(rows, len(precinct))
+
+    units = get_flow_units(precinct, observers, rows)
+    slots = get_flow_slots(precinct, rows, units, locations)
+    n_units, n_slots = len(units["observer"]), len(slots["row"])
+    count("optimise.flow.units", n_units)
+    count("optimise.flow.slots", n_slots)
+    if n_units == 0 or n_slots == 0:
+        return precinct.copy()
+
+    current = slots["unit"]
+    if method == "weighted" and not objective["warm_start"]:
+        slots["unit"] = np.full(n_slots, -1)
+
+    chunk_size = 1024
+    if n_candidates is None and max_memory_mb is not None:
+        n_candidates, chunk_size = get_candidate_budget(
+            n_units, n_slots, max_memory_mb
+        )
+        # the leftover slots and observers are linked up later, so more
+        # candidates only slow the solver down
+        n_candidates = min(n_candidates, FLOW_CANDIDATES)
+    elif n_candidates is None:
+        n_candidates = FLOW_CANDIDATES
+
+    with timer("optimise.flow.candidates"):
+        candidates = FlowCandidates(
+            units, slots, n_candidates, distance, chunk_size, method == "flow"
+        )
+
+    n_precincts = len(precinct)
+    rank = get_priority_tiers(precinct["Priority"].values, n_tiers=n_precincts)
+    slots["priority"] = 1 - rank[slots["row"]] / max(n_precincts - 1, 1)
+    # precincts with the same priority share a tier, 0 is the highest
+    _, tier = np.unique(precinct["Priority"].values, return_inverse=True)
+    slots["tier"] = tier[slots["row"]]
+
+    scale = 1
+    n_filled = -1
+    while True:
+        if method == "flow":
+            edge_cost, reward, scale = get_flow_rewards(
+                slots, candidates.unit, candidates.cost, n_units
+            )
+            observe("optimise.flow.distance_scale", scale)
+        else:
+            edge_cost = get_weighted_costs(
+                units,
+                slots,
+                candidates.unit,
+                candidates.slot,
+                candidates.cost,
+                objective,
+            )
+            reward = np.zeros(n_slots, dtype=np.int64)
+
+        with timer("optimise.flow.solve"):
+            matched = solve_flow(
+                n_units, n_slots, candidates.unit, candidates.slot, edge_cost, reward
+            )
+
+        # stop once the closest empty slots and free observers are not worth
+        # pairing up
+        if (matched >= 0).sum() <= n_filled:
+            break
+        n_filled = (matched >= 0).sum()
+        with timer("optimise.flow.candidates"):
+            if not candidates.expand(matched):
+                break
+        count("optimise.flow.expansions")
+
+    count("optimise.flow.edges", len(candidates.unit))
+
+    before = current >= 0
+    after = matched >= 0
+    count("optimise.flow.filled_before", before.sum())
+    count("optimise.flow.filled_after", after.sum())
+    # the edges are ordered by unit then slot
+    edge = np.searchsorted(
+        candidates.unit * n_slots + candidates.slot,
+        matched[after] * n_slots + np.flatnonzero(after),
+    )
+    observe(
+        "optimise.flow.objective",
+        (edge_cost[edge] - reward[after]).sum() * scale / DISTANCE_SCALE,
+    )
+    observe(
+        "optimiser.distance_before",
+        distance.paired(units["zip"][current[before]], slots["zip"][before]),
+    )
+    observe(
+        "optimiser.distance_after",
+        distance.paired(units["zip"][matched[after]], slots["zip"][after]),
+    )
+
+    names = np.append(observers["name"].values[units["observer"]], "")
+    legal = np.append(units["legal"], False)
+
+    precinct = precinct.copy()
+    for kind, (_, columns) in SLOT_KINDS.items():
+        slot = np.flatnonzero(slots["kind"] == kind)
+        row = slots["row"][slot]
+        # empty slots land on the padding at the end
+        unit = np.where(matched[slot] >= 0, matched[slot], n_units)
+        for column in columns:
+            values = precinct[column].values.copy()
+            values[row] = names[unit]
+            precinct[column] = values
+
+            legal_column = column.replace("_observer", "_legal")
+            values = precinct[legal_column].values.copy()
+            filled = matched[slot] >= 0
+            values[row[filled]] = legal[unit[filled]]
+            precinct[legal_column] = values
+
+    return precinct
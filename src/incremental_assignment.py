@@ -0,0 +1,198 @@
+import argparse
+import logging
+import src.basic_assignment as ba
+import pandas as pd
+import numpy as np
+
+from src.config import add_config_arguments, load_config, load_run_config
+from src.instrumentation import get_report, reporting
+from src.interning import isin
+from src.metrics import get_assignment_metrics
+from src.optimal_assignment import (
+    OBSERVER_COLUMNS,
+    get_observer_locations,
+    optimise_buckets,
+)
+from src.output import OUTPUT_DIR, read_frame, write_outputs
+
+logger = logging.getLogger(__name__)
+
+# observer columns that use up an observer's morning and afternoon
+AM_COLUMNS = ["inside_observer", "outside_am_observer"]
+PM_COLUMNS = ["inside_observer", "outside_pm_observer"]
+
+
+def get_previous_assignment(path=None):
+    """
+    Loads the precincts saved by a previous run. Defaults to
+    `assigned_precincts.xlsx` in OUTPUT_DIR
+    """
+
+    precinct = read_frame(path or OUTPUT_DIR / "assigned_precincts.xlsx")
+    precinct[OBSERVER_COLUMNS] = precinct[OBSERVER_COLUMNS].fillna("").astype(str)
+
+    return precinct
+
+
+def get_roster_changes(precinct, observers):
+    """
+    Compares a previous assignment with the current observers
+
+    Returns
+    -------
+    added: np.array
+        Names of observers that are not assigned to any precinct
+    removed: np.array
+        Names of assigned observers that are no longer in `observers`
+    """
+
+    assigned = pd.unique(precinct[OBSERVER_COLUMNS].values.ravel())
+    assigned = assigned[assigned != ""]
+    names = observers["name"].values
+
+    added = names[~isin(names, assigned)]
+    removed = assigned[~isin(assigned, names)]
+
+    return added, removed
+
+
+def repair_assignment(
+    precinct,
+    observers,
+    removed=(),
+    config=None,
+    optimise=True,
+    exclude=(),
+    check_roster=True,
+):
+    """
+    Updates a previous assignment after observers drop out or sign up. Only
+    the slots that were vacated or still empty are filled, so observers who
+    already have a precinct keep it.
+
+    Parameters
+    ----------
+    precinct: pd.DataFrame
+        The precincts from a previous run, see `get_previous_assignment`
+    observers: pd.DataFrame
+        The current observers, as returned by `get_observer_dataset`
+    removed: list, optional
+        Names of observers who dropped out but are still in `observers`.
+        Assigned observers missing from `observers` are also removed, unless
+        `check_roster` is False.
+    config: Config, optional
+        The loaded config. See `src.config.load_config`
+    optimise: bool, optional
+        Run the optimiser over the refilled precincts
+    exclude: list, optional
+        Names of observers who stay in `observers` but are not used to refill
+        slots, e.g. someone who was just taken off a precinct
+    check_roster: bool, optional
+        Look for assigned observers missing from `observers`. Callers that
+        keep the two in step, such as the service, can skip this.
+
+    Returns
+    -------
+    precinct: pd.DataFrame
+    observers: pd.DataFrame
+        Copies of the inputs with the repaired assignment
+    changed: np.array
+        Boolean mask of the precincts whose observers changed
+
+    Note
+    ----
+    Vacated slots are refilled by `run_ordered_assignment` in priority order,
+    with everyone already at a precinct marked as taken and everyone else as
+    free, whatever `observers` says. The optimiser then only swaps observers
+    between the refilled slots, so an observer keeps their slot even if
+    another slot at the same precinct was refilled.
+    """
+
+    if config is None:
+        config = load_config()
+
+    removed = np.asarray(removed, dtype=object)
+    if check_roster:
+        _, missing = get_roster_changes(precinct, observers)
+        removed = pd.unique(np.concatenate([missing.astype(object), removed]))
+
+    precinct = precinct.sort_values("Priority", kind="stable").reset_index(drop=True)
+    previous = precinct[OBSERVER_COLUMNS].values.copy()
+
+    vacated = isin(previous, removed)
+    precinct[OBSERVER_COLUMNS] = np.where(vacated, "", previous)
+
+    observers = observers[~observers["name"].isin(removed)].copy()
+    names = observers["name"].values
+    excluded = isin(names, exclude)
+    shifts = [("assigned_am", AM_COLUMNS), ("assigned_pm", PM_COLUMNS)]
+    for assignment_col, columns in shifts:
+        taken = isin(names, precinct[columns].values)
+        observers[assignment_col] = np.where(taken | excluded, True, None)
+
+    precinct, observers = ba.run_ordered_assignment(precinct, observers, config)
+    if excluded.any():
+        for assignment_col, columns in shifts:
+            taken = isin(names, precinct[columns].values)
+            observers[assignment_col] = np.where(
+                excluded & ~taken, None, observers[assignment_col].values
+            )
+    changed_slots = precinct[OBSERVER_COLUMNS].values != previous
+    changed = changed_slots.any(axis=1)
+
+    if optimise and changed.any():
+        options = {**config.optimiser, "n_workers": 1}
+        precinct = optimise_buckets(
+            precinct,
+            observers,
+            rows=changed_slots,
+            locations=config.locations,
+            objective=config.objective,
+            **options,
+        )
+        observers = get_observer_locations(precinct, observers)
+
+    return precinct, observers, changed
+
+
+def main(args=None):
+    """
+    Updates the last saved assignment after observers drop out or sign up
+    """
+
+    parser = add_config_arguments(
+        argparse.ArgumentParser(description="Update the last assignment")
+    )
+    args = parser.parse_args(args)
+
+    config = load_run_config(args)
+    with reporting("incremental_assignment", config, OUTPUT_DIR):
+        observers = ba.load_county_observers(config, args.mode)
+        precinct = get_previous_assignment(
+            OUTPUT_DIR / f"assigned_precincts.{config.export['format']}"
+        )
+
+        added, removed = get_roster_changes(precinct, observers)
+        logger.info("%d unassigned observers, %d removed", len(added), len(removed))
+
+        precinct, observers, changed = repair_assignment(
+            precinct, observers, config=config
+        )
+        logger.info("%d precincts changed", changed.sum())
+        get_report().add_metrics(
+            "assignment",
+            get_assignment_metrics(
+                precinct, observers, config.optimiser["distance"]
+            ),
+        )
+
+        write_outputs(
+            {"assigned_precincts": precinct, "assigned_observers": observers},
+            **config.export,
+        )
+
+        print(precinct[changed])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+import json
+import logging
+import numpy as np
+import time
+
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+from pathlib import Path
+
+
+logger = logging.getLogger(__name__)
+
+
+class RunReport:
+    """
+    Collects the timings and counters of a run so they can be saved as a
+    JSON report
+
+    Parameters
+    ----------
+    name: string
+        The name of the run, e.g. the entry point
+    """
+
+    def __init__(self, name="run"):
+        self.name = name
+        self.started = datetime.now().isoformat(timespec="seconds")
+        self.stages = {}
+        self.counters = {}
+        self.distributions = {}
+        self.metrics = {}
+
+    def __repr__(self):
+        return f"RunReport({self.name}, {len(self.stages)} stages)"
+
+    @contextmanager
+    def timer(self, name):
+        """
+        Adds the time spent in the `with` block to the stage `name`
+        """
+
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            seconds = time.perf_counter() - start
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+            logger.debug("%s took %.3fs", name, seconds)
+
+    def count(self, name, n=1):
+        """
+        Adds `n` to the counter `name`
+        """
+
+        self.counters[name] = self.counters.get(name, 0) + int(n)
+
+    def observe(self, name, values):
+        """
+        Tracks the count, total, min and max of the values seen for `name`,
+        e.g. cycle sizes
+        """
+
+        values = np.atleast_1d(values).tolist()
+        if not values:
+            return
+
+        summary = self.distributions.setdefault(
+            name, {"count": 0, "total": 0, "min": values[0], "max": values[0]}
+        )
+        summary["count"] += len(values)
+        summary["total"] += sum(values)
+        summary["min"] = min(summary["min"], min(values))
+        summary["max"] = max(summary["max"], max(values))
+
+    def add_metrics(self, name, metrics):
+        """
+        Stores a dict of quality metrics, see `src.metrics`
+        """
+
+        self.metrics[name] = metrics
+
+    def merge(self, other, prefix=""):
+        """
+        Adds the stages, counters and distributions of another report, e.g.
+        one collected in a worker process, with `prefix` before their names
+        """
+
+        other = other if isinstance(other, dict) else other.to_dict()
+
+        for name, seconds in other["stages"].items():
+            self.stages[prefix + name] = self.stages.get(prefix + name, 0.0) + seconds
+        for name, n in other["counters"].items():
+            self.count(prefix + name, n)
+        for name, summary in other["distributions"].items():
+            current = self.distributions.get(prefix + name)
+            if current is None:
+                self.distributions[prefix + name] = dict(summary)
+            else:
+                current["count"] += summary["count"]
+                current["total"] += summary["total"]
+                current["min"] = min(current["min"], summary["min"])
+                current["max"] = max(current["max"], summary["max"])
+        for name, metrics in other.get("metrics", {}).items():
+            self.metrics[prefix + name] = metrics
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "started": self.started,
+            "stages": dict(self.stages),
+            "counters": dict(self.counters),
+            "distributions": {
+                name: dict(summary) for name, summary in self.distributions.items()
+            },
+            "metrics": dict(self.metrics),
+        }
+
+    def save(self, path):
+        """
+        Writes the report as JSON
+        """
+
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(self.to_dict(), indent=2))
+
+        return path
+
+
+_report = RunReport()
+
+
+def get_report():
+    """
+    The report of the current run. Library code records into this so callers
+    do not need to pass a report around.
+    """
+
+    return _report
+
+
+def start_report(name="run"):
+    """
+    Replaces the current report with an empty one
+    """
+
+    global _report
+    _report = RunReport(name)
+
+    return _report
+
+
+@contextmanager
+def collect_report(name="run"):
+    """
+    Records into a new report inside the `with` block and then restores the
+    current one. Used to collect what a single optimiser bucket records.
+    """
+
+    global _report
+    previous = _report
+    _report = RunReport(name)
+    try:
+        yield _report
+    finally:
+        _report = previous
+
+
+def timer(name):
+    """
+    Times the `with` block as stage `name` of the current report
+    """
+
+    return get_report().timer(name)
+
+
+def timed(name):
+    """
+    Decorator that times each call as stage `name` of the current report
+    """
+
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with get_report().timer(name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def count(name, n=1):
+    get_report().count(name, n)
+
+
+def observe(name, values):
+    get_report().observe(name, values)
+
+
+@contextmanager
+def profile(profiler, path):
+    """
+    Profiles the `with` block
+
+    Parameters
+    ----------
+    profiler: string or None
+        "cprofile" writes a pstats file, "pyinstrument" (requires
+        `pyinstrument`) writes an html report. Does nothing if None
+    path: str or Path
+        Where to write the profile, without a suffix
+    """
+
+    if profiler is None:
+        yield
+        return
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    if profiler == "cprofile":
+        import cProfile
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(path.with_suffix(".pstats"))
+    elif profiler == "pyinstrument":
+        from pyinstrument import Profiler
+
+        profiler = Profiler()
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            path.with_suffix(".html").write_text(profiler.output_html())
+    else:
+        raise ValueError(f"Unknown profiler: {profiler}")
+
+
+@contextmanager
+def reporting(name, config, output_dir):
+    """
+    Sets up logging and a fresh report for an entry point. The report is
+    written to `output_dir`/`name`_report.json when the `with` block ends,
+    along with a profile if one is set in the config.
+
+    Parameters
+    ----------
+    name: string
+        The name of the entry point
+    config: Config
+        The loaded config. Uses the `report` block
+    output_dir: str or Path
+        Where to write the report
+    """
+
+    settings = config.report
+    logging.basicConfig(
+        level=settings["log_level"],
+        format="%(asctime)s %(name)s %(levelname)s %(message)s",
+    )
+
+    report = start_report(name)
+    output_dir = Path(output_dir)
+    try:
+        with profile(settings["profile"], output_dir / f"{name}_profile"):
+            with report.timer("total"):
+                yield report
+    finally:
+        path = report.save(output_dir / f"{name}_report.json")
+        logger.info("Run report written to %s", path)
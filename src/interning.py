@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+
+
+class NameIndex:
+    """
+    Maps names to dense int32 ids, the position of the name's first
+    occurrence. Assignment and optimisation work on the ids so names are only
+    compared once, when encoding, and decoded again for the outputs.
+
+    Parameters
+    ----------
+    names: array-like
+        The names to index, e.g. `observers["name"]`. Later duplicates of a
+        name share the id of the first one.
+    """
+
+    def __init__(self, names):
+        self.names = np.asarray(names, dtype=object)
+        codes, unique_names = pd.factorize(self.names)
+        self.index = pd.Index(unique_names)
+        # codes are numbered in order of first occurrence
+        _, first = np.unique(codes[codes >= 0], return_index=True)
+        self.ids = np.flatnonzero(codes >= 0)[first].astype(np.int32)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __repr__(self):
+        return f"NameIndex({len(self.index)} names)"
+
+    def encode(self, values):
+        """
+        The ids of `values`. Empty and unknown names are -1.
+        """
+
+        position = self.index.get_indexer(np.asarray(values, dtype=object))
+
+        # unknown names (-1) land on the padding at the end
+        return np.append(self.ids, np.int32(-1))[position]
+
+    def decode(self, ids, missing=""):
+        """
+        The names of `ids`. Negative ids are replaced by `missing`.
+        """
+
+        ids = np.asarray(ids)
+        names = np.append(self.names, missing)
+
+        return names[np.where(ids >= 0, ids, len(self.names))]
+
+
+def isin(values, test_values):
+    """
+    Hash based `np.isin` for names. `np.isin` sorts object arrays, comparing
+    the names one pair at a time, which is slow for a whole roster.
+
+    Parameters
+    ----------
+    values: array-like
+        The names to look up, of any shape
+    test_values: array-like
+        The names to look for
+
+    Returns
+    -------
+    np.array
+        Boolean mask the shape of `values`
+    """
+
+    values = np.asarray(values, dtype=object)
+    test_values = np.asarray(test_values, dtype=object).ravel()
+
+    return pd.Series(values.ravel()).isin(test_values).values.reshape(values.shape)
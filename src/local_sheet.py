@@ -0,0 +1,102 @@
+import pandas as pd
+import re
+
+from src.output import read_frame
+
+
+def rowcol_to_a1(row, col):
+    """
+    The A1 label of a cell, e.g. (2, 28) is "AB2". Same as
+    `gspread.utils.rowcol_to_a1`, without importing gspread
+    """
+
+    letters = ""
+    while col > 0:
+        col, remainder = divmod(col - 1, 26)
+        letters = chr(ord("A") + remainder) + letters
+
+    return f"{letters}{row}"
+
+
+def a1_to_rowcol(label):
+    """
+    The (row, col) of an A1 label, e.g. "AB2" is (2, 28). Same as
+    `gspread.utils.a1_to_rowcol`, without importing gspread
+    """
+
+    match = re.fullmatch(r"([A-Za-z]+)(\d+)", label)
+    if match is None:
+        raise ValueError(f"Not an A1 cell label: {label}")
+
+    col = 0
+    for letter in match.group(1).upper():
+        col = col * 26 + ord(letter) - ord("A") + 1
+
+    return int(match.group(2)), col
+
+
+class LocalWorksheet:
+    """
+    Stands in for the google sheet of observer form responses, e.g. to run
+    the service or the scripts without google credentials. Implements the
+    parts of `gspread.Worksheet` that `get_sheet_columns` uses.
+
+    Parameters
+    ----------
+    responses: pd.DataFrame or str or Path
+        The form responses with the columns in sheet order, or a csv, parquet
+        or xlsx file of them. Row 1 of the sheet is the header.
+    """
+
+    def __init__(self, responses):
+        if not isinstance(responses, pd.DataFrame):
+            responses = read_frame(responses)
+        self.header = [str(column) for column in responses.columns]
+        self.rows = responses.fillna("").astype(str).values.tolist()
+
+    def __repr__(self):
+        return f"LocalWorksheet({len(self.rows)} responses)"
+
+    @property
+    def row_count(self):
+        return len(self.rows) + 1
+
+    def get_column(self, col_num, first_row, last_row):
+        """
+        The values of column `col_num` from `first_row` to `last_row`. Trailing
+        empty cells are dropped, like the google sheets api does.
+        """
+
+        column = [
+            row[col_num - 1] if col_num <= len(row) else ""
+            for row in self.rows[max(first_row - 2, 0) : max(last_row - 1, 0)]
+        ]
+        while column and column[-1] == "":
+            column.pop()
+
+        return column
+
+    def batch_get(self, ranges, major_dimension="COLUMNS"):
+        """
+        Each A1 range of a single column, as a list of columns
+        """
+
+        if major_dimension != "COLUMNS":
+            raise ValueError("LocalWorksheet only returns columns")
+
+        value_ranges = []
+        for a1_range in ranges:
+            start, end = a1_range.split(":")
+            first_row, col_num = a1_to_rowcol(start)
+            last_row, _ = a1_to_rowcol(end)
+            column = self.get_column(col_num, first_row, last_row)
+            value_ranges.append([column] if column else [])
+
+        return value_ranges
+
+    def append_row(self, values):
+        """
+        Adds a response at the bottom of the sheet
+        """
+
+        self.rows.append([str(value) for value in values])
@@ -0,0 +1,101 @@
+import numpy as np
+
+from src.distance import get_distance
+from src.interning import NameIndex
+
+
+OBSERVER_COLUMNS = ["inside_observer", "outside_am_observer", "outside_pm_observer"]
+PERCENTILES = [50, 90, 99]
+
+
+def get_priority_tiers(priority, n_tiers=4):
+    """
+    Splits precincts into `n_tiers` equal sized tiers by priority, tier 0
+    being the highest priority. Ties keep their order.
+    """
+
+    priority = np.asarray(priority)
+    rank = np.empty(len(priority), dtype=int)
+    rank[np.argsort(priority, kind="stable")] = np.arange(len(priority))
+
+    return rank * n_tiers // max(len(priority), 1)
+
+
+def summarise_distance(distance, percentiles=PERCENTILES):
+    """
+    Total, mean and percentiles of travel distances
+    """
+
+    distance = np.asarray(distance, dtype=float)
+    summary = {"n": int(len(distance)), "total": float(distance.sum())}
+    if len(distance) == 0:
+        return summary
+
+    summary["mean"] = float(distance.mean())
+    for percentile, value in zip(percentiles, np.percentile(distance, percentiles)):
+        summary[f"p{percentile}"] = float(value)
+
+    return summary
+
+
+def get_assignment_metrics(precinct, observers, distance=None, n_tiers=4):
+    """
+    Measures the quality of an assignment: how far observers travel, how many
+    precincts are filled in each priority tier and how many have a legal
+    observer. Everything is computed on arrays so it is cheap enough to run
+    after every solve.
+
+    Parameters
+    ----------
+    precinct: pd.DataFrame
+        The assigned precincts
+    observers: pd.DataFrame
+        The list of all observers
+    distance: callable or string, optional
+        The distance provider, see `src.distance`, or its name in
+        DISTANCE_PROVIDERS. Defaults to ZipCodeDistance. Use the optimiser's
+        so the metrics match what was optimised
+    n_tiers: int, optional
+        The number of priority tiers to report the fill rate for
+
+    Returns
+    -------
+    dict
+        "distance", "fill_rate" and "legal_coverage" for each observer column.
+        "distance" also has the summary over all columns under "all".
+    """
+
+    distance = get_distance(distance)
+
+    name_index = NameIndex(observers["name"].values)
+    post_code = observers["post_code"].values
+    legal_background = observers["legal_background"].values.astype(bool)
+    precinct_zip = precinct["Zip"].values
+    tiers = get_priority_tiers(precinct["Priority"].values, n_tiers)
+    tier_size = np.bincount(tiers, minlength=n_tiers)
+
+    metrics = {"distance": {}, "fill_rate": {}, "legal_coverage": {}}
+    all_distances = []
+    for column in OBSERVER_COLUMNS:
+        observer_id = name_index.encode(precinct[column].values)
+        found = observer_id >= 0
+
+        column_distance = distance.paired(
+            post_code[observer_id[found]], precinct_zip[found]
+        )
+        all_distances.append(column_distance)
+        metrics["distance"][column] = summarise_distance(column_distance)
+
+        filled = precinct[column].values != ""
+        metrics["fill_rate"][column] = (
+            np.bincount(tiers, weights=filled, minlength=n_tiers)
+            / np.maximum(tier_size, 1)
+        ).tolist()
+
+        legal = np.zeros(len(precinct), dtype=bool)
+        legal[found] = legal_background[observer_id[found]]
+        metrics["legal_coverage"][column] = float(legal.mean()) if len(legal) else 0.0
+
+    metrics["distance"]["all"] = summarise_distance(np.concatenate(all_distances))
+
+    return metrics
@@ -1,81 +1,30 @@
+import argparse
+import logging
+import warnings
 import pandas as pd
 import numpy as np
-import networkx as nx
-import matplotlib.pyplot as plt
 
 import src.basic_assignment as ba
 
-from pathlib import Path
-
-
-class PreferenceNetwork:
-    """
-    This class is a wrapper around a nx.DiGraph() and allows
-    for easy setup and projections of the bipartite graph
-    """
-
-    def __init__(self, preference_edges, ownership_edges):
-
-        G = nx.DiGraph()
-
-        for node in ownership_edges["Polling Place Name"]:
-            G.add_node(node, node_type="pollstation", node_color="darkred")
-        for node in ownership_edges.iloc[:, 1]:
-            G.add_node(node, node_type="observer", node_color="dodgerblue")
-        for node in preference_edges["preference"]:
-            G.add_node(node, node_type="pollstation", node_color="darkred")
-        for node in preference_edges["observer"]:
-            G.add_node(node, node_type="observer", node_color="dodgerblue")
-
-        G.add_edges_from(ownership_edges.itertuples(index=False, name=None))
-        G.add_edges_from(preference_edges.itertuples(index=False, name=None))
-
-        self.G = G
-
-    def draw(self):
-        """
-        Returns a matplotliDb plot of the graph
-        """
-        f, ax = plt.subplots(figsize=(10, 7))
-
-        pos = nx.spring_layout(self.G)
-        nx.draw_networkx_edges(self.G, pos, alpha=0.2)
-        nx.draw_networkx_nodes(
-            self.G,
-            pos,
-            node_color=nx.get_node_attributes(self.G, "node_color").values(),
-            node_size=50,
-        )
-
-        return f
-
-    def __repr__(self):
-        """
-        Calls the networkx.DiGraph __repr__ method
-        """
-        return self.G.__repr__()
-
-    def get_projection(self, node_type="observer"):
-        """
-        Get projection of bipartite network for `node_type`
-        """
-
-        obs_nodes = [
-            x for x, y in self.G.nodes(data=True) if y["node_type"] == node_type
-        ]
-        G_proj = nx.bipartite.projected_graph(self.G, obs_nodes)
-
-        return G_proj
-
-    def get_projection_adj(self, node_type="observer"):
-        """
-        Get the adjacency matrix for the projection of the bipartite network
-        """
-        G_proj = self.get_projection(node_type)
-        adjacency_matrix = pd.DataFrame(G_proj.adjacency(), columns=["from", "to"])
-        adjacency_matrix["to"] = adjacency_matrix["to"].apply(lambda x: list(x.keys()))
-
-        return adjacency_matrix
+from concurrent.futures import ProcessPoolExecutor
+from src.candidates import CandidateGraph
+from src.config import add_config_arguments, load_run_config
+from src.distance import get_distance
+from src.flow import get_slot_mask, optimise_flow
+from src.instrumentation import (
+    collect_report,
+    count,
+    get_report,
+    observe,
+    reporting,
+    timed,
+    timer,
+)
+from src.interning import NameIndex
+from src.metrics import get_assignment_metrics
+from src.output import OUTPUT_DIR, write_outputs
+
+logger = logging.getLogger(__name__)
 
 
 def get_zipcode_distance(zip1, zip2):
@@ -87,45 +36,42 @@ def get_zipcode_distance(zip1, zip2):
     return np.abs(int(zip1) - int(zip2))
 
 
-def resolve_cycle(pref_network, verbose=False):
+def get_cycle_members(pointer, nodes):
     """
-    Assign preferences as per the cycle
+    Finds every node on a cycle of a functional graph in one pass
 
     Parameters
     ----------
-    pref_network: PreferenceNetwork
-        A PreferenceNetwork object
-    verbose: bool, optional
-        If debug statements should be printed. False by default
+    pointer: np.array
+        `pointer[i]` is the node that node `i` points to
+    nodes: np.array
+        The nodes of the graph. Each of them must point to one of them
 
     Returns
     -------
-    preferences: dict
-        Matched preferences
+    np.array
+        The nodes that are on a cycle, in order. Self-cycles are included.
+
+    Note
+    ----
+    Every node reaches a cycle within len(nodes) steps, so after jumping at
+    least that many steps from every node we land on exactly the nodes that
+    are on a cycle. Doubling the jump each time takes log(n) passes.
     """
 
-    G_proj = pref_network.get_projection()
-    adj_df = pref_network.get_projection_adj()
+    position = np.empty(len(pointer), dtype=np.int64)
+    position[nodes] = np.arange(len(nodes))
+    jump = position[pointer[nodes]]
 
-    # find self cycles
-    self_mask = adj_df["to"].apply(len) == 0
-    print(adj_df)
-    preferences = {}
-    if self_mask.any():
-        observers_matched = adj_df.loc[self_mask, "from"]
-        if verbose:
-            print("Self: ", list(observers_matched))
-        preferences.update(dict(pref_network.G.out_edges(list(observers_matched))))
-    else:
-        try:
-            for observer, _ in nx.find_cycle(G_proj):
-                if verbose:
-                    print("Cycle : ", observer)
-                preferences.update(dict(pref_network.G.out_edges([observer])))
-        except nx.NetworkXNoCycle:
-            pass
+    n_steps = 1
+    while n_steps < len(nodes):
+        jump = jump[jump]
+        n_steps *= 2
+
+    on_cycle = np.zeros(len(nodes), dtype=bool)
+    on_cycle[jump] = True
 
-    return preferences
+    return nodes[on_cycle]
 
 
 def get_matched_sets(distance_df, merged_df, column_to_optimise, verbose=False):
@@ -143,7 +89,7 @@ def get_matched_sets(distance_df, merged_df, column_to_optimise, verbose=False):
         Specifies the observer columns that needs to be optimised
         Must be one of 'inside_observer', 'outside_am_observer', 'outside_pm_observer'
     verbose: bool, optional
-        If debug data should be printed to screen
+        If debug data should be logged
 
     Returns
     -------
@@ -151,35 +97,268 @@ def get_matched_sets(distance_df, merged_df, column_to_optimise, verbose=False):
         The optimised match list.
         A dictionary with keys as observers and values as polling locations
 
+    Note
+    ----
+    Each round every observer points at the owner of their closest remaining
+    polling location and all of the cycles this makes are resolved at once,
+    see `get_cycle_members`. The cycles are disjoint so the matching is the
+    same as resolving them one at a time.
     """
 
+    observers = distance_df.index.values
+    locations = distance_df.columns.values
+    distance = distance_df.values
+
+    # the observer (row) that currently holds each polling location (column)
+    owner_names = merged_df.set_index("Polling Place Name")[column_to_optimise]
+    owner = NameIndex(observers).encode(owner_names.reindex(locations).values)
+
+    free_observers = np.ones(len(observers), dtype=bool)
+    free_locations = np.ones(len(locations), dtype=bool)
+    preference = np.zeros(len(observers), dtype=np.int64)
+    pointer = np.arange(len(observers))
+
     matched_set = {}
-    while len(distance_df) > 0:
+    while free_observers.any():
+        rows = np.flatnonzero(free_observers)
+        cols = np.flatnonzero(free_locations)
         if verbose:
-            print(" >>>>>> ", len(distance_df))
-        preference = np.argmin(distance_df.values, axis=1)
-        preference_edges = pd.DataFrame(
-            {
-                "observer": distance_df.index,
-                "preference": distance_df.columns[preference],
-            }
-        )
-        ownership_edges = merged_df.loc[
-            merged_df["Polling Place Name"].isin(distance_df.columns[preference]),
-            ["Polling Place Name", column_to_optimise],
-        ]
-        print(preference_edges, ownership_edges)
-        PN = PreferenceNetwork(preference_edges, ownership_edges)
-        matched_pairs = resolve_cycle(PN, verbose)
-        matched_set.update(matched_pairs)
-
-        distance_df = distance_df.drop(matched_pairs.keys())
-        distance_df = distance_df.drop(matched_pairs.values(), axis=1)
-        print(matched_set)
+            logger.debug("%d observers left", len(rows))
+
+        preference[rows] = cols[np.argmin(distance[np.ix_(rows, cols)], axis=1)]
+        pointer[rows] = owner[preference[rows]]
+        cycle = get_cycle_members(pointer, rows)
+
+        if verbose:
+            logger.debug("Cycles: %s", observers[cycle])
+        count("ttc.rounds")
+        observe("ttc.matched_per_round", len(cycle))
+
+        matched_set.update(zip(observers[cycle], locations[preference[cycle]]))
+        free_observers[cycle] = False
+        free_locations[preference[cycle]] = False
+
     return matched_set
 
 
-def optimise_assignment(precinct, observers, column_to_optimise):
+def get_preference_order(distance):
+    """
+    Ranks polling locations for each observer, closest first. Ties are broken
+    by column order, the same as `np.argmin`.
+    """
+
+    distance = np.asarray(distance)
+    if (
+        np.issubdtype(distance.dtype, np.integer)
+        and distance.size > 0
+        and distance.min() >= 0
+        and distance.max() <= np.iinfo(np.uint16).max
+    ):
+        # numpy uses a radix sort for 16 bit integers which is much quicker
+        distance = distance.astype(np.uint16)
+
+    return np.argsort(distance, axis=1, kind="stable")
+
+
+def get_matched_sets_array(distance, verbose=False):
+    """
+    Array implementation of `get_matched_sets`. Runs the top trading cycle
+    algorithm on integer index arrays, walking down a sorted preference order
+    rather than searching the remaining distances every round.
+
+    Parameters
+    ----------
+    distance: np.array
+        A square matrix of distances between observers (rows) and polling
+        locations (cols). Observer `i` is the current owner of location `i`.
+    verbose: bool, optional
+        If debug data should be logged
+
+    Returns
+    -------
+    matched: np.array
+        The optimised match list. `matched[i]` is the index of the polling
+        location assigned to observer `i`
+
+    Note
+    ----
+    Each round resolves every cycle at once, as `get_matched_sets` does, so
+    the matching is identical to `get_matched_sets`.
+    """
+
+    n_observers = distance.shape[0]
+    matched = np.full(n_observers, -1)
+    if n_observers == 0:
+        return matched
+
+    order = get_preference_order(distance)
+    rank = np.zeros(n_observers, dtype=int)
+    preference = order[:, 0].copy()
+    free = np.ones(n_observers, dtype=bool)
+    taken = np.zeros(n_observers, dtype=bool)
+
+    while free.any():
+        free_observers = np.flatnonzero(free)
+        if verbose:
+            logger.debug("%d observers left", len(free_observers))
+
+        # observer i owns location i so preference pointers double as owner
+        # pointers and every cycle among them is resolved at once
+        cycle = get_cycle_members(preference, free_observers)
+
+        if verbose:
+            logger.debug("Cycles: %s", cycle)
+
+        count("ttc.rounds")
+        observe("ttc.matched_per_round", len(cycle))
+        matched[cycle] = preference[cycle]
+        free[cycle] = False
+        taken[preference[cycle]] = True
+
+        # observers whose preferred location was taken move down their list
+        stale = np.flatnonzero(free & taken[preference])
+        while len(stale) > 0:
+            rank[stale] += 1
+            preference[stale] = order[stale, rank[stale]]
+            stale = stale[taken[preference[stale]]]
+
+    return matched
+
+
+def get_matched_sets_lap(distance):
+    """
+    Solves the assignment of observers to polling locations that minimises the
+    total distance. Unlike `get_matched_sets` this is globally optimal.
+
+    Parameters
+    ----------
+    distance: np.array
+        A square matrix of distances between observers (rows) and polling
+        locations (cols)
+
+    Returns
+    -------
+    matched: np.array
+        `matched[i]` is the index of the polling location assigned to observer `i`
+    """
+    from scipy.optimize import linear_sum_assignment
+
+    _, matched = linear_sum_assignment(distance)
+
+    return matched
+
+
+def get_matched_sets_candidates(candidates, verbose=False):
+    """
+    Sparse version of `get_matched_sets_array`. Each observer only ranks their
+    candidate polling locations. An observer who has lost all of their
+    closest candidates has their list doubled before they move on, so the
+    matching is identical to the dense version.
+
+    Parameters
+    ----------
+    candidates: CandidateGraph
+        The candidate polling locations for each observer, see
+        `src.candidates`. Expanded in place.
+    verbose: bool, optional
+        If debug data should be logged
+
+    Returns
+    -------
+    matched: np.array
+        `matched[i]` is the index of the polling location assigned to observer `i`
+    """
+
+    n_observers = candidates.matrix.shape[0]
+    matched = np.full(n_observers, -1)
+    if n_observers == 0:
+        return matched
+
+    # rows are sorted closest first so a rank is a position in the row
+    rank = np.zeros(n_observers, dtype=int)
+    preference = candidates.matrix.indices[candidates.matrix.indptr[:-1]].astype(int)
+    free = np.ones(n_observers, dtype=bool)
+    taken = np.zeros(n_observers, dtype=bool)
+
+    while free.any():
+        free_observers = np.flatnonzero(free)
+        if verbose:
+            logger.debug("%d observers left", len(free_observers))
+
+        cycle = get_cycle_members(preference, free_observers)
+
+        if verbose:
+            logger.debug("Cycles: %s", cycle)
+
+        count("ttc.rounds")
+        observe("ttc.matched_per_round", len(cycle))
+        matched[cycle] = preference[cycle]
+        free[cycle] = False
+        taken[preference[cycle]] = True
+
+        # an observer's own location is never taken while they are free so
+        # they can't run off the end of their row. Anyone past their closest
+        # candidates may have missed a closer location so gets more of them,
+        # along with everyone close to running out to save rebuilding often
+        stale = np.flatnonzero(free & taken[preference])
+        while len(stale) > 0:
+            rank[stale] += 1
+            incomplete = ~candidates.is_complete()
+            if (
+                incomplete[stale] & (rank[stale] >= candidates.n_candidates[stale])
+            ).any():
+                expand = np.flatnonzero(
+                    free & incomplete & (2 * rank >= candidates.n_candidates)
+                )
+                if verbose:
+                    logger.debug("Expanding candidates for %d observers", len(expand))
+                count("candidates.expansions")
+                candidates.expand(expand)
+
+            position = candidates.matrix.indptr[stale] + rank[stale]
+            preference[stale] = candidates.matrix.indices[position]
+            stale = stale[taken[preference[stale]]]
+
+    return matched
+
+
+def get_matched_sets_sparse(candidates):
+    """
+    Sparse version of `get_matched_sets_lap`. Only assignments to candidate
+    polling locations are considered.
+
+    Parameters
+    ----------
+    candidates: scipy.sparse.csr_matrix
+        Distances from observers (rows) to candidate polling locations (cols),
+        the `matrix` of a CandidateGraph
+
+    Returns
+    -------
+    matched: np.array
+        `matched[i]` is the index of the polling location assigned to observer `i`
+    """
+    from scipy.sparse.csgraph import min_weight_full_bipartite_matching
+
+    # scipy drops zero weight edges so shift all of them up. Every observer is
+    # matched so this doesn't change the optimal assignment
+    weights = candidates.astype(float)
+    weights.data += 1
+
+    _, matched = min_weight_full_bipartite_matching(weights)
+
+    return matched
+
+
+def optimise_assignment(
+    precinct,
+    observers,
+    column_to_optimise,
+    method="ttc",
+    n_candidates=None,
+    max_memory_mb=None,
+    distance=None,
+):
     """
     Creates a distance matrix and runs the top-trading algorithm.
 
@@ -192,6 +371,26 @@ def optimise_assignment(precinct, observers, column_to_optimise):
     column_to_optimise: string
         Specifies the observer columns that needs to be optimised
         Must be one of 'inside_observer', 'outside_am_observer', 'outside_pm_observer'
+    method: string, optional
+        The matching engine to use. One of:
+            "ttc" - top trading cycles on index arrays (default)
+            "hungarian" - minimises the total distance over all observers
+        "networkx" is a deprecated alias of "ttc", which gives the same
+        matching as the networkx engine it replaced.
+    n_candidates: int, optional
+        If given, each observer is only considered for
+        their `n_candidates` closest polling locations (plus their current
+        one) and the dense distance matrix is never built. Use this for
+        large problems. "ttc" considers more polling locations for any
+        observer who runs out of candidates.
+    max_memory_mb: float, optional
+        If given instead of `n_candidates`, keeps as many candidates as fit in
+        this much memory.
+    distance: callable or string, optional
+        The distance provider, see `src.distance`, or its name in
+        DISTANCE_PROVIDERS. Defaults to ZipCodeDistance, the difference
+        between zip codes. Use "haversine" for the distance in km between zip
+        codes.
 
     Returns
     -------
@@ -203,177 +402,350 @@ def optimise_assignment(precinct, observers, column_to_optimise):
     if len(precinct) == 0:
         return pd.Series([], name=column_to_optimise)
 
-    merged_df = precinct.merge(
-        observers[["name", "post_code"]], left_on=column_to_optimise, right_on="name"
+    observer_id = NameIndex(observers["name"].values).encode(
+        precinct[column_to_optimise].values
     )
-    precinct_list = merged_df[["Polling Place Name", "Zip"]]
-    observer_list = merged_df[[column_to_optimise, "post_code"]]
-    distance = np.abs(
-        precinct_list.Zip.values[np.newaxis, :]
-        - observer_list.post_code.values[:, np.newaxis]
-    )
-    distance_df = pd.DataFrame(
-        distance,
-        index=observer_list[column_to_optimise],
-        columns=precinct_list["Polling Place Name"],
+    found = np.flatnonzero(observer_id >= 0)
+    observer_id = observer_id[found]
+
+    observer_zip = observers["post_code"].values[observer_id]
+    precinct_zip = precinct["Zip"].values[found]
+
+    distance = get_distance(distance)
+
+    count("optimiser.observers", len(found))
+
+    if method == "networkx":
+        warnings.warn(
+            'optimiser method "networkx" is deprecated, use "ttc"',
+            DeprecationWarning,
+            stacklevel=2,
+        )
+        method = "ttc"
+    if method not in ["ttc", "hungarian"]:
+        raise ValueError(f"Unknown optimisation method: {method}")
+
+    with timer("distance"):
+        if n_candidates is not None:
+            candidates = CandidateGraph(
+                observer_zip, precinct_zip, n_candidates, distance
+            )
+            count("optimiser.candidate_cells", candidates.matrix.nnz)
+        elif max_memory_mb is not None:
+            candidates = CandidateGraph.from_memory_limit(
+                observer_zip, precinct_zip, max_memory_mb, distance
+            )
+            count("optimiser.candidate_cells", candidates.matrix.nnz)
+        else:
+            candidates = None
+            dense_distance = distance(observer_zip, precinct_zip)
+            count("optimiser.distance_cells", dense_distance.size)
+
+    with timer("matching"):
+        if method == "ttc" and candidates is None:
+            matched = get_matched_sets_array(dense_distance)
+        elif method == "ttc":
+            matched = get_matched_sets_candidates(candidates)
+        elif candidates is None:
+            matched = get_matched_sets_lap(dense_distance)
+        else:
+            matched = get_matched_sets_sparse(candidates.matrix)
+
+    observe("optimiser.distance_before", distance.paired(observer_zip, precinct_zip))
+    observe(
+        "optimiser.distance_after", distance.paired(observer_zip, precinct_zip[matched])
     )
 
-    merged_df["current_distance"] = np.abs(merged_df["Zip"] - merged_df["post_code"])
+    # observers are decoded back to names in the precinct order. Precincts
+    # whose observer could not be found keep their current observer
+    optimised = precinct[column_to_optimise].values.copy()
+    optimised[found[matched]] = observers["name"].values[observer_id]
 
-    matched_set = get_matched_sets(distance_df, merged_df, column_to_optimise, True)
+    return optimised
 
-    df = pd.DataFrame([matched_set], index=["pollingstation"]).T.reset_index()
-    df.columns = [column_to_optimise, "pollingstation"]
-    precinct[["Pct", "Polling Place Name"]].merge(
-        df, left_on="Polling Place Name", right_on="pollingstation"
-    ).drop("pollingstation", axis=1)
 
-    return df[column_to_optimise].values
+OBSERVER_COLUMNS = ["inside_observer", "outside_am_observer", "outside_pm_observer"]
 
 
-if __name__ == "__main__":
+def get_bucket_masks(precinct):
+    """
+    Splits the assigned precincts into the buckets that are optimised
+    separately: inside, outside all day, outside AM only and outside PM only,
+    each for legal and non-legal observers. Buckets that write to the same
+    column never share a precinct.
 
-    observers = ba.get_observer_dataset()
-    precinct = ba.get_precinct_dataset()
-    precinct, observers = ba.run_ordered_assignment(precinct, observers)
+    Returns
+    -------
+    dict
+        Bucket name to a tuple of (mask, column to optimise, columns to write)
+    """
 
-    # Inside legal
+    inside = precinct["inside_observer"].values
+    am = precinct["outside_am_observer"].values
+    pm = precinct["outside_pm_observer"].values
 
-    precinct_subset = precinct[
-        precinct["inside_legal"] & (precinct["inside_observer"] != "")
-    ]
-    precinct.loc[
-        (precinct["inside_legal"]) & (precinct["inside_observer"] != ""),
-        "inside_observer",
-    ] = optimise_assignment(precinct_subset, observers, "inside_observer")
+    buckets = {}
+    for legal_name, legal in [("legal", True), ("not_legal", False)]:
+        inside_legal = precinct["inside_legal"].values.astype(bool) == legal
+        am_legal = precinct["outside_am_legal"].values.astype(bool) == legal
+        pm_legal = precinct["outside_pm_legal"].values.astype(bool) == legal
 
-    # Outside both legal
+        buckets[f"inside_{legal_name}"] = (
+            inside_legal & (inside != ""),
+            "inside_observer",
+            ["inside_observer"],
+        )
+        buckets[f"outside_both_{legal_name}"] = (
+            am_legal & (am == pm) & (am != ""),
+            "outside_am_observer",
+            ["outside_am_observer", "outside_pm_observer"],
+        )
+        buckets[f"outside_am_{legal_name}"] = (
+            am_legal & (am != pm) & (am != ""),
+            "outside_am_observer",
+            ["outside_am_observer"],
+        )
+        buckets[f"outside_pm_{legal_name}"] = (
+            pm_legal & (am != pm) & (pm != ""),
+            "outside_pm_observer",
+            ["outside_pm_observer"],
+        )
 
-    mask = (
-        (precinct["outside_am_legal"])
-        & (precinct["outside_am_observer"] == precinct["outside_pm_observer"])
-        & (precinct["outside_am_observer"] != "")
-    )
+    return buckets
 
-    precinct_subset = precinct[mask]
-    optimised_observer_list = optimise_assignment(
-        precinct_subset, observers, "outside_am_observer"
-    )
-    precinct.loc[mask, "outside_am_observer"] = optimised_observer_list
-    precinct.loc[mask, "outside_pm_observer"] = optimised_observer_list
 
-    # Outside am only legal
+def optimise_bucket(precinct, observers, column_to_optimise, **options):
+    """
+    Runs `optimise_assignment` on one bucket, recording into a report of its
+    own so it can be sent back from a worker process
 
-    mask = (
-        (precinct["outside_am_legal"])
-        & (precinct["outside_am_observer"] != precinct["outside_pm_observer"])
-        & (precinct["outside_am_observer"] != "")
-    )
+    Returns
+    -------
+    result: np.array
+        As returned by `optimise_assignment`
+    report: dict
+        The timings and counters recorded for the bucket
+    """
 
-    precinct_subset = precinct[mask]
-    optimised_observer_list = optimise_assignment(
-        precinct_subset, observers, "outside_am_observer"
-    )
-    precinct.loc[mask, "outside_am_observer"] = optimised_observer_list
+    with collect_report() as report:
+        with report.timer("total"):
+            result = optimise_assignment(
+                precinct, observers, column_to_optimise, **options
+            )
+
+    return result, report.to_dict()
+
+
+@timed("optimise")
+def optimise_buckets(
+    precinct,
+    observers,
+    n_workers=None,
+    rows=None,
+    locations=None,
+    objective=None,
+    **options,
+):
+    """
+    Runs `optimise_assignment` on every bucket from `get_bucket_masks`. The
+    buckets are independent so they are solved in parallel, largest first.
+    With method="flow" or "weighted" all the buckets are solved together by
+    `src.flow.optimise_flow` instead.
 
-    # Outside pm only legal
+    Parameters
+    ----------
+    precinct: pd.DataFrame
+        The precincts after the basic assignment
+    observers: pd.DataFrame
+        The list of all observers
+    n_workers: int, optional
+        The number of processes to use. Defaults to the number of CPUs. Use 1
+        to solve the buckets one after another in this process.
+    rows: np.array, optional
+        Boolean mask of the precincts that may be changed, or of the slots
+        with one column per OBSERVER_COLUMNS. Observers in the other slots
+        stay where they are, and an outside all day pair is only changed if
+        both of its slots may be. Defaults to all precincts.
+    locations: dict, optional
+        The location parameters from the config. Only used by "flow" and
+        "weighted"
+    objective: dict, optional
+        The weights from the config. Only used by "weighted"
+    **options:
+        Passed on to `optimise_assignment`
 
-    mask = (
-        (precinct["outside_pm_legal"])
-        & (precinct["outside_am_observer"] != precinct["outside_pm_observer"])
-        & (precinct["outside_pm_observer"] != "")
-    )
+    Returns
+    -------
+    pd.DataFrame
+        A copy of `precinct` with the optimised observers
+    """
+
+    if options.get("method") in ["flow", "weighted"]:
+        return optimise_flow(
+            precinct, observers, rows, locations, objective=objective, **options
+        )
 
-    precinct_subset = precinct[mask]
-    optimised_observer_list = optimise_assignment(
-        precinct_subset, observers, "outside_pm_observer"
+    buckets = get_bucket_masks(precinct)
+    if rows is not None:
+        slots = get_slot_mask(rows, len(precinct))
+        for name, (mask, column, columns) in list(buckets.items()):
+            slot_ids = [OBSERVER_COLUMNS.index(col) for col in columns]
+            buckets[name] = (mask & slots[:, slot_ids].all(axis=1), column, columns)
+    observers = observers[["name", "post_code"]]
+
+    jobs = sorted(
+        (name for name, (mask, _, _) in buckets.items() if mask.any()),
+        key=lambda name: buckets[name][0].sum(),
+        reverse=True,
     )
-    precinct.loc[mask, "outside_pm_observer"] = optimised_observer_list
 
-    # Inside non-legal
+    if n_workers == 1:
+        outputs = {
+            name: optimise_bucket(
+                precinct[buckets[name][0]], observers, buckets[name][1], **options
+            )
+            for name in jobs
+        }
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            futures = {
+                name: executor.submit(
+                    optimise_bucket,
+                    precinct[buckets[name][0]],
+                    observers,
+                    buckets[name][1],
+                    **options,
+                )
+                for name in jobs
+            }
+            outputs = {name: future.result() for name, future in futures.items()}
 
-    precinct_subset = precinct[
-        (~precinct["inside_legal"]) & (precinct["inside_observer"] != "")
-    ]
+    # the reports are merged in job order so they don't depend on the workers
+    results = {}
+    for name, (result, bucket_report) in outputs.items():
+        results[name] = result
+        get_report().merge(bucket_report, prefix=f"optimise.{name}.")
 
-    precinct.loc[
-        (~precinct["inside_legal"]) & (precinct["inside_observer"] != ""),
-        "inside_observer",
-    ] = optimise_assignment(precinct_subset, observers, "inside_observer")
+    precinct = precinct.copy()
+    for column in OBSERVER_COLUMNS:
+        values = precinct[column].values.copy()
+        for name, result in results.items():
+            mask, _, columns = buckets[name]
+            if column in columns:
+                values[mask] = result
+        precinct[column] = values
 
-    # Outside both not-legal
+    return precinct
 
-    mask = (
-        (~precinct["outside_am_legal"])
-        & (precinct["outside_am_observer"] == precinct["outside_pm_observer"])
-        & (precinct["outside_am_observer"] != "")
-    )
-    precinct_subset = precinct[mask]
-    optimised_observer_list = optimise_assignment(
-        precinct_subset, observers, "outside_am_observer"
-    )
-    precinct.loc[mask, "outside_am_observer"] = optimised_observer_list
-    precinct.loc[mask, "outside_pm_observer"] = optimised_observer_list
 
-    # Outside am only legal
+def get_observer_locations(precinct, observers):
+    """
+    Looks up the polling location each observer was assigned to for the
+    inside, outside AM and outside PM shifts.
 
-    mask = (
-        (~precinct["outside_am_legal"])
-        & (precinct["outside_am_observer"] != precinct["outside_pm_observer"])
-        & (precinct["outside_am_observer"] != "")
-    )
-    precinct_subset = precinct[mask]
-    optimised_observer_list = optimise_assignment(
-        precinct_subset, observers, "outside_am_observer"
-    )
-    precinct.loc[mask, "outside_am_observer"] = optimised_observer_list
+    Returns
+    -------
+    pd.DataFrame
+        A copy of `observers` with `inside_location`, `outside_am_location`
+        and `outside_pm_location` columns. Unassigned observers get NaN.
+    """
 
-    # Outside pm only legal
+    observers = observers.copy()
+    name_index = NameIndex(observers["name"].values)
+    locations = np.append(precinct["Polling Place Name"].values, np.nan)
+
+    for column in OBSERVER_COLUMNS:
+        observer_id = name_index.encode(precinct[column].values)
+        found = observer_id >= 0
+        # observers without a precinct land on the padding at the end
+        observer_location = np.full(len(observers), len(precinct))
+        observer_location[observer_id[found]] = np.flatnonzero(found)
+        observers[column.replace("_observer", "_location")] = locations[
+            observer_location
+        ]
 
-    mask = (
-        (~precinct["outside_pm_legal"])
-        & (precinct["outside_am_observer"] != precinct["outside_pm_observer"])
-        & (precinct["outside_pm_observer"] != "")
-    )
-    precinct_subset = precinct[mask]
-    optimised_observer_list = optimise_assignment(
-        precinct_subset, observers, "outside_pm_observer"
-    )
-    precinct.loc[mask, "outside_pm_observer"] = optimised_observer_list
+    return observers
 
-    observers_allocated = observers.merge(
-        precinct[["inside_observer", "Polling Place Name"]],
-        left_on="name",
-        right_on="inside_observer",
-        how="left",
-    )
-    observers["inside_location"] = observers_allocated["Polling Place Name"].values
 
-    observers_allocated = observers.merge(
-        precinct[["outside_am_observer", "Polling Place Name"]],
-        left_on="name",
-        right_on="outside_am_observer",
-        how="left",
+def optimise_all(precinct, observers, config, **options):
+    """
+    Optimises every bucket of the assigned precincts and records each
+    observer's optimised locations. The quality metrics before and after
+    optimisation are added to the run report.
+
+    Parameters
+    ----------
+    precinct: pd.DataFrame
+        The precincts after the basic (or manual) assignment
+    observers: pd.DataFrame
+        The list of all observers
+    config: Config
+        The loaded config. The optimiser settings are read from
+        `config.optimiser`.
+    **options:
+        Override the optimiser settings, e.g. n_workers=1 or
+        distance="haversine"
+
+    Returns
+    -------
+    tuple of pd.DataFrame
+        Copies of `precinct` and `observers` after optimisation
+    """
+
+    options = {**config.optimiser, **options}
+    # the metrics measure distance the same way as the optimiser
+    distance = get_distance(options["distance"])
+
+    report = get_report()
+    report.add_metrics(
+        "before_optimisation", get_assignment_metrics(precinct, observers, distance)
     )
-    observers["outside_am_location"] = observers_allocated["Polling Place Name"].values
 
-    observers_allocated = observers.merge(
-        precinct[["outside_pm_observer", "Polling Place Name"]],
-        left_on="name",
-        right_on="outside_pm_observer",
-        how="left",
+    precinct = optimise_buckets(
+        precinct,
+        observers,
+        locations=config.locations,
+        objective=config.objective,
+        **options,
     )
-    observers["outside_pm_location"] = observers_allocated["Polling Place Name"].values
+    observers = get_observer_locations(precinct, observers)
 
-    precinct.to_excel(
-        Path(__file__).parent / "../data/01_output/optimised_assigned_precincts.xlsx",
-        index=False,
-        encoding="utf-8",
+    report.add_metrics(
+        "after_optimisation", get_assignment_metrics(precinct, observers, distance)
     )
-    observers.to_excel(
-        Path(__file__).parent / "../data/01_output/optimised_assigned_observers.xlsx",
-        index=False,
-        encoding="utf-8",
+
+    return precinct, observers
+
+
+def main(args=None):
+    """
+    Assigns observers in priority order, optimises their travel distance and
+    writes the assignment to OUTPUT_DIR
+    """
+
+    parser = add_config_arguments(
+        argparse.ArgumentParser(description="Assign and optimise observers")
     )
+    args = parser.parse_args(args)
 
-    print(precinct)
+    config = load_run_config(args)
+    with reporting("optimal_assignment", config, OUTPUT_DIR):
+        observers = ba.load_county_observers(config, args.mode)
+        precinct = ba.get_precinct_dataset(config.precinct_file)
+        precinct, observers = ba.run_ordered_assignment(precinct, observers, config)
+
+        precinct, observers = optimise_all(precinct, observers, config)
+
+        write_outputs(
+            {
+                "optimised_assigned_precincts": precinct,
+                "optimised_assigned_observers": observers,
+            },
+            **config.export,
+        )
+
+        print(precinct)
+
+
+if __name__ == "__main__":
+    main()
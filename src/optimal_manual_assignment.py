@@ -1,8 +1,12 @@
+import argparse
 import src.basic_assignment as ba
 import pandas as pd
 
 from pathlib import Path
-from src.optimal_assignment import optimise_assignment
+from src.config import add_config_arguments, load_run_config
+from src.instrumentation import reporting
+from src.optimal_assignment import optimise_all
+from src.output import OUTPUT_DIR, write_outputs
 
 
 def get_manual_precinct_allocation():
@@ -17,147 +21,37 @@ def get_manual_precinct_allocation():
     return precinct
 
 
-if __name__ == "__main__":
-
-    observers = ba.get_observer_dataset()
-    precinct = get_manual_precinct_allocation().fillna("")
-
-    # inside legal
-    mask = precinct["inside_legal"] & (precinct["inside_observer"] != "")
-
-    precinct_subset = precinct[mask]
-    precinct.loc[mask, "inside_observer"] = optimise_assignment(
-        precinct_subset, observers, "inside_observer"
-    )
-
-    # inside not-legal
-    mask = (~precinct["inside_legal"]) & (precinct["inside_observer"] != "")
-
-    precinct_subset = precinct[mask]
-    precinct.loc[mask, "inside_observer"] = optimise_assignment(
-        precinct_subset, observers, "inside_observer"
-    )
-
-    # outside legal all day
-    mask = (
-        (precinct["outside_am_legal"])
-        & (precinct["outside_am_observer"] == precinct["outside_pm_observer"])
-        & (precinct["outside_am_observer"] != "")
-    )
-
-    precinct_subset = precinct[mask]
-    optimised_observer_list = optimise_assignment(
-        precinct_subset, observers, "outside_am_observer"
-    )
-    precinct.loc[mask, "outside_am_observer"] = optimised_observer_list
-    precinct.loc[mask, "outside_pm_observer"] = optimised_observer_list
-
-    # outside am only legal
-    mask = (
-        (precinct["outside_am_legal"])
-        & (precinct["outside_am_observer"] != precinct["outside_pm_observer"])
-        & (precinct["outside_am_observer"] != "")
-    )
-
-    precinct_subset = precinct[mask]
-    optimised_observer_list = optimise_assignment(
-        precinct_subset, observers, "outside_am_observer"
-    )
-    precinct.loc[mask, "outside_am_observer"] = optimised_observer_list
-
-    # outside pm only legal
-    mask = (
-        (precinct["outside_pm_legal"])
-        & (precinct["outside_am_observer"] != precinct["outside_pm_observer"])
-        & (precinct["outside_pm_observer"] != "")
-    )
-
-    precinct_subset = precinct[mask]
-    optimised_observer_list = optimise_assignment(
-        precinct_subset, observers, "outside_pm_observer"
-    )
-    precinct.loc[mask, "outside_pm_observer"] = optimised_observer_list
+def main(args=None):
+    """
+    Optimises the manually edited assignment and writes it, with the LBJ
+    output, to OUTPUT_DIR
+    """
 
-    # outside not-legal all day
-    mask = (
-        (~precinct["outside_am_legal"])
-        & (precinct["outside_am_observer"] == precinct["outside_pm_observer"])
-        & (precinct["outside_am_observer"] != "")
+    parser = add_config_arguments(
+        argparse.ArgumentParser(description="Optimise a manually edited assignment")
     )
-    precinct_subset = precinct[mask]
-    optimised_observer_list = optimise_assignment(
-        precinct_subset, observers, "outside_am_observer"
-    )
-    precinct.loc[mask, "outside_am_observer"] = optimised_observer_list
-    precinct.loc[mask, "outside_pm_observer"] = optimised_observer_list
+    args = parser.parse_args(args)
 
-    # outside am only not-legal
-    mask = (
-        (~precinct["outside_am_legal"])
-        & (precinct["outside_am_observer"] != precinct["outside_pm_observer"])
-        & (precinct["outside_am_observer"] != "")
-    )
-    precinct_subset = precinct[mask]
-    optimised_observer_list = optimise_assignment(
-        precinct_subset, observers, "outside_am_observer"
-    )
-    precinct.loc[mask, "outside_am_observer"] = optimised_observer_list
+    config = load_run_config(args)
+    with reporting("optimal_manual_assignment", config, OUTPUT_DIR):
+        observers = ba.load_county_observers(config, args.mode)
+        precinct = get_manual_precinct_allocation().fillna("")
 
-    # Outside pm only not-legal
-    mask = (
-        (~precinct["outside_pm_legal"])
-        & (precinct["outside_am_observer"] != precinct["outside_pm_observer"])
-        & (precinct["outside_pm_observer"] != "")
-    )
-    precinct_subset = precinct[mask]
-    optimised_observer_list = optimise_assignment(
-        precinct_subset, observers, "outside_pm_observer"
-    )
-    precinct.loc[mask, "outside_pm_observer"] = optimised_observer_list
+        precinct, observers = optimise_all(precinct, observers, config)
 
-    observers_allocated = observers.merge(
-        precinct[["inside_observer", "Polling Place Name"]],
-        left_on="name",
-        right_on="inside_observer",
-        how="left",
-    )
-    observers["inside_location"] = observers_allocated["Polling Place Name"].values
+        lbj_output = ba.get_lbj_csv(precinct, observers, config)
 
-    observers_allocated = observers.merge(
-        precinct[["outside_am_observer", "Polling Place Name"]],
-        left_on="name",
-        right_on="outside_am_observer",
-        how="left",
-    )
-    observers["outside_am_location"] = observers_allocated["Polling Place Name"].values
+        write_outputs(
+            {
+                "manual_optimised_assigned_precincts": precinct,
+                "manual_optimised_assigned_observers": observers,
+                "lbj_output_manual": lbj_output,
+            },
+            **config.export,
+        )
 
-    observers_allocated = observers.merge(
-        precinct[["outside_pm_observer", "Polling Place Name"]],
-        left_on="name",
-        right_on="outside_pm_observer",
-        how="left",
-    )
-    observers["outside_pm_location"] = observers_allocated["Polling Place Name"].values
+        print(lbj_output)
 
-    precinct.to_excel(
-        Path(__file__).parent
-        / "../data/01_output/manual_optimised_assigned_precincts.xlsx",
-        index=False,
-        encoding="utf-8",
-    )
-    observers.to_excel(
-        Path(__file__).parent
-        / "../data/01_output/manual_optimised_assigned_observers.xlsx",
-        index=False,
-        encoding="utf-8",
-    )
 
-    lbj_output = ba.get_lbj_csv(precinct, observers)
-
-    lbj_output.to_excel(
-        Path(__file__).parent / "../data/01_output/lbj_output_manual.xlsx",
-        index=False,
-        encoding="utf-8",
-    )
-
-    print(lbj_output)
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+import argparse
+import pandas as pd
+
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from src.config import EXPORT_FORMATS, load_config
+from src.instrumentation import timed
+
+
+OUTPUT_DIR = Path(__file__).parent / "../data/01_output"
+
+
+def write_frame(df, path):
+    """
+    Writes `df` without its index. The format is taken from the file suffix,
+    one of ".xlsx", ".csv" or ".parquet".
+
+    Note
+    ----
+    Excel files are written with xlsxwriter in constant memory mode, which
+    streams each row to disk instead of holding the whole workbook.
+    Parquet needs `pyarrow`.
+    """
+
+    path = Path(path)
+
+    if path.suffix == ".csv":
+        df.to_csv(path, index=False, encoding="utf-8")
+    elif path.suffix == ".parquet":
+        df.to_parquet(path, index=False)
+    elif path.suffix == ".xlsx":
+        with pd.ExcelWriter(
+            path,
+            engine="xlsxwriter",
+            engine_kwargs={"options": {"constant_memory": True}},
+        ) as writer:
+            df.to_excel(writer, index=False)
+    else:
+        raise ValueError(f"Unknown output format: {path.suffix}")
+
+    return path
+
+
+def read_frame(path):
+    """
+    Reads a file written by `write_frame`
+    """
+
+    path = Path(path)
+
+    if path.suffix == ".csv":
+        return pd.read_csv(path)
+    elif path.suffix == ".parquet":
+        return pd.read_parquet(path)
+    elif path.suffix == ".xlsx":
+        return pd.read_excel(path)
+    else:
+        raise ValueError(f"Unknown output format: {path.suffix}")
+
+
+@timed("export")
+def write_outputs(outputs, output_dir=None, format="xlsx", n_workers=None):
+    """
+    Writes several dataframes at once
+
+    Parameters
+    ----------
+    outputs: dict
+        File name without suffix -> pd.DataFrame
+    output_dir: str or Path, optional
+        Where to write the files. Defaults to OUTPUT_DIR
+    format: string, optional
+        One of "xlsx" (default), "csv" or "parquet"
+    n_workers: int, optional
+        The number of processes to use. Defaults to one per output. Use 1 to
+        write the files one after another in this process.
+
+    Returns
+    -------
+    list of Path
+        The files written
+    """
+
+    if format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown output format: {format}")
+
+    output_dir = Path(output_dir or OUTPUT_DIR)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    paths = [output_dir / f"{name}.{format}" for name in outputs]
+
+    if n_workers == 1 or len(outputs) <= 1:
+        return [write_frame(df, path) for df, path in zip(outputs.values(), paths)]
+
+    with ProcessPoolExecutor(max_workers=n_workers or len(outputs)) as executor:
+        return list(executor.map(write_frame, outputs.values(), paths))
+
+
+def convert_outputs(names, from_format, format, output_dir=None, n_workers=None):
+    """
+    Rewrites saved outputs in another format, e.g. an xlsx assignment as csv
+    for a quicker load elsewhere
+
+    Parameters
+    ----------
+    names: list of str
+        File names without suffix
+    from_format: string
+        The format the files were saved in
+    format: string
+        The format to write
+    output_dir: str or Path, optional
+        Where the files are. Defaults to OUTPUT_DIR
+    n_workers: int, optional
+        See `write_outputs`
+
+    Returns
+    -------
+    list of Path
+        The files written
+    """
+
+    output_dir = Path(output_dir or OUTPUT_DIR)
+    outputs = {name: read_frame(output_dir / f"{name}.{from_format}") for name in names}
+
+    return write_outputs(outputs, output_dir, format, n_workers)
+
+
+def main(args=None):
+    """
+    Converts the outputs of the last run to another format
+    """
+
+    parser = argparse.ArgumentParser(description="Convert saved outputs")
+    parser.add_argument(
+        "names",
+        nargs="*",
+        default=["assigned_precincts", "assigned_observers", "lbj_output"],
+    )
+    parser.add_argument("--config", help="defaults to config/parameters.yml")
+    parser.add_argument("--from-format", help="defaults to the export format")
+    parser.add_argument("--format", required=True, choices=sorted(EXPORT_FORMATS))
+    args = parser.parse_args(args)
+
+    config = load_config(args.config)
+    paths = convert_outputs(
+        args.names,
+        args.from_format or config.export["format"],
+        args.format,
+        n_workers=config.export["n_workers"],
+    )
+    for path in paths:
+        print(path)
+
+
+if __name__ == "__main__":
+    main()
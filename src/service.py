@@ -0,0 +1,395 @@
+import argparse
+import json
+import logging
+import threading
+import pandas as pd
+import numpy as np
+
+import src.basic_assignment as ba
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from src.config import add_config_arguments, load_run_config
+from src.incremental_assignment import (
+    AM_COLUMNS,
+    PM_COLUMNS,
+    get_previous_assignment,
+    repair_assignment,
+)
+from src.instrumentation import reporting, timer
+from src.local_sheet import LocalWorksheet
+from src.metrics import get_assignment_metrics
+from src.optimal_assignment import OBSERVER_COLUMNS, optimise_all
+from src.output import OUTPUT_DIR, write_outputs
+from urllib.parse import unquote
+
+logger = logging.getLogger(__name__)
+
+HOST = "127.0.0.1"
+PORT = 8020
+
+# the availability an observer needs for each precinct observer column
+COLUMN_AVAILABILITY = {
+    "inside_observer": "inside_all_day",
+    "outside_am_observer": "outside_AM",
+    "outside_pm_observer": "outside_PM",
+}
+
+
+def to_records(df):
+    """
+    A dataframe as a list of JSON-ready dicts
+    """
+
+    return json.loads(df.to_json(orient="records", date_format="iso"))
+
+
+class AssignmentState:
+    """
+    The cleaned observers and the current assignment, kept in memory between
+    requests. Each change only refills the slots it vacates, see
+    `repair_assignment`, so observers elsewhere keep their precinct.
+
+    Parameters
+    ----------
+    precinct: pd.DataFrame
+        The assigned precincts
+    observers: pd.DataFrame
+        The observers, as returned by `run_ordered_assignment`
+    config: Config
+        The loaded config. See `src.config.load_config`
+    """
+
+    def __init__(self, precinct, observers, config):
+        self.precinct = precinct
+        self.observers = observers
+        self.config = config
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return (
+            f"AssignmentState({len(self.precinct)} precincts, "
+            f"{len(self.observers)} observers)"
+        )
+
+    @classmethod
+    def load(cls, config, mode="refresh", worksheet=None, resume=False):
+        """
+        Loads the observers and precincts and assigns them
+
+        Parameters
+        ----------
+        config: Config
+            The loaded config
+        mode: string, optional
+            How to load the observers, see `get_observer_dataset`. The
+            county's `observer_export` is used in "export" mode
+        worksheet: LocalWorksheet, optional
+            Read the responses from this instead of the google sheet
+        resume: bool, optional
+            Start from the precincts saved in OUTPUT_DIR by a previous run
+            instead of assigning from scratch
+        """
+
+        observers = ba.get_observer_dataset(
+            config, mode, export_path=config.observer_export, worksheet=worksheet
+        )
+
+        if resume:
+            precinct = get_previous_assignment(
+                OUTPUT_DIR / f"assigned_precincts.{config.export['format']}"
+            )
+            precinct, observers, _ = repair_assignment(
+                precinct, observers, config=config
+            )
+        else:
+            precinct = ba.get_precinct_dataset(config.precinct_file)
+            precinct, observers = ba.run_ordered_assignment(
+                precinct, observers, config
+            )
+            precinct, observers = optimise_all(precinct, observers, config)
+
+        return cls(precinct, observers, config)
+
+    def repair(self, removed=(), exclude=()):
+        """
+        Refills the vacated slots and returns the mask of precincts that
+        changed
+        """
+
+        self.precinct, self.observers, changed = repair_assignment(
+            self.precinct,
+            self.observers,
+            removed,
+            self.config,
+            exclude=exclude,
+            check_roster=False,
+        )
+
+        return changed
+
+    def get_observer(self, name):
+        observer = self.observers[self.observers["name"] == name]
+        if len(observer) == 0:
+            raise KeyError(f"Unknown observer: {name}")
+
+        return observer.iloc[0]
+
+    def add_observer(self, response):
+        """
+        Adds a form response and gives the new observer a slot if one is free
+
+        Parameters
+        ----------
+        response: dict
+            Column of `columns_map` -> value, as entered on the form. Missing
+            columns get their "fill_missing" value
+
+        Returns
+        -------
+        pd.DataFrame
+            The precincts that changed
+        """
+
+        columns_map = self.config.columns_map
+        responses = pd.DataFrame(
+            [
+                {
+                    column: response.get(column, params["fill_missing"])
+                    for column, params in columns_map.items()
+                }
+            ],
+            dtype=object,
+        )
+        observer, rejects = ba.clean_responses(responses, self.config)
+        if len(rejects) > 0:
+            raise ValueError(f"Invalid {rejects['reject_reason'].iloc[0]}")
+        if len(observer) == 0:
+            raise ValueError("Response has no name or is a rover")
+        if observer["name"].iloc[0] in self.observers["name"].values:
+            raise ValueError(f"Observer already exists: {observer['name'].iloc[0]}")
+
+        self.observers = pd.concat([self.observers, observer], ignore_index=True)
+
+        return self.precinct[self.repair()]
+
+    def remove_observer(self, name):
+        """
+        Drops an observer and refills their slots
+
+        Returns
+        -------
+        pd.DataFrame
+            The precincts that changed
+        """
+
+        self.get_observer(name)
+
+        return self.precinct[self.repair(removed=[name])]
+
+    def reassign_precinct(self, pct, column, name=None):
+        """
+        Changes the observer in one slot of a precinct
+
+        Parameters
+        ----------
+        pct: string
+            The precinct's "Pct"
+        column: string
+            One of OBSERVER_COLUMNS
+        name: string, optional
+            The observer to put in the slot. They are taken off any slot with
+            the same shift. If None, the slot is refilled with someone other
+            than its current observer.
+
+        Returns
+        -------
+        pd.DataFrame
+            The precincts that changed
+        """
+
+        if column not in OBSERVER_COLUMNS:
+            raise ValueError(f"Unknown observer column: {column}")
+        row = np.flatnonzero(self.precinct["Pct"].astype(str).values == str(pct))
+        if len(row) == 0:
+            raise KeyError(f"Unknown precinct: {pct}")
+
+        precinct = self.precinct.copy()
+        previous = precinct[column].values[row[0]]
+        exclude = [previous] if previous != "" else []
+
+        if name is None:
+            precinct.iloc[row[0], precinct.columns.get_loc(column)] = ""
+        else:
+            observer = self.get_observer(name)
+            if not observer[COLUMN_AVAILABILITY[column]]:
+                raise ValueError(f"{name} is not available for {column}")
+
+            shift_columns = {
+                "inside_observer": AM_COLUMNS + PM_COLUMNS,
+                "outside_am_observer": AM_COLUMNS,
+                "outside_pm_observer": PM_COLUMNS,
+            }[column]
+            for shift_column in dict.fromkeys(shift_columns):
+                precinct[shift_column] = np.where(
+                    precinct[shift_column].values == name,
+                    "",
+                    precinct[shift_column].values,
+                )
+            precinct.iloc[row[0], precinct.columns.get_loc(column)] = name
+            precinct.iloc[
+                row[0], precinct.columns.get_loc(column.replace("_observer", "_legal"))
+            ] = bool(observer["legal_background"])
+            exclude = []
+
+        self.precinct = precinct
+        changed = self.repair(exclude=exclude)
+        # the slot itself is not a change to the repair
+        changed |= self.precinct["Pct"].astype(str).values == str(pct)
+
+        return self.precinct[changed]
+
+    def export(self, **options):
+        """
+        Writes the current assignment and the LBJ output to OUTPUT_DIR
+
+        Parameters
+        ----------
+        **options:
+            Override the `export` settings, e.g. format="csv"
+
+        Returns
+        -------
+        list of Path
+            The files written
+        """
+
+        lbj_output = ba.get_lbj_csv(self.precinct, self.observers, self.config)
+
+        return write_outputs(
+            {
+                "assigned_precincts": self.precinct,
+                "assigned_observers": self.observers,
+                "lbj_output": lbj_output,
+            },
+            **{**self.config.export, **options},
+        )
+
+    def metrics(self):
+        return get_assignment_metrics(
+            self.precinct, self.observers, self.config.optimiser["distance"]
+        )
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    """
+    Routes JSON requests to the server's AssignmentState:
+
+        GET    /precincts                       the current assignment
+        GET    /metrics                         see `get_assignment_metrics`
+        POST   /observers                       add a form response
+        DELETE /observers/<name>                remove an observer
+        POST   /precincts/<pct>/<column>        {"observer": name or null}
+        POST   /export                          {"format": ...}, optional
+    """
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+
+        return json.loads(self.rfile.read(length)) if length else {}
+
+    def route(self, method):
+        state = self.server.state
+        parts = [unquote(part) for part in self.path.strip("/").split("/")]
+
+        if method == "GET" and parts == ["precincts"]:
+            return to_records(state.precinct)
+        if method == "GET" and parts == ["metrics"]:
+            return state.metrics()
+        if method == "POST" and parts == ["observers"]:
+            return to_records(state.add_observer(self.read_json()))
+        if method == "DELETE" and len(parts) == 2 and parts[0] == "observers":
+            return to_records(state.remove_observer(parts[1]))
+        if method == "POST" and len(parts) == 3 and parts[0] == "precincts":
+            name = self.read_json().get("observer")
+            return to_records(state.reassign_precinct(parts[1], parts[2], name))
+        if method == "POST" and parts == ["export"]:
+            return [str(path) for path in state.export(**self.read_json())]
+
+        raise LookupError(f"No route for {method} {self.path}")
+
+    def handle_request(self, method):
+        state = self.server.state
+        try:
+            with state.lock, timer(f"service.{method.lower()}"):
+                body = self.route(method)
+        except LookupError as error:
+            # KeyError is a LookupError, unknown observers and precincts are a 404
+            self.send_json(404, {"error": str(error).strip("'")})
+        except (ValueError, TypeError) as error:
+            self.send_json(400, {"error": str(error)})
+        else:
+            self.send_json(200, body)
+
+    def do_GET(self):
+        self.handle_request("GET")
+
+    def do_POST(self):
+        self.handle_request("POST")
+
+    def do_DELETE(self):
+        self.handle_request("DELETE")
+
+
+def serve(state, host=HOST, port=PORT):
+    """
+    Answers requests against `state` until interrupted
+    """
+
+    server = ThreadingHTTPServer((host, port), ServiceHandler)
+    server.state = state
+    logger.info("Serving %r on http://%s:%d", state, host, port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def main(args=None):
+    """
+    Loads and assigns the observers and serves the assignment until
+    interrupted
+    """
+
+    parser = add_config_arguments(
+        argparse.ArgumentParser(description="Serve the assignment over HTTP")
+    )
+    parser.add_argument(
+        "--sheet", help="read the responses from this file instead of google sheets"
+    )
+    parser.add_argument("--resume", action="store_true")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    args = parser.parse_args(args)
+
+    config = load_run_config(args)
+    with reporting("service", config, OUTPUT_DIR):
+        worksheet = LocalWorksheet(args.sheet) if args.sheet else None
+        state = AssignmentState.load(config, args.mode, worksheet, args.resume)
+        serve(state, args.host, args.port)
+
+
+if __name__ == "__main__":
+    main()
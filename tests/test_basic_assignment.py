@@ -0,0 +1,278 @@
+import dataclasses
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks.synthetic import make_precincts, make_responses
+from src.basic_assignment import (
+    ASSIGNMENT_ORDER,
+    clean_observer_df,
+    load_county_observers,
+    prepare_observer_dataset,
+    read_observer_export,
+    refresh_observer_snapshot,
+    run_ordered_assignment,
+)
+from src.cache import load_snapshot
+from src.config import load_config
+from src.instrumentation import collect_report
+from src.local_sheet import LocalWorksheet
+
+
+def get_responses(rows):
+    columns = ["date_entered", "name", "email", "post_code", "election_day"]
+    responses = pd.DataFrame(rows, columns=columns)
+    responses["phone_number"] = "919-555-0100"
+    responses["legal_background"] = "No"
+    responses["comments"] = ""
+    responses["is_rover"] = "0"
+    responses["ev_2020_experience"] = "0"
+    return responses
+
+
+def test_read_observer_export_does_not_depend_on_chunksize(tmp_path):
+    # A answered on 10/9 and again on 10/10, which sorts first as text. C
+    # changed name but not email, and D's row has no date so is the oldest
+    responses = get_responses(
+        [
+            ["10/10/2020 09:00:00", "A", "a@x.org", "27610", "Inside"],
+            ["10/9/2020 09:00:00", "A", "a@x.org", "27601", "Inside"],
+            ["10/1/2020 09:00:00", "B", "b@x.org", "27601", "Outside AM"],
+            ["10/2/2020 09:00:00", "C", "c@x.org", "27603", "Outside PM"],
+            ["10/11/2020 09:00:00", "Cee", "c@x.org", "27604", "Outside PM"],
+            ["10/3/2020 09:00:00", "D", "d@x.org", "27605", "Inside"],
+            [None, "D", "d@x.org", "27606", "Inside"],
+            ["10/4/2020 09:00:00", "E", "e@x.org", "not a zip", "Inside"],
+        ]
+    )
+    path = tmp_path / "responses.csv"
+    responses.to_csv(path, index=False)
+
+    config = load_config()
+    expected = read_observer_export(path, config, chunksize=len(responses))
+    for chunksize in [1, 2]:
+        pd.testing.assert_frame_equal(
+            read_observer_export(path, config, chunksize=chunksize), expected
+        )
+
+    post_code = expected.set_index("name")["post_code"]
+    assert sorted(post_code.index) == ["A", "B", "Cee", "D"]
+    assert post_code["A"] == 27610
+    assert post_code["D"] == 27605
+
+
+@pytest.mark.parametrize("chunksize", [1, 3])
+def test_read_observer_export_keeps_file_order_on_ties(tmp_path, chunksize):
+    responses = get_responses(
+        [
+            ["10/9/2020 09:00:00", "A", "a@x.org", "27601", "Inside"],
+            ["10/9/2020 09:00:00", "A", "a@x.org", "27610", "Inside"],
+            ["10/9/2020 09:00:00", "A", "a@x.org", "27603", "Inside"],
+        ]
+    )
+    path = tmp_path / "responses.csv"
+    responses.to_csv(path, index=False)
+
+    observers = read_observer_export(path, load_config(), chunksize=chunksize)
+
+    assert list(observers["post_code"]) == [27603]
+
+
+def test_export_load_records_each_stage_once(tmp_path):
+    responses = get_responses(
+        [["10/9/2020 09:00:00", "A", "a@x.org", "27601", "Inside"]]
+    )
+    path = tmp_path / "responses.csv"
+    responses.to_csv(path, index=False)
+    config = dataclasses.replace(load_config(), observer_export=path)
+
+    with collect_report() as report:
+        load_county_observers(config)
+
+    assert sorted(report.stages) == ["load_observers", "read_export"]
+
+
+def run_reference_assignment(precinct, observers, config):
+    # the loop that run_ordered_assignment replaced, which writes each tier
+    # into the frames through .loc and merges back the observers' locations
+    precinct = precinct.copy()
+    observers = observers.copy()
+    observers[["assigned_am", "assigned_pm"]] = observers[
+        ["assigned_am", "assigned_pm"]
+    ].astype(object)
+
+    for location, is_attorney in ASSIGNMENT_ORDER:
+        params = config.locations[location]
+        availability = params["observer_availability"]
+        columns = list(params["precinct_observer"])
+        assignment_columns = {
+            "outside_AM": ["assigned_am"],
+            "outside_PM": ["assigned_pm"],
+        }.get(availability, ["assigned_pm", "assigned_am"])
+
+        missing = (precinct[columns] == "").all(axis=1)
+        available = (
+            observers[availability]
+            & (observers["legal_background"] == is_attorney)
+            & observers[assignment_columns].isna().all(axis=1)
+        )
+        if params["from_county"]:
+            available &= observers["from_county"]
+
+        # every available observer is marked as taken, even if not placed
+        names = observers.loc[available, "name"].values[: missing.sum()]
+        names = np.pad(names, (0, missing.sum() - len(names)), constant_values="")
+        observers.loc[available, assignment_columns] = True
+
+        for column in columns:
+            precinct.loc[missing, column] = names
+        legal_columns = list(np.atleast_1d(params["precinct_is_legal"]))
+        precinct.loc[missing, legal_columns] = is_attorney
+
+        located = observers.merge(
+            precinct[[columns[0], "Polling Place Name"]],
+            left_on="name",
+            right_on=columns[0],
+            how="left",
+        )
+        observers[params["observer_loc"]] = located["Polling Place Name"].values
+
+    return precinct, observers
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_run_ordered_assignment_matches_reference(seed):
+    config = load_config()
+    responses = make_responses(400, config.valid_post_codes, seed)
+    precinct = make_precincts(150, config.valid_post_codes, seed)
+    observers = prepare_observer_dataset(responses, config)
+    # some slots are already filled, by known and unknown observers
+    precinct.loc[precinct.index[:3], "inside_observer"] = observers["name"].values[:3]
+    precinct.loc[precinct.index[3], "outside_am_observer"] = "Someone Else"
+    inputs = precinct.copy(), observers.copy()
+
+    assigned_precinct, assigned_observers = run_ordered_assignment(
+        precinct, observers, config
+    )
+    expected_precinct, expected_observers = run_reference_assignment(
+        precinct, observers, config
+    )
+
+    pd.testing.assert_frame_equal(
+        assigned_precinct, expected_precinct, check_dtype=False
+    )
+    pd.testing.assert_frame_equal(
+        assigned_observers, expected_observers, check_dtype=False
+    )
+    # the inputs are not modified
+    pd.testing.assert_frame_equal(precinct, inputs[0])
+    pd.testing.assert_frame_equal(observers, inputs[1])
+
+
+class RecordingWorksheet(LocalWorksheet):
+    # remembers the ranges of every request
+    def __init__(self, responses):
+        super().__init__(responses)
+        self.requests = []
+
+    def batch_get(self, ranges, major_dimension="COLUMNS"):
+        self.requests.append(ranges)
+        return super().batch_get(ranges, major_dimension)
+
+
+SNAPSHOT_COLUMNS = {
+    "date_entered": {"col_num": 1, "fill_missing": None},
+    "email": {"col_num": 2, "fill_missing": None},
+    "name": {"col_num": 3, "fill_missing": None},
+}
+
+
+def get_worksheet():
+    return RecordingWorksheet(
+        pd.DataFrame(
+            {
+                "Timestamp": ["10/1/2020 09:00:00", "10/2/2020 09:00:00"],
+                "Email": ["a@x.org", "b@x.org"],
+                "Name": ["A", "B"],
+            }
+        )
+    )
+
+
+def refresh(worksheet, path):
+    return refresh_observer_snapshot(worksheet, SNAPSHOT_COLUMNS, path)
+
+
+def test_refresh_without_changes_only_fetches_the_keys(tmp_path):
+    pytest.importorskip("pyarrow")
+    path = tmp_path / "responses.parquet"
+    worksheet = get_worksheet()
+    first = refresh(worksheet, path)
+
+    again = refresh(worksheet, path)
+
+    pd.testing.assert_frame_equal(again, first)
+    assert list(first["name"]) == ["A", "B"]
+    # the first refresh fetches every column, later ones only the key columns
+    assert worksheet.requests == [["A2:A3", "B2:B3", "C2:C3"], ["A2:A3", "B2:B3"]]
+
+
+def test_refresh_fetches_only_appended_rows(tmp_path):
+    pytest.importorskip("pyarrow")
+    path = tmp_path / "responses.parquet"
+    worksheet = get_worksheet()
+    refresh(worksheet, path)
+
+    worksheet.append_row(["10/3/2020 09:00:00", "c@x.org", "C"])
+    responses = refresh(worksheet, path)
+
+    assert list(responses["name"]) == ["A", "B", "C"]
+    assert worksheet.requests[-1] == ["A2:A4", "B2:B4", "A4:A4", "B4:B4", "C4:C4"]
+    pd.testing.assert_frame_equal(load_snapshot(path)[0], responses)
+
+
+@pytest.mark.parametrize("change", ["delete", "resubmit", "older"])
+def test_refresh_fetches_everything_if_saved_rows_changed(tmp_path, change):
+    pytest.importorskip("pyarrow")
+    path = tmp_path / "responses.parquet"
+    worksheet = get_worksheet()
+    refresh(worksheet, path)
+
+    if change == "delete":
+        del worksheet.rows[0]
+    elif change == "resubmit":
+        worksheet.rows[0][0] = "10/5/2020 09:00:00"
+    else:
+        worksheet.append_row(["9/30/2020 09:00:00", "c@x.org", "C"])
+    responses = refresh(worksheet, path)
+
+    expected = pd.DataFrame(worksheet.rows, columns=list(SNAPSHOT_COLUMNS))
+    pd.testing.assert_frame_equal(responses, expected, check_dtype=False)
+    n_rows = worksheet.row_count
+    assert worksheet.requests[-1] == [f"{column}2:{column}{n_rows}" for column in "ABC"]
+
+
+def test_clean_observer_df_reports_invalid_post_codes():
+    observers = get_responses(
+        [
+            ["10/1/2020 09:00:00", "A ", "A@X.org", "27601-1234", "Inside"],
+            ["10/1/2020 09:00:00", "B", "b@x.org", " 27610 ", "Outside AM"],
+            ["10/1/2020 09:00:00", "C", "c@x.org", "not a zip", "Inside"],
+            ["10/1/2020 09:00:00", "D", "d@x.org", "", "Inside"],
+            ["10/1/2020 09:00:00", "E", "e@x.org", "12345", "Inside"],
+            ["10/1/2020 09:00:00", None, "f@x.org", "27601", "Inside"],
+        ]
+    )
+    observers["phone_number"] = ["(919) 555-0100", None, "", "", "", ""]
+    observers.loc[4, "is_rover"] = "1"
+
+    cleaned, rejects = clean_observer_df(observers, load_config(), return_rejects=True)
+
+    assert list(cleaned["name"]) == ["A", "B"]
+    assert list(cleaned["email"]) == ["a@x.org", "b@x.org"]
+    assert list(cleaned["post_code"]) == [27601, 27610]
+    assert cleaned["post_code"].dtype == "int32"
+    assert list(cleaned["phone_number"]) == ["9195550100", ""]
+    # the rover and the row without a name are dropped, not rejected
+    assert list(rejects["name"]) == ["C", "D"]
+    assert list(rejects["reject_reason"]) == ["post_code", "post_code"]
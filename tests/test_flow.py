@@ -0,0 +1,111 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.config import load_config
+from src.flow import MAX_EXACT_COST, get_flow_rewards, optimise_flow
+from src.optimal_assignment import OBSERVER_COLUMNS
+
+
+def get_observers(rows):
+    columns = ["name", "post_code", "inside_all_day", "outside_AM", "outside_PM"]
+    observers = pd.DataFrame(rows, columns=columns)
+    observers["outside_all_day"] = False
+    observers["legal_background"] = False
+    observers["from_county"] = True
+    observers["assigned_am"] = None
+    observers["assigned_pm"] = None
+    return observers
+
+
+def test_cold_weighted_fills_as_many_slots_as_warm():
+    pytest.importorskip("scipy")
+
+    # everyone lives in the same two zip codes, so without spreading them out
+    # they would all want the same two closest precincts
+    precinct = pd.DataFrame(
+        {
+            "Pct": [f"P{i}" for i in range(6)],
+            "Polling Place Name": [f"Place {i}" for i in range(6)],
+            "Zip": [27601, 27602, 27603, 27604, 27605, 27610],
+            "Priority": [1, 2, 3, 4, 5, 6],
+            "inside_observer": ["A", "B", "C", "D", "E", "F"],
+            "inside_legal": [False] * 6,
+            "outside_am_observer": ["G", "H", "I", "", "", ""],
+            "outside_am_legal": [False] * 6,
+            "outside_pm_observer": ["", "", "", "J", "K", "L"],
+            "outside_pm_legal": [False] * 6,
+        }
+    )
+    observers = get_observers(
+        [
+            [name, 27601 if i % 2 else 27610, inside, am, pm]
+            for names, inside, am, pm in [
+                ("ABCDEF", True, False, False),
+                ("GHI", False, True, False),
+                ("JKL", False, False, True),
+            ]
+            for i, name in enumerate(names)
+        ]
+    )
+
+    config = load_config()
+    options = {"method": "weighted", "locations": config.locations, "n_candidates": 2}
+    warm = optimise_flow(precinct, observers, objective=config.objective, **options)
+    cold = optimise_flow(
+        precinct,
+        observers,
+        objective={**config.objective, "warm_start": False},
+        **options,
+    )
+
+    filled = (warm[OBSERVER_COLUMNS] != "").values.sum()
+    assert filled == 12
+    assert (cold[OBSERVER_COLUMNS] != "").values.sum() >= filled
+
+
+def test_flow_rewards_stay_exact_on_large_inputs():
+    slots = {"weight": np.array([2, 1, 1]), "tier": np.array([0, 0, 1])}
+    n_units = 100_000
+    edge_unit = np.repeat(np.arange(n_units), 3)
+    edge_cost = np.tile([0, 10 ** 9, 7], n_units)
+
+    cost, reward, scale = get_flow_rewards(slots, edge_unit, edge_cost, n_units)
+
+    assert scale > 1
+    max_weight = reward.max() + cost.max() + 1
+    assert n_units * max_weight < MAX_EXACT_COST
+    # one more tier still outweighs the costs of every unit together
+    span = n_units * cost.max() + 1
+    assert reward[0] - reward[1] >= span
+    assert reward[1] - reward[2] >= span
+
+    # small inputs are not rounded
+    cost, _, scale = get_flow_rewards(slots, edge_unit[:3], edge_cost[:3], 1)
+    assert scale == 1
+    assert list(cost) == [0, 10 ** 9, 7]
+
+
+def test_flow_breaks_priority_ties_on_distance():
+    pytest.importorskip("scipy")
+
+    # both precincts have the same priority so A moves to the one next door
+    precinct = pd.DataFrame(
+        {
+            "Pct": ["P0", "P1"],
+            "Polling Place Name": ["Place 0", "Place 1"],
+            "Zip": [27601, 27610],
+            "Priority": [1, 1],
+            "inside_observer": ["A", ""],
+            "inside_legal": [False, False],
+            "outside_am_observer": ["", ""],
+            "outside_am_legal": [False, False],
+            "outside_pm_observer": ["", ""],
+            "outside_pm_legal": [False, False],
+        }
+    )
+    observers = get_observers([["A", 27610, True, False, False]])
+
+    optimised = optimise_flow(precinct, observers, locations=load_config().locations)
+
+    assert list(optimised["inside_observer"]) == ["", "A"]
@@ -0,0 +1,53 @@
+import pandas as pd
+
+from src.config import load_config
+from src.incremental_assignment import repair_assignment
+from src.optimal_assignment import OBSERVER_COLUMNS
+
+
+def get_observers(rows):
+    columns = ["name", "post_code", "inside_all_day", "outside_AM"]
+    observers = pd.DataFrame(rows, columns=columns)
+    observers["outside_PM"] = False
+    observers["outside_all_day"] = False
+    observers["legal_background"] = False
+    observers["from_county"] = True
+    observers["assigned_am"] = None
+    observers["assigned_pm"] = None
+    return observers
+
+
+def test_repair_keeps_unchanged_slots():
+    # A and B dropped out of the inside slots. G and I would both rather be at
+    # the other precinct, but their AM slots did not change so they stay put
+    precinct = pd.DataFrame(
+        {
+            "Pct": ["P1", "P2"],
+            "Polling Place Name": ["Place 1", "Place 2"],
+            "Zip": [27601, 27610],
+            "Priority": [1, 2],
+            "inside_observer": ["A", "B"],
+            "inside_legal": [False, False],
+            "outside_am_observer": ["G", "I"],
+            "outside_am_legal": [False, False],
+            "outside_pm_observer": ["", ""],
+            "outside_pm_legal": [False, False],
+        }
+    )
+    observers = get_observers(
+        [
+            ["F", 27610, True, False],
+            ["H", 27601, True, False],
+            ["G", 27610, False, True],
+            ["I", 27601, False, True],
+        ]
+    )
+
+    repaired, _, changed = repair_assignment(precinct, observers, config=load_config())
+
+    assert sorted(repaired["inside_observer"]) == ["F", "H"]
+    assert list(changed) == [True, True]
+
+    # only the inside slots were vacated, every other slot keeps its observer
+    unchanged = OBSERVER_COLUMNS[1:]
+    assert (repaired[unchanged].values == precinct[unchanged].values).all()
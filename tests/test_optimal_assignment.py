@@ -0,0 +1,167 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks.synthetic import make_precincts, make_responses
+from src.basic_assignment import prepare_observer_dataset, run_ordered_assignment
+from src.candidates import CandidateGraph
+from src.config import load_config
+from src.distance import ZipCodeDistance
+from src.metrics import get_assignment_metrics
+from src.optimal_assignment import (
+    get_matched_sets,
+    get_matched_sets_array,
+    get_matched_sets_candidates,
+    optimise_assignment,
+    optimise_buckets,
+)
+
+
+def get_reference_matching(distance):
+    # top trading cycles resolving one cycle at a time, as the networkx engine
+    # did. Observer i owns location i and ties go to the first location
+    matched = np.full(len(distance), -1)
+    free = list(range(len(distance)))
+    while free:
+        preference = {
+            observer: min(
+                free, key=lambda location: (distance[observer][location], location)
+            )
+            for observer in free
+        }
+        path = [free[0]]
+        while preference[path[-1]] not in path:
+            path.append(preference[path[-1]])
+        for observer in path[path.index(preference[path[-1]]) :]:
+            matched[observer] = preference[observer]
+        free = [observer for observer in free if matched[observer] < 0]
+
+    return matched
+
+
+def get_random_zips(rng, n):
+    # few distinct zip codes so there are plenty of ties
+    return 27600 + rng.integers(0, 15, size=n), 27600 + rng.integers(0, 15, size=n)
+
+
+# 0, 1 and 2 swap round in a cycle. 3 wants 0, 1 and 2 but they are taken so
+# keeps 3. 4 likes every location the same so points at 3 first, the first
+# location still free, and then keeps 4
+DISTANCE = np.array(
+    [
+        [3, 1, 2, 9, 9],
+        [3, 2, 1, 9, 9],
+        [1, 2, 3, 9, 9],
+        [1, 2, 3, 4, 9],
+        [0, 0, 0, 0, 0],
+    ]
+)
+MATCHED = [1, 2, 0, 3, 4]
+
+
+def test_ttc_matches_hand_checked_preferences():
+    assert list(get_reference_matching(DISTANCE)) == MATCHED
+    assert list(get_matched_sets_array(DISTANCE)) == MATCHED
+
+    names = np.array([f"O{i}" for i in range(len(DISTANCE))])
+    locations = np.array([f"L{i}" for i in range(len(DISTANCE))])
+    distance_df = pd.DataFrame(DISTANCE, index=names, columns=locations)
+    merged_df = pd.DataFrame(
+        {"Polling Place Name": locations, "inside_observer": names}
+    )
+    matched_set = get_matched_sets(distance_df, merged_df, "inside_observer")
+
+    assert matched_set == dict(zip(names, locations[MATCHED]))
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_ttc_engines_match_reference(seed):
+    pytest.importorskip("scipy")
+
+    rng = np.random.default_rng(seed)
+    observer_zip, precinct_zip = get_random_zips(rng, rng.integers(1, 40))
+    distance = ZipCodeDistance()(observer_zip, precinct_zip)
+    expected = get_reference_matching(distance)
+
+    np.testing.assert_array_equal(get_matched_sets_array(distance), expected)
+    candidates = CandidateGraph(observer_zip, precinct_zip, 2)
+    np.testing.assert_array_equal(get_matched_sets_candidates(candidates), expected)
+
+
+def test_networkx_method_is_a_deprecated_alias_of_ttc():
+    precinct = pd.DataFrame(
+        {
+            "Polling Place Name": ["L0", "L1", "L2"],
+            "Zip": [27601, 27605, 27610],
+            "inside_observer": ["A", "B", "C"],
+        }
+    )
+    observers = pd.DataFrame(
+        {"name": ["A", "B", "C"], "post_code": [27610, 27601, 27605]}
+    )
+
+    expected = optimise_assignment(precinct, observers, "inside_observer")
+    with pytest.warns(DeprecationWarning):
+        matched = optimise_assignment(
+            precinct, observers, "inside_observer", method="networkx"
+        )
+
+    assert list(expected) == ["B", "C", "A"]
+    assert list(matched) == list(expected)
+
+
+def get_basic_assignment(n_observers, seed):
+    config = load_config()
+    responses = make_responses(n_observers, config.valid_post_codes, seed)
+    precinct = make_precincts(n_observers // 2, config.valid_post_codes, seed)
+    observers = prepare_observer_dataset(responses, config)
+
+    return run_ordered_assignment(precinct, observers, config)
+
+
+def check_assignment(optimised, precinct, observers):
+    observer = observers.set_index("name")
+    for column, availability in [
+        ("inside_observer", "inside_all_day"),
+        ("outside_am_observer", "outside_AM"),
+        ("outside_pm_observer", "outside_PM"),
+    ]:
+        names = optimised[column].values
+        filled = names != ""
+        # the same slots are filled, each by a different observer
+        assert (filled == (precinct[column].values != "")).all()
+        assert len(set(names[filled])) == filled.sum()
+        assert observer.loc[names[filled], availability].all()
+
+        legal = optimised[column.replace("_observer", "_legal")].values[filled]
+        assert (observer.loc[names[filled], "legal_background"].values == legal).all()
+
+    inside = set(optimised["inside_observer"]) - {""}
+    outside = set(optimised["outside_am_observer"]) | set(
+        optimised["outside_pm_observer"]
+    )
+    assert not inside & outside
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_hungarian_keeps_constraints_and_beats_ttc(seed):
+    pytest.importorskip("scipy")
+
+    precinct, observers = get_basic_assignment(300, seed)
+    options = {"n_workers": 1}
+    ttc = optimise_buckets(precinct, observers, method="ttc", **options)
+    hungarian = optimise_buckets(precinct, observers, method="hungarian", **options)
+    sparse = optimise_buckets(
+        precinct, observers, method="hungarian", n_candidates=3, **options
+    )
+
+    for optimised in [ttc, hungarian, sparse]:
+        check_assignment(optimised, precinct, observers)
+
+    def total(optimised):
+        metrics = get_assignment_metrics(optimised, observers)
+        return metrics["distance"]["all"]["total"]
+
+    assert total(hungarian) <= total(ttc)
+    assert total(hungarian) <= total(sparse)
+    assert total(ttc) <= total(precinct)